@@ -6,68 +6,226 @@ and specialized display and filtering options.
 """
 
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.core.exceptions import PermissionDenied
+from django.db.models import Q
+from django.http import Http404
+from django.shortcuts import redirect
+from django.urls import path, reverse
 from django.utils.html import format_html
-from .models import TimeCapsule, CapsuleContent
+from django.utils.text import capfirst
+from .deletion import delete_capsule
+from .delivery import delivery_url
+from .models import TimeCapsule, CapsuleContent, ContentBlob
+from .pagination import EstimatedCountPaginator
+from .search import matches, search
 
-# Register your models here.
+# Capsules with more contents than this are not edited inline; the capsule
+# page links to the filtered content changelist instead
+INLINE_MAX_CONTENTS = 50
+
+class IndexedSearchChangeList(ChangeList):
+    """Lists search results best match first unless a column is sorted."""
+    
+    def get_ordering(self, request, queryset):
+        if self.query and ORDER_VAR not in self.params:
+            return ['-search_rank', '-pk']
+        return super().get_ordering(request, queryset)
+
+class IndexedSearchMixin:
+    """Answers the changelist search box from the full-text index.
+    
+    Replaces the ``icontains`` scans of ``search_fields`` with
+    capsules.search; ``search_fields`` only enables the search box. Lookups
+    on related rows, which the index does not cover, come from
+    get_related_matches().
+    """
+    
+    def get_related_matches(self, search_term):
+        """Q of rows matched through related models, listed after the rest."""
+        return None
+    
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        also = self.get_related_matches(search_term)
+        return search(queryset, search_term, also=also), False
+    
+    def get_changelist(self, request, **kwargs):
+        return IndexedSearchChangeList
 
 class CapsuleContentInline(admin.TabularInline):
     """Inline admin interface for CapsuleContent.
     
     Allows managing capsule content directly from the TimeCapsule admin page.
+    Only used for capsules with at most INLINE_MAX_CONTENTS items.
     """
     model = CapsuleContent
     extra = 1
+    show_change_link = True
+    exclude = ('blob',)
 
 @admin.register(CapsuleContent)
-class CapsuleContentAdmin(admin.ModelAdmin):
+class CapsuleContentAdmin(IndexedSearchMixin, admin.ModelAdmin):
     """Admin interface for CapsuleContent model.
     
     Provides standalone management of capsule content with:
     - List display configuration
-    - Search and filter options
+    - Full-text search (capsules.search) and filter options
     """
-    list_display = ('title', 'capsule', 'content_type', 'uploaded_at', 'view_file')
-    list_filter = ('content_type', 'uploaded_at')
-    search_fields = ('title', 'capsule__title')
-    readonly_fields = ('uploaded_at',)
+    list_display = ('title', 'capsule', 'content_type', 'upload_status', 'uploaded_at', 'view_file')
+    list_filter = ('content_type', 'upload_status', 'uploaded_at')
+    list_select_related = ('capsule',)
+    search_fields = ('title', 'description', 'capsule__title')
+    readonly_fields = ('uploaded_at', 'upload_status', 'upload_error', 'blob')
+    autocomplete_fields = ('capsule',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_related_matches(self, search_term):
+        """Contents of capsules whose title matches, through the capsule index."""
+        titles = matches(TimeCapsule, search_term, fields=('title',))
+        return None if titles is None else Q(capsule__in=TimeCapsule.objects.filter(titles))
+    
+    def get_urls(self):
+        """Add the admin's own file view in front of the default URLs."""
+        info = self.opts.app_label, self.opts.model_name
+        return [
+            path(
+                '<path:object_id>/file/',
+                self.admin_site.admin_view(self.file_view),
+                name='%s_%s_file' % info,
+            ),
+        ] + super().get_urls()
+    
+    def file_view(self, request, object_id):
+        """Redirect to a signed delivery URL of a content's file.
+        
+        Unlike serve_protected_file, this view serves any capsule's files,
+        locked ones included, but only to staff with the view or change
+        permission on capsule contents.
+        """
+        content = self.get_object(request, object_id)
+        if content is None or not content.storage_key:
+            raise Http404("This content has no file.")
+        if not self.has_view_permission(request, content):
+            raise PermissionDenied
+        return redirect(delivery_url(content.storage_ref))
     
     def view_file(self, obj):
         """Displays a link to view the uploaded file.
         
         If a file is associated with the CapsuleContent instance, returns an HTML
-        link to view the file. Otherwise, returns a message indicating no file.
+        link to the admin's file view, which avoids building the storage URL
+        for every row. Otherwise, returns a message indicating no file.
         """
-        if obj.file:
-            return format_html('<a href="{}" target="_blank">View File</a>', obj.file.url)
+        if obj.storage_key:
+            url = reverse('admin:capsules_capsulecontent_file', args=[obj.pk])
+            return format_html('<a href="{}" target="_blank">View File</a>', url)
         return "No file"
     view_file.short_description = 'File'
 
+@admin.register(ContentBlob)
+class ContentBlobAdmin(admin.ModelAdmin):
+    """Read-only admin interface for ContentBlob model.
+    
+    Blobs are created and freed by uploads and deletions only; the admin
+    shows how often each stored file is shared.
+    """
+    list_display = ('digest', 'size', 'storage_backend', 'ref_count', 'created_at')
+    list_filter = ('storage_backend',)
+    search_fields = ('digest',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 @admin.register(TimeCapsule)
-class TimeCapsuleAdmin(admin.ModelAdmin):
+class TimeCapsuleAdmin(IndexedSearchMixin, admin.ModelAdmin):
     """Admin interface for TimeCapsule model.
     
     Customizes the admin interface with:
     - List display configuration
-    - Search functionality
+    - Full-text search (capsules.search)
     - Filtering options
     - Inline content management
     """
     list_display = ('title', 'creator', 'unlock_date', 'status', 'created_at', 'content_count')
     list_filter = ('status', 'created_at', 'unlock_date')
-    search_fields = ('title', 'creator__username', 'description')
-    readonly_fields = ('created_at',)
+    list_select_related = ('creator',)
+    search_fields = ('title', 'description', 'creator__username')
+    readonly_fields = ('created_at', 'contents_link')
+    autocomplete_fields = ('creator',)
     date_hierarchy = 'unlock_date'
     inlines = [CapsuleContentInline]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_related_matches(self, search_term):
+        """Capsules of the user whose username is the search term."""
+        return Q(creator__username__iexact=search_term.strip())
+    
+    def get_queryset(self, request):
+        """Annotate the content count so the changelist runs no query per row."""
+        return super().get_queryset(request).with_content_count()
+    
+    def get_inline_instances(self, request, obj=None):
+        """Skip the content inline for capsules too large to edit inline."""
+        if obj is not None and obj.contents.all()[INLINE_MAX_CONTENTS:].exists():
+            return []
+        return super().get_inline_instances(request, obj)
+    
+    def get_deleted_objects(self, objs, request):
+        """
+        Describe a delete without running the cascade collector.
+        
+        delete_capsule only hides the capsules and the purge removes their
+        contents later, so the confirmation page lists the capsules and
+        counts their contents in one query instead of loading every row.
+        """
+        capsules = list(objs)
+        perms_needed = set()
+        if not self.has_delete_permission(request):
+            perms_needed.add(self.opts.verbose_name)
+        model_count = {self.opts.verbose_name_plural: len(capsules)}
+        contents = CapsuleContent.objects.filter(capsule__in=capsules).count()
+        if contents:
+            model_count[CapsuleContent._meta.verbose_name_plural] = contents
+        deleted = [f'{capfirst(self.opts.verbose_name)}: {capsule}' for capsule in capsules]
+        return deleted, model_count, perms_needed, []
+    
+    def delete_model(self, request, obj):
+        """Delete through capsules.deletion rather than the cascade collector."""
+        delete_capsule(obj)
+    
+    def delete_queryset(self, request, queryset):
+        """Delete each selected capsule through capsules.deletion."""
+        for capsule in queryset:
+            delete_capsule(capsule)
     
     def content_count(self, obj):
         """Displays the number of items in the time capsule.
         
-        Returns the count of CapsuleContent instances associated with the
-        TimeCapsule instance.
+        Reads the count annotated by get_queryset().
         """
-        return obj.contents.count()
+        return obj.content_count
     content_count.short_description = 'Number of Items'
+    content_count.admin_order_field = 'content_count'
+    
+    def contents_link(self, obj):
+        """Links to the content changelist filtered to this capsule."""
+        if obj.pk is None:
+            return "-"
+        url = reverse('admin:capsules_capsulecontent_changelist')
+        return format_html('<a href="{}?capsule__id__exact={}">View all contents</a>', url, obj.pk)
+    contents_link.short_description = 'Contents'
 
     fieldsets = (
         ('Basic Information', {
@@ -77,7 +235,7 @@ class TimeCapsuleAdmin(admin.ModelAdmin):
             'fields': ('unlock_date', 'status', 'is_public')
         }),
         ('Metadata', {
-            'fields': ('created_at',),
+            'fields': ('created_at', 'contents_link'),
             'classes': ('collapse',)
         })
     )
@@ -0,0 +1,535 @@
+"""JSON API for capsules and their contents.
+
+Covers the operations of the HTML views in capsules.views for clients
+that are not browsers. All endpoints live under ``/api/``, use the session
+(and CSRF protection) of a logged-in user, and speak JSON::
+
+    GET    capsules/                  own capsules, newest first
+    GET    capsules/?ids=3,1,2        batch-get visible capsules
+    POST   capsules/                  create a capsule
+    GET    capsules/<pk>/             a visible capsule
+    PATCH  capsules/<pk>/             edit a capsule (owner, not locked)
+    DELETE capsules/<pk>/             delete a capsule (owner)
+    POST   capsules/<pk>/lock/        lock a capsule (owner, not locked)
+    GET    capsules/<pk>/contents/    contents of a visible capsule, oldest first
+    POST   capsules/<pk>/contents/    add a file, multipart (owner, not locked)
+    GET    contents/?ids=5,4          batch-get visible contents
+    GET    contents/<pk>/             a visible content
+    PATCH  contents/<pk>/             edit title/description (owner, not locked)
+    DELETE contents/<pk>/             delete a content (owner, not locked)
+    POST   contents/<pk>/file/        replace the file, multipart (owner, not locked)
+
+Files larger than a single request use the chunked upload endpoints
+(capsules.uploads), which already speak JSON. A content's ``file_url`` is
+its signed delivery URL, so files are fetched without another API call.
+
+- ``?fields=id,title`` returns only the listed fields, and the query only
+  loads the columns (and annotations) they need.
+- Lists are keyset-paginated: ``{"results": [...], "next": <url>}``, with
+  ``?cursor=`` and ``?limit=`` (up to CAPSULES_API_MAX_PAGE_SIZE).
+- Batch gets answer ``{"results": [...], "missing": [...]}`` in the order
+  requested, with at most CAPSULES_API_MAX_BATCH ids.
+- Every GET carries a strong ETag (a hash of the exact body); a matching
+  ``If-None-Match`` gets a 304 without a body.
+
+Access rules are part of every query (``visible_to()`` for reads, the
+creator for writes), so objects a user may not see do not exist for them
+and answer 404.
+"""
+
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from .deletion import delete_capsule
+from .delivery import delivery_urls
+from .forms import CapsuleContentForm, TimeCapsuleForm
+from .models import CapsuleContent, TimeCapsule
+from .pagination import DEFAULT_PAGE_SIZE, paginate_keyset
+from .pipeline import save_pending
+from .sniffing import sniff_file
+
+DEFAULT_MAX_PAGE_SIZE = 100
+DEFAULT_MAX_BATCH = 100
+
+# Field name -> model columns it needs; annotations are added separately
+CAPSULE_FIELDS = {
+    'id': (),
+    'url': (),
+    'title': ('title',),
+    'description': ('description',),
+    'status': ('status', 'unlock_date'),
+    'unlock_date': ('unlock_date',),
+    'created_at': ('created_at',),
+    'is_public': ('is_public',),
+    'is_owner': ('creator',),
+    'content_count': (),
+}
+CONTENT_FIELDS = {
+    'id': (),
+    'url': (),
+    'capsule': ('capsule',),
+    'title': ('title',),
+    'description': ('description',),
+    'content_type': ('content_type',),
+    'upload_status': ('upload_status',),
+    'uploaded_at': ('uploaded_at',),
+    'file_url': ('storage_backend', 'storage_key'),
+}
+
+
+class ApiError(Exception):
+    """An error answered with ``{"error": message}`` and ``status``."""
+
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.payload = {'error': message, **extra}
+
+
+def api_view(*methods):
+    """
+    Decorate an API view.
+
+    Answers 401 for anonymous users and 405 for other methods in JSON
+    (instead of redirecting to the login page), and turns ApiError into
+    its JSON response.
+
+    Args:
+        *methods: The HTTP methods the view accepts
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not request.user.is_authenticated:
+                return JsonResponse({'error': 'Authentication required.'}, status=401)
+            if request.method not in methods:
+                response = JsonResponse({'error': 'Method not allowed.'}, status=405)
+                response['Allow'] = ', '.join(methods)
+                return response
+            try:
+                return view(request, *args, **kwargs)
+            except ApiError as e:
+                return JsonResponse(e.payload, status=e.status)
+        return wrapper
+    return decorator
+
+
+def _respond(request, payload, status=200):
+    """JSON response; GETs get a strong ETag and honour If-None-Match."""
+    body = json.dumps(payload, cls=DjangoJSONEncoder).encode()
+    response = HttpResponse(body, status=status, content_type='application/json')
+    patch_vary_headers(response, ['Cookie'])
+    if request.method != 'GET':
+        return response
+    response['ETag'] = '"%s"' % hashlib.sha256(body).hexdigest()[:40]
+    # Clients may keep the body but must revalidate it every time
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(request, etag=response['ETag'], response=response) or response
+
+
+def _fields(request, available):
+    """The fields requested with ``?fields=``, in canonical order."""
+    raw = request.GET.get('fields')
+    if not raw:
+        return tuple(available)
+    requested = {name.strip() for name in raw.split(',') if name.strip()}
+    unknown = requested - available.keys()
+    if unknown:
+        raise ApiError(f"Unknown field(s): {', '.join(sorted(unknown))}.")
+    return tuple(name for name in available if name in requested)
+
+
+def _ids(request):
+    """The ids of a batch get, or None for a plain list request."""
+    raw = request.GET.get('ids')
+    if raw is None:
+        return None
+    try:
+        ids = list(dict.fromkeys(int(pk) for pk in raw.split(',') if pk.strip()))
+    except ValueError:
+        raise ApiError('ids must be a comma-separated list of integers.')
+    limit = getattr(settings, 'CAPSULES_API_MAX_BATCH', DEFAULT_MAX_BATCH)
+    if len(ids) > limit:
+        raise ApiError(f'At most {limit} ids can be fetched at once.')
+    return ids
+
+
+def _json_body(request):
+    """The request body as a JSON object."""
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        raise ApiError('The request body must be JSON.')
+    if not isinstance(payload, dict):
+        raise ApiError('The request body must be a JSON object.')
+    return payload
+
+
+def _partial_form(form_class, payload, instance, editable):
+    """A bound model form validating only the fields present in ``payload``."""
+    unknown = payload.keys() - set(editable)
+    if unknown:
+        raise ApiError(f"Field(s) cannot be changed: {', '.join(sorted(unknown))}.")
+    form = form_class(data=payload, instance=instance)
+    for name in list(form.fields):
+        if name not in payload:
+            del form.fields[name]
+    return form
+
+
+def _page(request, queryset, fields, serialize, **keyset):
+    """Cursor-paginated list response."""
+    max_size = getattr(settings, 'CAPSULES_API_MAX_PAGE_SIZE', DEFAULT_MAX_PAGE_SIZE)
+    try:
+        limit = min(max(int(request.GET.get('limit', DEFAULT_PAGE_SIZE)), 1), max_size)
+    except ValueError:
+        raise ApiError('limit must be an integer.')
+    page = paginate_keyset(queryset, request.GET.get('cursor'), limit, **keyset)
+    next_url = None
+    if page.has_next:
+        query = request.GET.copy()
+        query['cursor'] = page.next_cursor
+        next_url = f'{request.path}?{query.urlencode()}'
+    return page, {'results': serialize(page.items, fields), 'next': next_url}
+
+
+def _batch(request, queryset, ids, fields, serialize):
+    """Batch-get response, in the order of ``ids``."""
+    found = {obj.pk: obj for obj in queryset.filter(pk__in=ids)}
+    return _respond(request, {
+        'results': serialize([found[pk] for pk in ids if pk in found], fields),
+        'missing': [pk for pk in ids if pk not in found],
+    })
+
+
+# Capsules
+
+def _capsule_query(queryset, fields, now):
+    columns = {'created_at'}  # keyset pagination
+    for name in fields:
+        columns.update(CAPSULE_FIELDS[name])
+    queryset = queryset.with_effective_status(now).only(*columns)
+    if 'content_count' in fields:
+        queryset = queryset.with_content_count()
+    return queryset
+
+
+def _serialize_capsules(capsules, fields, user):
+    rows = []
+    for capsule in capsules:
+        values = {
+            'id': capsule.pk,
+            'url': reverse('capsules:api_capsule', args=[capsule.pk]) if 'url' in fields else None,
+            'status': capsule.effective_status if 'status' in fields else None,
+            'is_owner': capsule.creator_id == user.pk if 'is_owner' in fields else None,
+        }
+        rows.append({
+            name: values[name] if name in values else getattr(capsule, name)
+            for name in fields
+        })
+    return rows
+
+
+def _capsule_payload(request, capsule_id, now=None):
+    fields = tuple(CAPSULE_FIELDS)
+    capsule = _capsule_query(TimeCapsule.objects.filter(pk=capsule_id), fields, now).get()
+    return _serialize_capsules([capsule], fields, request.user)[0]
+
+
+def _owned_capsule(request, pk, now):
+    capsule = (
+        TimeCapsule.objects.filter(creator=request.user, pk=pk)
+        .with_effective_status(now).first()
+    )
+    if capsule is None:
+        raise ApiError('Capsule not found.', status=404)
+    return capsule
+
+
+@api_view('GET', 'POST')
+def capsules(request):
+    """
+    List the user's capsules, batch-get visible ones, or create one.
+
+    Args:
+        request: The HTTP request; POST takes ``title``, ``description``
+            and ``unlock_date`` (ISO 8601)
+
+    Returns:
+        HttpResponse: A page of capsules, the batch, or 201 with the new
+        capsule
+    """
+    now = timezone.now()
+    if request.method == 'POST':
+        form = TimeCapsuleForm(data=_json_body(request))
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        capsule = form.save(commit=False)
+        capsule.creator = request.user
+        capsule.status = 'active'
+        capsule.save()
+        response = _respond(request, _capsule_payload(request, capsule.pk, now), status=201)
+        response['Location'] = reverse('capsules:api_capsule', args=[capsule.pk])
+        return response
+
+    fields = _fields(request, CAPSULE_FIELDS)
+    serialize = lambda items, fields: _serialize_capsules(items, fields, request.user)
+    ids = _ids(request)
+    if ids is not None:
+        queryset = _capsule_query(TimeCapsule.objects.visible_to(request.user), fields, now)
+        return _batch(request, queryset, ids, fields, serialize)
+    queryset = _capsule_query(TimeCapsule.objects.filter(creator=request.user), fields, now)
+    return _respond(request, _page(request, queryset, fields, serialize)[1])
+
+
+@api_view('GET', 'PATCH', 'DELETE')
+def capsule(request, pk):
+    """
+    Read, edit or delete one capsule.
+
+    Args:
+        request: The HTTP request; PATCH takes any of ``title``,
+            ``description`` and ``unlock_date``
+        pk: Primary key of the capsule
+
+    Returns:
+        HttpResponse: The capsule, or 204 after deleting it
+    """
+    now = timezone.now()
+    if request.method == 'GET':
+        fields = _fields(request, CAPSULE_FIELDS)
+        queryset = _capsule_query(TimeCapsule.objects.visible_to(request.user), fields, now)
+        found = queryset.filter(pk=pk).first()
+        if found is None:
+            raise ApiError('Capsule not found.', status=404)
+        return _respond(request, _serialize_capsules([found], fields, request.user)[0])
+
+    capsule = _owned_capsule(request, pk, now)
+    if request.method == 'DELETE':
+        delete_capsule(capsule)
+        return HttpResponse(status=204)
+
+    if capsule.is_locked:
+        raise ApiError("You can't edit a locked capsule.", status=403)
+    form = _partial_form(
+        TimeCapsuleForm, _json_body(request), capsule, TimeCapsuleForm.Meta.fields
+    )
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    form.save()
+    return _respond(request, _capsule_payload(request, capsule.pk, now))
+
+
+@api_view('POST')
+def capsule_lock(request, pk):
+    """
+    Lock a capsule until its unlock date.
+
+    Args:
+        request: The HTTP request
+        pk: Primary key of the capsule
+
+    Returns:
+        HttpResponse: The locked capsule
+    """
+    now = timezone.now()
+    capsule = _owned_capsule(request, pk, now)
+    if capsule.is_locked:
+        raise ApiError("This capsule is already locked.", status=409)
+    capsule.status = 'locked'
+    capsule.save()
+    return _respond(request, _capsule_payload(request, capsule.pk, now))
+
+
+# Contents
+
+def _content_query(queryset, fields):
+    columns = {'uploaded_at', 'capsule'}  # keyset pagination, ownership
+    for name in fields:
+        columns.update(CONTENT_FIELDS[name])
+    return queryset.only(*columns)
+
+
+def _serialize_contents(contents, fields):
+    # Sign the URLs of every available file in one batch
+    urls = {}
+    if 'file_url' in fields:
+        urls = delivery_urls(c.storage_ref for c in contents if c.file_available)
+    rows = []
+    for content in contents:
+        values = {
+            'id': content.pk,
+            'url': reverse('capsules:api_content', args=[content.pk]) if 'url' in fields else None,
+            'capsule': content.capsule_id,
+            'file_url': urls.get(content.storage_ref) if content.file_available else None,
+        }
+        rows.append({
+            name: values[name] if name in values else getattr(content, name)
+            for name in fields
+        })
+    return rows
+
+
+def _content_payload(request, content_id):
+    fields = tuple(CONTENT_FIELDS)
+    content = CapsuleContent.objects.visible_to(request.user).get(pk=content_id)
+    return _serialize_contents([content], fields)[0]
+
+
+def _owned_content(request, pk):
+    content = (
+        CapsuleContent.objects.live().filter(capsule__creator=request.user, pk=pk)
+        .select_related('capsule').first()
+    )
+    if content is None:
+        raise ApiError('Content not found.', status=404)
+    if content.capsule.is_locked:
+        raise ApiError("You can't change content in a locked capsule.", status=403)
+    return content
+
+
+def _store_upload(request, content, form):
+    """Hand the validated file of ``form`` to the upload pipeline."""
+    content.content_type = form.sniffed.content_type
+    save_pending(content, request.FILES['file'])
+
+
+def _content_form_data(request):
+    """Multipart form data, defaulting ``content_type`` to the sniffed one."""
+    data = request.POST.copy()
+    upload = request.FILES.get('file')
+    if upload and not data.get('content_type'):
+        data['content_type'] = sniff_file(upload).content_type or ''
+    return data
+
+
+@api_view('GET', 'POST')
+def capsule_contents(request, pk):
+    """
+    List the contents of a visible capsule, or add a file to one.
+
+    Args:
+        request: The HTTP request; POST is multipart with ``file``,
+            ``title``, ``description`` and optionally ``content_type``
+        pk: Primary key of the capsule
+
+    Returns:
+        HttpResponse: A page of contents, or 202 with the new content,
+        whose file is still being uploaded
+    """
+    if request.method == 'POST':
+        capsule = _owned_capsule(request, pk, timezone.now())
+        if capsule.is_locked:
+            raise ApiError("You can't add content to a locked capsule.", status=403)
+        form = CapsuleContentForm(_content_form_data(request), request.FILES)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        content = form.save(commit=False)
+        content.capsule = capsule
+        _store_upload(request, content, form)
+        response = _respond(request, _content_payload(request, content.pk), status=202)
+        response['Location'] = reverse('capsules:api_content', args=[content.pk])
+        return response
+
+    fields = _fields(request, CONTENT_FIELDS)
+    queryset = _content_query(
+        CapsuleContent.objects.visible_to(request.user).filter(capsule_id=pk), fields
+    )
+    page, payload = _page(
+        request, queryset, fields, _serialize_contents, field='uploaded_at', descending=False
+    )
+    # An empty first page may mean the capsule is not there for this user
+    if not page.items and not request.GET.get('cursor'):
+        if not TimeCapsule.objects.visible_to(request.user).filter(pk=pk).exists():
+            raise ApiError('Capsule not found.', status=404)
+    return _respond(request, payload)
+
+
+@api_view('GET')
+def contents(request):
+    """
+    Batch-get visible contents with ``?ids=``.
+
+    Args:
+        request: The HTTP request
+
+    Returns:
+        HttpResponse: The batch
+    """
+    ids = _ids(request)
+    if ids is None:
+        raise ApiError('ids is required.')
+    fields = _fields(request, CONTENT_FIELDS)
+    queryset = _content_query(CapsuleContent.objects.visible_to(request.user), fields)
+    return _batch(request, queryset, ids, fields, _serialize_contents)
+
+
+@api_view('GET', 'PATCH', 'DELETE')
+def content(request, pk):
+    """
+    Read, edit or delete one content.
+
+    Args:
+        request: The HTTP request; PATCH takes ``title`` and/or
+            ``description``
+        pk: Primary key of the content
+
+    Returns:
+        HttpResponse: The content, or 204 after deleting it
+    """
+    if request.method == 'GET':
+        fields = _fields(request, CONTENT_FIELDS)
+        queryset = _content_query(CapsuleContent.objects.visible_to(request.user), fields)
+        found = queryset.filter(pk=pk).first()
+        if found is None:
+            raise ApiError('Content not found.', status=404)
+        return _respond(request, _serialize_contents([found], fields)[0])
+
+    content = _owned_content(request, pk)
+    if request.method == 'DELETE':
+        content.delete()
+        return HttpResponse(status=204)
+
+    form = _partial_form(
+        CapsuleContentForm, _json_body(request), content, ('title', 'description')
+    )
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    form.save()
+    return _respond(request, _content_payload(request, content.pk))
+
+
+@api_view('POST')
+def content_file(request, pk):
+    """
+    Replace the file of a content.
+
+    The old file keeps being served until the new one is uploaded.
+
+    Args:
+        request: The HTTP request, multipart with ``file`` and optionally
+            ``content_type``
+        pk: Primary key of the content
+
+    Returns:
+        HttpResponse: 202 with the content, whose upload is pending
+    """
+    content = _owned_content(request, pk)
+    if 'file' not in request.FILES:
+        return JsonResponse({'errors': {'file': ['This field is required.']}}, status=400)
+    data = _content_form_data(request)
+    data.setdefault('title', content.title)
+    data.setdefault('description', content.description)
+    form = CapsuleContentForm(data, request.FILES, instance=content)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    _store_upload(request, form.instance, form)
+    return _respond(request, _content_payload(request, content.pk), status=202)
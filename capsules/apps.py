@@ -5,6 +5,7 @@ defining its basic settings and behavior within the Django project.
 """
 
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CapsulesConfig(AppConfig):
@@ -16,3 +17,42 @@ class CapsulesConfig(AppConfig):
     """
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'capsules'
+
+    def ready(self):
+        """
+        Start the in-process unlock sweeper when this process is meant to,
+        drop cached storage backends whenever settings change, release the
+        stored file of deleted contents, invalidate cached fragments of
+        changed capsules, and keep the public timeline and the search index
+        in step with capsule and content saves and deletes. Every database
+        connection gets the request metrics query wrapper when opened.
+        """
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save, pre_save
+        from django.test.signals import setting_changed
+        from .fragments import bump_capsule_version, bump_partial_save, content_changed
+        from .instrumentation import install_db_wrapper
+        from .models import CapsuleContent, PublicTimelineEntry, TimeCapsule, release_content_blob
+        from .search import capsule_deleted, capsule_saved, content_deleted, content_saved
+        from .storage import reset_storages
+        from .timeline import sync_timeline_entry, timeline_entry_deleted
+        setting_changed.connect(reset_storages)
+        connection_created.connect(install_db_wrapper)
+        post_delete.connect(release_content_blob, sender=CapsuleContent)
+        pre_save.connect(bump_capsule_version, sender=TimeCapsule)
+        post_save.connect(bump_partial_save, sender=TimeCapsule)
+        post_save.connect(content_changed, sender=CapsuleContent)
+        post_delete.connect(content_changed, sender=CapsuleContent)
+        post_save.connect(sync_timeline_entry, sender=TimeCapsule)
+        post_delete.connect(timeline_entry_deleted, sender=PublicTimelineEntry)
+        post_save.connect(capsule_saved, sender=TimeCapsule)
+        post_delete.connect(capsule_deleted, sender=TimeCapsule)
+        post_save.connect(content_saved, sender=CapsuleContent)
+        post_delete.connect(content_deleted, sender=CapsuleContent)
+
+        # Only the process meant to sweep starts the loop, not every
+        # manage.py command, migration or test run
+        interval = getattr(settings, 'CAPSULES_UNLOCK_SWEEP_INTERVAL', 0)
+        if getattr(settings, 'CAPSULES_RUN_SWEEPER', False) and interval:
+            from .sweeper import start_periodic_sweeper
+            start_periodic_sweeper(interval)
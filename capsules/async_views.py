@@ -0,0 +1,179 @@
+"""Native async versions of the busiest capsule views.
+
+Under ASGI a synchronous view runs in a worker thread for its whole
+duration, including every database and cache round trip. The views below
+read the database through Django's async ORM and the cache (fragments and
+delivery URLs) through the async cache API, so a request waiting on
+either does not hold a thread of its own. They share their queries,
+permission rules and helpers with the synchronous views in
+capsules.views and render the same templates.
+
+``capsules/urls.py`` routes to them when ``CAPSULES_ASYNC_VIEWS`` is set,
+which the ASGI deployment does (see Procfile); under WSGI the
+synchronous views avoid an event loop per request. The
+``benchmark_servers`` command compares both deployments.
+
+None of these views talks to a storage backend: delivery URLs are signed
+locally and the files themselves are fetched from ``deliver_file``.
+Template rendering is CPU-bound and runs inline; it never touches the
+database because the user and session are loaded beforehand.
+"""
+
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponseForbidden
+from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .delivery import adelivery_url, adelivery_urls
+from .fragments import acached_fragments
+from .models import CapsuleContent
+from .pagination import DEFAULT_PAGE_SIZE, apaginate_keyset
+from .views import (
+    _can_access_file,
+    _can_view,
+    _card_queryset,
+    _content_refs,
+    _cover_refs,
+    _detail_queryset,
+    _list_queryset,
+    _set_content_urls,
+    _set_covers,
+)
+
+
+def async_login_required(view):
+    """
+    ``login_required`` for async views.
+
+    Resolves the lazy ``request.user`` (and with it the session) in one
+    hop to a thread, so nothing later in the request blocks on them.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@async_login_required
+async def capsule_list(request):
+    """
+    Display one page of the user's time capsules.
+
+    Async version of capsules.views.capsule_list.
+
+    Args:
+        request: The HTTP request
+
+    Returns:
+        HttpResponse: Rendered template with a page of capsules
+    """
+    now = timezone.now()
+    page = await apaginate_keyset(
+        _list_queryset(request.user, now),
+        cursor=request.GET.get('cursor'),
+        page_size=getattr(settings, 'CAPSULES_PAGE_SIZE', DEFAULT_PAGE_SIZE),
+    )
+
+    async def render_cards(pks):
+        capsules = [capsule async for capsule in _card_queryset(pks, now)]
+        _set_covers(capsules, await adelivery_urls(_cover_refs(capsules)))
+        return {
+            capsule.pk: render_to_string('capsules/_capsule_card.html', {'capsule': capsule})
+            for capsule in capsules
+        }
+
+    cards = await acached_fragments(
+        'card', request.user, [(c.pk, c) for c in page.items], render_cards, now
+    )
+    context = {'capsules': page.items, 'cards': cards, 'page': page}
+
+    # Infinite scroll asks for the next batch of cards only
+    if request.GET.get('fragment'):
+        return render(request, 'capsules/_capsule_cards.html', context)
+    return render(request, 'capsules/capsule_list.html', context)
+
+
+@async_login_required
+async def capsule_detail(request, pk):
+    """
+    Display details of a specific time capsule.
+
+    Async version of capsules.views.capsule_detail.
+
+    Args:
+        request: The HTTP request
+        pk: Primary key of the capsule to display
+
+    Returns:
+        HttpResponse: Rendered template with capsule details
+
+    Raises:
+        Http404: If capsule doesn't exist
+    """
+    now = timezone.now()
+    capsule = await _detail_queryset(now).filter(pk=pk).afirst()
+    if capsule is None:
+        raise Http404("No TimeCapsule matches the given query.")
+    if not _can_view(request.user, capsule):
+        return HttpResponseForbidden("You don't have permission to view this capsule.")
+
+    contents = {content.pk: content async for content in capsule.contents.all()}
+
+    async def render_blocks(pks):
+        missing = [contents[pk] for pk in pks]
+        _set_content_urls(missing, await adelivery_urls(_content_refs(capsule, missing)))
+        return {
+            content.pk: render_to_string(
+                'capsules/_content_block.html', {'capsule': capsule, 'content': content}
+            )
+            for content in missing
+        }
+
+    return render(request, 'capsules/capsule_detail.html', {
+        'capsule': capsule,
+        'content_blocks': await acached_fragments(
+            'content', request.user, [(pk, capsule) for pk in contents], render_blocks, now
+        ),
+    })
+
+
+@async_login_required
+async def serve_protected_file(request, content_id):
+    """
+    Redirect to the signed delivery URL of a content's file.
+
+    Async version of capsules.views.serve_protected_file.
+
+    Args:
+        request: The HTTP request
+        content_id: ID of the content whose file should be served
+
+    Returns:
+        HttpResponseRedirect: Redirect to the file's delivery URL
+
+    Raises:
+        Http404: If content doesn't exist or has no file
+        PermissionDenied: If user doesn't have permission
+    """
+    content = await (
+        CapsuleContent.objects.live().select_related('capsule').filter(pk=content_id).afirst()
+    )
+    if content is None:
+        raise Http404("No CapsuleContent matches the given query.")
+    capsule = content.capsule
+
+    if not _can_access_file(request.user, capsule):
+        raise PermissionDenied("You don't have permission to view this content.")
+    if capsule.is_locked:
+        raise PermissionDenied("This content is locked until the capsule's unlock date.")
+    if not content.storage_key:
+        raise Http404("This content has no file.")
+    return redirect(await adelivery_url(content.storage_ref))
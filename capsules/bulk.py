@@ -0,0 +1,186 @@
+"""Adding many files to a capsule at once.
+
+:func:`add_files` validates each file on its own and infers its title and
+content type (from its magic bytes, see capsules.sniffing). Files whose
+bytes are stored already reuse their ContentBlob; the others are uploaded
+to the content storage concurrently (at most
+``CAPSULES_BULK_UPLOAD_CONCURRENCY`` at a time, once per distinct file).
+Every CapsuleContent row is then created with a single ``bulk_create``. A
+file that fails validation or upload is reported in its result and does
+not stop the rest of the batch. New images get their derivatives in the
+background afterwards.
+"""
+
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import transaction
+from django.template.defaultfilters import filesizeformat
+
+from .hashing import file_digest
+from .instrumentation import track_storage
+from .models import CapsuleContent, ContentBlob, TimeCapsule
+from . import search
+from .pipeline import enqueue_derivatives
+from .sniffing import RESOURCE_TYPES, sniff_file
+from .storage import get_content_storage
+from .uploads import max_upload_size
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+
+
+@dataclass
+class FileResult:
+    """Outcome of adding one file.
+
+    Attributes:
+        name: Name of the uploaded file
+        content: The created CapsuleContent, or None if the file failed
+        error: Why the file failed, or None
+    """
+    name: str
+    content: CapsuleContent = None
+    error: str = None
+
+    @property
+    def ok(self):
+        """Whether the file was added."""
+        return self.error is None
+
+    def as_dict(self):
+        """JSON-serialisable form of the result."""
+        if self.ok:
+            return {'name': self.name, 'status': 'created', 'content_id': self.content.pk}
+        return {'name': self.name, 'status': 'error', 'error': self.error}
+
+
+def infer_title(name):
+    """Derive a readable title from a file name, e.g. 'beach_day-2.jpg'."""
+    stem = os.path.splitext(os.path.basename(name))[0]
+    title = ' '.join(stem.replace('_', ' ').replace('-', ' ').split())
+    return (title[:1].upper() + title[1:])[:200] or 'Untitled'
+
+
+def _upload(storage, fileobj, content_type):
+    return storage.save(fileobj.name, fileobj, RESOURCE_TYPES[content_type])
+
+
+def add_files(capsule, files, concurrency=None, on_created=None):
+    """
+    Add many uploaded files to ``capsule``.
+
+    Args:
+        capsule: The capsule to add the files to
+        files: List of uploaded files; a file's ``content_title`` and
+            ``content_description`` attributes, if set, are used instead
+            of the inferred title and an empty description
+        concurrency: Maximum simultaneous storage uploads, defaults to
+            CAPSULES_BULK_UPLOAD_CONCURRENCY
+        on_created: Called with the results inside the transaction that
+            creates the rows, e.g. to record progress atomically with them
+
+    Returns:
+        list: One FileResult per file, in the order given
+    """
+    concurrency = concurrency or getattr(
+        settings, 'CAPSULES_BULK_UPLOAD_CONCURRENCY', DEFAULT_CONCURRENCY
+    )
+    results = [FileResult(name=f.name) for f in files]
+    accepted = []
+    for result, fileobj in zip(results, files):
+        sniffed = sniff_file(fileobj)
+        content_type = sniffed.content_type
+        if content_type is None:
+            result.error = f"Unsupported file type {sniffed.mime_type}."
+        elif fileobj.size > max_upload_size():
+            result.error = f"File size must be under {filesizeformat(max_upload_size())}."
+        else:
+            accepted.append((result, fileobj, content_type, file_digest(fileobj)))
+
+    storage = get_content_storage()
+    known = ContentBlob.objects.in_bulk(
+        {digest for _, _, _, digest in accepted}, field_name='digest'
+    )
+    # Upload each file that is not stored yet once, however often it occurs
+    missing = {}
+    for result, fileobj, content_type, digest in accepted:
+        if digest not in known:
+            missing.setdefault(digest, (fileobj, content_type))
+    keys, failed = {}, set()
+    if missing:
+        with track_storage(), ThreadPoolExecutor(
+            max_workers=min(concurrency, len(missing)),
+            thread_name_prefix='capsule-bulk-upload',
+        ) as executor:
+            futures = {
+                digest: executor.submit(_upload, storage, fileobj, content_type)
+                for digest, (fileobj, content_type) in missing.items()
+            }
+            for digest, future in futures.items():
+                try:
+                    keys[digest] = future.result()
+                except Exception as e:
+                    logger.warning("Bulk upload of %s failed: %s", missing[digest][0].name, e)
+                    failed.add(digest)
+    for result, _, _, digest in accepted:
+        if digest in failed:
+            result.error = "The upload failed, please try again."
+
+    contents = []
+    with transaction.atomic():
+        ContentBlob.objects.bulk_create(
+            [
+                ContentBlob(
+                    digest=digest,
+                    size=missing[digest][0].size,
+                    storage_backend=storage.name,
+                    storage_key=key,
+                )
+                for digest, key in keys.items()
+            ],
+            ignore_conflicts=True,
+        )
+        blobs = ContentBlob.objects.in_bulk(
+            {digest for result, _, _, digest in accepted if result.ok}, field_name='digest'
+        )
+        for digest, key in keys.items():
+            if blobs[digest].storage_key != key:
+                # Stored concurrently by another request; keep that copy
+                transaction.on_commit(lambda key=key: storage.delete(key))
+        for result, fileobj, content_type, digest in accepted:
+            if result.ok:
+                result.content = CapsuleContent(
+                    capsule=capsule,
+                    title=getattr(fileobj, 'content_title', None) or infer_title(fileobj.name),
+                    description=getattr(fileobj, 'content_description', ''),
+                    content_type=content_type,
+                )
+                result.content.use_blob(blobs[digest])
+                contents.append(result.content)
+        ContentBlob.objects.add_references(Counter(c.blob_id for c in contents))
+        CapsuleContent.objects.bulk_create(contents)
+        # bulk_create sends no signals, so invalidate cached fragments and
+        # update the search index here
+        if contents:
+            TimeCapsule.objects.filter(pk=capsule.pk).bump_version()
+            search.index('content', [content.pk for content in contents])
+            search.index('capsule', [capsule.pk])
+        if on_created is not None:
+            on_created(results)
+
+    # One derivative job per new image; it fills in every content sharing it
+    for result, fileobj, content_type, digest in accepted:
+        if result.ok and content_type == 'image' and keys.get(digest) == result.content.storage_key:
+            enqueue_derivatives(result.content, fileobj)
+            keys.pop(digest)
+
+    logger.info(
+        "Added %s of %s files to capsule %s", len(contents), len(files), capsule.pk
+    )
+    return results
@@ -0,0 +1,266 @@
+"""Deferred deletion of time capsules and their stored files.
+
+``capsule.delete()`` runs Django's cascade collector, which loads every
+content of the capsule to send its delete signals, and the stored files of
+contents that predate ContentBlob were never removed at all. Instead:
+
+1. :func:`delete_capsule` only sets ``deleted_at``, which hides the capsule
+   from its default manager and its contents from the user-facing content
+   querysets (``CapsuleContentQuerySet.live``), and returns.
+2. :func:`purge_deleted_capsules` removes the rows of deleted capsules in
+   batches of ``CAPSULES_PURGE_BATCH_SIZE`` contents with a few set-based
+   statements per batch: blob references are dropped in bulk, and the
+   files no content refers to any more are queued as
+   PendingStorageDeletion rows in the same transaction.
+3. :func:`delete_pending_files` claims the queued files in batches and
+   deletes them through each backend's batch call (``delete_many``)
+   outside any transaction, retrying failed batches with exponential
+   backoff.
+
+Both steps only act on what is still in the database, so running them
+again, or from several processes at once, does no harm. On backends that
+support ``SELECT ... FOR UPDATE SKIP LOCKED`` every batch is claimed by
+exactly one process, as in capsules.sweeper.
+
+Purging starts in the background once a deletion commits; ``manage.py
+purge_deleted`` runs both steps as well and picks up retries.
+
+Settings:
+
+- ``CAPSULES_PURGE_BATCH_SIZE``: contents, or files, handled per batch
+- ``CAPSULES_PURGE_WORKERS``: background purge threads per process; 0
+  leaves purging to ``manage.py purge_deleted``
+- ``CAPSULES_STORAGE_DELETE_RETRIES``: attempts per file before giving up
+- ``CAPSULES_STORAGE_DELETE_RETRY_DELAY``: seconds before the first retry,
+  doubled for every further retry
+"""
+
+import logging
+import threading
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import search
+from .derivatives import derivative_refs
+from .models import CapsuleContent, ContentBlob, PendingStorageDeletion, PublicTimelineEntry, TimeCapsule
+from .storage import get_content_storage, make_ref
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_WORKERS = 1
+DEFAULT_RETRIES = 5
+DEFAULT_RETRY_DELAY = 60.0
+
+# Seconds a claimed batch of queued files stays with the process deleting it
+CLAIM_TIMEOUT = 300
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _batch_size(batch_size):
+    return batch_size or getattr(settings, 'CAPSULES_PURGE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+
+def _claimed(queryset):
+    # Rows claimed by another purge are skipped rather than waited on
+    if connection.features.has_select_for_update_skip_locked:
+        return queryset.select_for_update(skip_locked=True)
+    return queryset
+
+
+def delete_capsule(capsule):
+    """
+    Delete ``capsule`` right away, leaving its rows and files to the purge.
+
+    Args:
+        capsule: The TimeCapsule to delete
+    """
+    with transaction.atomic():
+        # A new version also drops the capsule's cached fragments
+        TimeCapsule.objects.filter(pk=capsule.pk).update(
+            deleted_at=timezone.now(), version=uuid.uuid4()
+        )
+        # Take the capsule out of the cached feed now, not once purged
+        PublicTimelineEntry.objects.filter(capsule_id=capsule.pk).delete()
+        schedule_purge()
+    logger.info("Deleted capsule %s; purging it in the background", capsule.pk)
+
+
+def _purge_batch(capsule_id, batch_size):
+    """Remove one batch of a deleted capsule's contents; returns how many."""
+    with transaction.atomic():
+        rows = list(
+            _claimed(CapsuleContent.objects.filter(capsule_id=capsule_id).order_by('pk'))
+            .values_list('pk', 'blob_id', 'storage_backend', 'storage_key', 'derivatives')[:batch_size]
+        )
+        if not rows:
+            return 0
+        pks = [pk for pk, _, _, _, _ in rows]
+        released = Counter(blob_id for _, blob_id, _, _, _ in rows if blob_id)
+        # Contents stored before deduplication own their files
+        refs = []
+        for _, blob_id, backend, key, derivatives in rows:
+            if not blob_id and key:
+                refs += [make_ref(backend, key)] + derivative_refs(derivatives)
+
+        # A raw delete skips the collector and the per-row signals, whose
+        # work is done below for the whole batch
+        CapsuleContent.objects.filter(pk__in=pks)._raw_delete(connection.alias)
+        search.get_search_backend().remove('content', pks)
+        by_count = defaultdict(list)
+        for blob_id, count in released.items():
+            by_count[count].append(blob_id)
+        for count, blob_ids in by_count.items():
+            ContentBlob.objects.filter(pk__in=blob_ids, ref_count__gte=count).update(
+                ref_count=F('ref_count') - count
+            )
+        freed = list(
+            ContentBlob.objects.select_for_update()
+            .filter(pk__in=released, ref_count=0)
+        )
+        for blob in freed:
+            refs += [blob.storage_ref] + derivative_refs(blob.derivatives)
+        ContentBlob.objects.filter(pk__in=[blob.pk for blob in freed]).delete()
+        PendingStorageDeletion.objects.enqueue(refs)
+    return len(rows)
+
+
+def purge_deleted_capsules(batch_size=None):
+    """
+    Remove the rows of every deleted capsule, queueing their stored files.
+
+    Args:
+        batch_size: Contents removed per transaction, defaults to
+            CAPSULES_PURGE_BATCH_SIZE
+
+    Returns:
+        int: Number of capsules purged
+    """
+    batch_size = _batch_size(batch_size)
+    capsule_ids = list(
+        TimeCapsule.all_objects.filter(deleted_at__isnull=False)
+        .order_by('deleted_at').values_list('pk', flat=True)
+    )
+    for capsule_id in capsule_ids:
+        removed = 0
+        while True:
+            count = _purge_batch(capsule_id, batch_size)
+            removed += count
+            if count < batch_size:
+                break
+        # Only the few rows left (sessions, jobs) go through the collector
+        TimeCapsule.all_objects.filter(pk=capsule_id).delete()
+        logger.info("Purged capsule %s and %s contents", capsule_id, removed)
+    return len(capsule_ids)
+
+
+def _claim_pending(due, batch_size):
+    """Lease the next batch of due files to this process and return them."""
+    with transaction.atomic():
+        rows = list(_claimed(due)[:batch_size])
+        # Until the lease runs out other processes see the rows as not due;
+        # it only matters if this one dies before recording the outcome
+        PendingStorageDeletion.objects.filter(pk__in=[row.pk for row in rows]).update(
+            next_attempt_at=timezone.now() + timedelta(seconds=CLAIM_TIMEOUT)
+        )
+    return rows
+
+
+def delete_pending_files(batch_size=None, now=None):
+    """
+    Delete due queued files from storage, one batch call per backend.
+
+    Each batch is claimed in a short transaction of its own; the storage
+    calls run outside of it, so no row locks are held while waiting on a
+    remote backend. A batch whose call fails is retried later with
+    exponential backoff; after CAPSULES_STORAGE_DELETE_RETRIES failed
+    attempts its files are left queued and no longer tried.
+
+    Args:
+        batch_size: Files claimed per transaction, defaults to
+            CAPSULES_PURGE_BATCH_SIZE
+        now: Reference time, defaults to the current time
+
+    Returns:
+        tuple: Numbers of files deleted and of files whose deletion failed
+    """
+    batch_size = _batch_size(batch_size)
+    retries = getattr(settings, 'CAPSULES_STORAGE_DELETE_RETRIES', DEFAULT_RETRIES)
+    delay = getattr(settings, 'CAPSULES_STORAGE_DELETE_RETRY_DELAY', DEFAULT_RETRY_DELAY)
+    now = now or timezone.now()
+    due = PendingStorageDeletion.objects.filter(
+        attempts__lt=retries, next_attempt_at__lte=now
+    ).order_by('next_attempt_at')
+    deleted = failed = 0
+    while True:
+        rows = _claim_pending(due, batch_size)
+        by_backend = defaultdict(list)
+        for row in rows:
+            by_backend[row.storage_backend].append(row)
+        for backend, backend_rows in by_backend.items():
+            try:
+                get_content_storage(backend).delete_many([row.storage_key for row in backend_rows])
+            except Exception as e:
+                logger.warning(
+                    "Could not delete %s files from %s: %s", len(backend_rows), backend, e
+                )
+                for row in backend_rows:
+                    row.attempts += 1
+                    row.next_attempt_at = now + timedelta(seconds=delay * 2 ** (row.attempts - 1))
+                    row.last_error = str(e)[:255]
+                PendingStorageDeletion.objects.bulk_update(
+                    backend_rows, ['attempts', 'next_attempt_at', 'last_error']
+                )
+                failed += len(backend_rows)
+            else:
+                PendingStorageDeletion.objects.filter(
+                    pk__in=[row.pk for row in backend_rows]
+                ).delete()
+                deleted += len(backend_rows)
+        if len(rows) < batch_size:
+            break
+    if deleted or failed:
+        logger.info("Deleted %s stored files, %s failed", deleted, failed)
+    return deleted, failed
+
+
+def purge():
+    """Purge deleted capsules, then delete the queued files."""
+    purge_deleted_capsules()
+    delete_pending_files()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'CAPSULES_PURGE_WORKERS', DEFAULT_WORKERS),
+                thread_name_prefix='capsule-purge',
+            )
+        return _executor
+
+
+def _purge_in_worker():
+    # Worker threads get their own database connections; drop them when done
+    try:
+        purge()
+    except Exception:
+        logger.exception("Background purge failed")
+    finally:
+        close_old_connections()
+
+
+def schedule_purge():
+    """Purge in the background once the transaction commits."""
+    if getattr(settings, 'CAPSULES_PURGE_WORKERS', DEFAULT_WORKERS):
+        transaction.on_commit(lambda: _get_executor().submit(_purge_in_worker))
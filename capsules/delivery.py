@@ -0,0 +1,151 @@
+"""Signed, expiring delivery URLs for capsule files.
+
+Pages never contain raw storage URLs. Instead each file is addressed by a
+token that carries its storage reference (see capsules.storage) and an
+expiry time, signed with an HMAC
+of the project's SECRET_KEY. The delivery view only has to verify the
+token, so serving a file costs no database round trip.
+
+URLs are generated in batch for a whole page and cached until shortly
+before they expire, so rendering a media-heavy capsule repeatedly reuses
+the same URLs (and browser caches keep working).
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.urls import reverse
+
+SALT = 'capsules.delivery'
+
+# Defaults for CAPSULES_DELIVERY_URL_TTL and CAPSULES_DELIVERY_URL_MARGIN
+DEFAULT_TTL = 3600
+DEFAULT_MARGIN = 300
+
+
+class InvalidDeliveryToken(Exception):
+    """Raised when a delivery token is forged, malformed or expired."""
+
+
+def _ttl():
+    return getattr(settings, 'CAPSULES_DELIVERY_URL_TTL', DEFAULT_TTL)
+
+
+def _margin():
+    return getattr(settings, 'CAPSULES_DELIVERY_URL_MARGIN', DEFAULT_MARGIN)
+
+
+def make_token(key, expires):
+    """
+    Sign a storage reference together with its expiry time.
+
+    Args:
+        key: Storage reference of the file
+        expires: Expiry as a UNIX timestamp
+
+    Returns:
+        str: URL-safe token
+    """
+    return signing.dumps({'k': key, 'e': int(expires)}, salt=SALT)
+
+
+def read_token(token, now=None):
+    """
+    Verify a token produced by :func:`make_token`.
+
+    Args:
+        token: The token from the URL
+        now: Reference UNIX time, defaults to the current time
+
+    Returns:
+        tuple: ``(key, expires)``
+
+    Raises:
+        InvalidDeliveryToken: If the signature is wrong or the token expired
+    """
+    try:
+        payload = signing.loads(token, salt=SALT)
+        key, expires = payload['k'], int(payload['e'])
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise InvalidDeliveryToken('Invalid delivery token')
+    if expires < (now or time.time()):
+        raise InvalidDeliveryToken('Delivery token expired')
+    return key, expires
+
+
+def _cache_key(key):
+    return 'capsules:delivery:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def _lookup(keys):
+    keys = {key for key in keys if key}
+    return keys, {_cache_key(key): key for key in keys}
+
+
+def _sign(missing):
+    """Sign ``missing`` references; returns the URLs and their cache entries."""
+    ttl = _ttl()
+    expires = time.time() + ttl
+    fresh = {
+        key: reverse('capsules:deliver_file', args=[make_token(key, expires)])
+        for key in missing
+    }
+    entries = {_cache_key(key): url for key, url in fresh.items()}
+    return fresh, entries, max(ttl - _margin(), 1)
+
+
+def delivery_urls(keys):
+    """
+    Return signed delivery URLs for many storage references at once.
+
+    Cached URLs are reused while they still have at least
+    CAPSULES_DELIVERY_URL_MARGIN seconds to live; the rest are signed and
+    cached in a single round trip.
+
+    Args:
+        keys: Iterable of storage references (empty values are ignored)
+
+    Returns:
+        dict: Storage reference -> delivery URL
+    """
+    keys, cache_keys = _lookup(keys)
+    if not keys:
+        return {}
+    cached = cache.get_many(list(cache_keys))
+    urls = {cache_keys[cache_key]: url for cache_key, url in cached.items()}
+
+    missing = keys - urls.keys()
+    if missing:
+        fresh, entries, timeout = _sign(missing)
+        cache.set_many(entries, timeout=timeout)
+        urls.update(fresh)
+    return urls
+
+
+async def adelivery_urls(keys):
+    """Async version of :func:`delivery_urls`, using the async cache API."""
+    keys, cache_keys = _lookup(keys)
+    if not keys:
+        return {}
+    cached = await cache.aget_many(list(cache_keys))
+    urls = {cache_keys[cache_key]: url for cache_key, url in cached.items()}
+
+    missing = keys - urls.keys()
+    if missing:
+        fresh, entries, timeout = _sign(missing)
+        await cache.aset_many(entries, timeout=timeout)
+        urls.update(fresh)
+    return urls
+
+
+def delivery_url(key):
+    """Return the signed delivery URL for a single storage reference."""
+    return delivery_urls([key]).get(key)
+
+
+async def adelivery_url(key):
+    """Async version of :func:`delivery_url`."""
+    return (await adelivery_urls([key])).get(key)
@@ -0,0 +1,147 @@
+"""Responsive image derivatives.
+
+Every uploaded image gets downscaled copies (``CAPSULES_IMAGE_SIZES``,
+thumbnail / medium / large by default) in WebP with a JPEG fallback, so
+pages can use ``srcset`` instead of downloading full-resolution photos.
+
+Resizing is CPU bound, so it runs in a process pool of
+``CAPSULES_DERIVATIVE_WORKERS`` processes (0 renders in the calling
+thread). It is started from the upload pipeline's worker threads, never
+from a request thread. The rendered files are stored next to the original
+and their storage references saved in ``derivatives`` of the blob and of
+every content sharing it::
+
+    {'thumb': {'width': 320, 'height': 240, 'webp': 'local:..', 'jpeg': 'local:..'}, ...}
+
+A failure only means the page falls back to the original image.
+"""
+
+import logging
+import multiprocessing
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+from .imaging import FORMATS, render_derivatives
+from .models import CapsuleContent, ContentBlob, TimeCapsule
+from .storage import make_ref
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = {
+    'thumb': 320,
+    'medium': 960,
+    'large': 1920,
+}
+DEFAULT_WORKERS = 2
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def image_sizes():
+    """Size name -> longest side in pixels of the derivatives to build."""
+    return getattr(settings, 'CAPSULES_IMAGE_SIZES', DEFAULT_SIZES)
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned rather than forked: the pool is created from threads
+            _pool = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'CAPSULES_DERIVATIVE_WORKERS', DEFAULT_WORKERS),
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+
+def _render(source, out_dir):
+    if getattr(settings, 'CAPSULES_DERIVATIVE_WORKERS', DEFAULT_WORKERS):
+        return _get_pool().submit(render_derivatives, source, out_dir, image_sizes()).result()
+    return render_derivatives(source, out_dir, image_sizes())
+
+
+def build_derivatives(content_id, source, storage, blob_id=None):
+    """
+    Render, store and record the derivatives of one image.
+
+    Args:
+        content_id: Primary key of the CapsuleContent
+        source: Path of the original image on local disk
+        storage: Storage backend to store the derivatives in
+        blob_id: Primary key of the image's ContentBlob; the derivatives
+            are then recorded for every content sharing it
+
+    Returns:
+        dict: The recorded derivatives, empty if rendering failed
+    """
+    derivatives = {}
+    try:
+        with tempfile.TemporaryDirectory() as out_dir:
+            for name, rendered in _render(source, out_dir).items():
+                entry = {'width': rendered['width'], 'height': rendered['height']}
+                for ext in FORMATS:
+                    with open(rendered[ext], 'rb') as f:
+                        key = storage.save(f'{name}.{ext}', f, 'image')
+                    entry[ext] = make_ref(storage.name, key)
+                derivatives[name] = entry
+    except Exception as e:
+        logger.warning("Could not build derivatives for content %s: %s", content_id, e)
+        return {}
+    if blob_id:
+        ContentBlob.objects.filter(pk=blob_id).update(derivatives=derivatives)
+        CapsuleContent.objects.filter(blob_id=blob_id).update(derivatives=derivatives)
+        TimeCapsule.objects.filter(contents__blob_id=blob_id).bump_version()
+    else:
+        CapsuleContent.objects.filter(pk=content_id).update(derivatives=derivatives)
+        TimeCapsule.objects.filter(contents=content_id).bump_version()
+    logger.info("Built %s derivatives for content %s", len(derivatives), content_id)
+    return derivatives
+
+
+def derivative_refs(derivatives):
+    """All storage references in a ``derivatives`` value."""
+    return [
+        entry[ext]
+        for entry in (derivatives or {}).values()
+        for ext in FORMATS
+        if entry.get(ext)
+    ]
+
+
+def srcset(derivatives, ext, urls):
+    """
+    Build a ``srcset`` attribute value.
+
+    Args:
+        derivatives: A ``CapsuleContent.derivatives`` value
+        ext: 'webp' or 'jpeg'
+        urls: Storage reference -> delivery URL
+
+    Returns:
+        str: e.g. ``"/files/a/ 320w, /files/b/ 960w"``, or '' if none
+    """
+    entries = sorted((derivatives or {}).values(), key=lambda entry: entry['width'])
+    return ', '.join(
+        f"{urls[entry[ext]]} {entry['width']}w"
+        for entry in entries
+        if urls.get(entry.get(ext))
+    )
+
+
+def fallback_url(derivatives, urls, preferred='medium'):
+    """
+    URL of the JPEG to use as ``src`` for browsers without ``srcset``.
+
+    Uses the preferred size if it exists, otherwise the largest one.
+
+    Returns:
+        str: Delivery URL, or None if there are no derivatives
+    """
+    if not derivatives:
+        return None
+    entry = derivatives.get(preferred) or max(derivatives.values(), key=lambda e: e['width'])
+    return urls.get(entry.get('jpeg'))
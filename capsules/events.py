@@ -0,0 +1,268 @@
+"""Server-sent status events for the capsules on a page.
+
+Pages showing capsules that are yet to unlock open one ``EventSource`` on
+:func:`capsule_events` with the ids of those capsules. The stream answers
+with the current status of each (so a reconnecting client catches up) and
+then pushes an event whenever one of them changes::
+
+    event: status
+    data: {"id": 12, "status": "unlocked", "unlock_date": "2026-01-01T00:00:00Z"}
+
+A capsule that is deleted, or made private by its owner, is reported once
+with the status ``"gone"``.
+
+All streams of a process share one :class:`StatusHub`. Instead of every
+client polling, the hub runs a single query over all watched capsules
+whenever one of them reaches its unlock date, and otherwise every
+``CAPSULES_EVENTS_POLL_INTERVAL`` seconds to notice edits, locks and
+deletes. Unlocks are pushed the moment they happen without any query per
+client, so popular unlock times no longer cause a wave of page reloads.
+
+The stream is meant to be served by ``time_capsule.asgi``, where a waiting
+client costs no thread. Under WSGI every open stream would hold a worker,
+so there the response carries the current statuses only and the client
+reconnects after ``CAPSULES_EVENTS_POLL_INTERVAL`` seconds. ASGI streams
+end after ``CAPSULES_EVENTS_MAX_AGE`` seconds, and the browser reconnects
+on its own.
+"""
+
+import asyncio
+import json
+import logging
+import weakref
+from dataclasses import dataclass, field
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+
+from .models import TimeCapsule
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 15
+DEFAULT_MAX_AGE = 300
+DEFAULT_KEEPALIVE = 20
+DEFAULT_MAX_CAPSULES = 100
+
+# Columns the hub compares between checks
+STATE_FIELDS = ('pk', 'effective_status', 'unlock_date', 'is_public', 'creator_id')
+
+
+@dataclass(eq=False)
+class Subscription:
+    """One client's view of the hub.
+
+    Attributes:
+        user_id: Primary key of the watching user
+        ids: Capsules the client watches; shrinks as capsules go away
+        queue: Events waiting to be sent to the client
+    """
+    user_id: int
+    ids: set
+    queue: asyncio.Queue = field(default_factory=asyncio.Queue)
+
+    def can_see(self, state):
+        """Whether the user may still see a capsule in ``state``."""
+        return state['creator_id'] == self.user_id or state['is_public']
+
+
+def status_event(state):
+    """The ``status`` event payload of a capsule state."""
+    return {
+        'id': state['pk'],
+        'status': state['effective_status'],
+        'unlock_date': state['unlock_date'],
+    }
+
+
+async def load_states(ids, now=None):
+    """
+    Current state of the capsules in ``ids``.
+
+    Args:
+        ids: Capsule primary keys
+        now: Reference time for the effective status
+
+    Returns:
+        dict: pk -> dict of STATE_FIELDS, for the capsules that exist
+    """
+    queryset = (
+        TimeCapsule.objects.filter(pk__in=ids)
+        .with_effective_status(now or timezone.now())
+        .values(*STATE_FIELDS)
+    )
+    return {row['pk']: row async for row in queryset}
+
+
+class StatusHub:
+    """Watches the capsules of every open stream of one event loop."""
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._states = {}
+        self._changed = asyncio.Event()
+        self._task = None
+
+    def subscribe(self, user_id, states):
+        """
+        Start watching capsules for a client.
+
+        Args:
+            user_id: Primary key of the watching user
+            states: Current states of the capsules, as from :func:`load_states`
+
+        Returns:
+            Subscription: Receives an event per status change
+        """
+        subscription = Subscription(user_id=user_id, ids=set(states))
+        self._subscriptions.add(subscription)
+        for pk, state in states.items():
+            self._states.setdefault(pk, state)
+        # Wake the loop; a new capsule may unlock before the next check
+        self._changed.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop watching the capsules of ``subscription``."""
+        self._subscriptions.discard(subscription)
+        watched = self.watched()
+        for pk in list(self._states):
+            if pk not in watched:
+                del self._states[pk]
+        if not self._subscriptions:
+            # Let the loop end instead of sleeping until the next poll
+            self._changed.set()
+
+    def watched(self):
+        """Ids of all capsules watched by some client."""
+        return set().union(*(s.ids for s in self._subscriptions))
+
+    def _next_check(self, now):
+        """Seconds until the next check: a poll or the next unlock."""
+        delay = getattr(settings, 'CAPSULES_EVENTS_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+        for state in self._states.values():
+            if state['effective_status'] in TimeCapsule.DUE_STATUSES:
+                delay = min(delay, (state['unlock_date'] - now).total_seconds())
+        return max(delay, 0)
+
+    async def _run(self):
+        while self._subscriptions:
+            try:
+                await asyncio.wait_for(
+                    self._changed.wait(), self._next_check(timezone.now())
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._changed.clear()
+            if not self._subscriptions:
+                break
+            try:
+                await self.check()
+            except Exception:
+                logger.exception("Checking the status of watched capsules failed")
+
+    async def check(self, now=None):
+        """Load the watched capsules once and notify clients of changes."""
+        watched = self.watched()
+        if not watched:
+            return
+        states = await load_states(watched, now)
+        for subscription in list(self._subscriptions):
+            for pk in list(subscription.ids):
+                state = states.get(pk)
+                if state is None or not subscription.can_see(state):
+                    subscription.ids.discard(pk)
+                    subscription.queue.put_nowait({'id': pk, 'status': 'gone'})
+                elif state['effective_status'] != self._states[pk]['effective_status'] \
+                        or state['unlock_date'] != self._states[pk]['unlock_date']:
+                    subscription.queue.put_nowait(status_event(state))
+        # Capsules subscribed to while the query ran keep their own state
+        self._states = {
+            pk: states[pk] if pk in states else self._states[pk]
+            for pk in self.watched()
+        }
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def get_hub():
+    """The StatusHub of the running event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _hubs:
+        _hubs[loop] = StatusHub()
+    return _hubs[loop]
+
+
+def _format(event, name='status'):
+    return f'event: {name}\ndata: {json.dumps(event, cls=DjangoJSONEncoder)}\n\n'
+
+
+async def _stream(hub, subscription, states):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + getattr(settings, 'CAPSULES_EVENTS_MAX_AGE', DEFAULT_MAX_AGE)
+    keepalive = getattr(settings, 'CAPSULES_EVENTS_KEEPALIVE', DEFAULT_KEEPALIVE)
+    try:
+        # Reconnect right away when the stream ends
+        yield 'retry: 1000\n\n'
+        for state in states.values():
+            yield _format(status_event(state))
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                event = await asyncio.wait_for(
+                    subscription.queue.get(), min(keepalive, remaining)
+                )
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle connection
+                yield ': keepalive\n\n'
+                continue
+            yield _format(event)
+    finally:
+        hub.unsubscribe(subscription)
+
+
+async def capsule_events(request):
+    """
+    Stream status events for the capsules in ``?ids=``.
+
+    Only capsules the user may view (see ``TimeCapsule.visible_to``) are
+    watched; others are silently left out.
+
+    Args:
+        request: The HTTP request
+
+    Returns:
+        StreamingHttpResponse: A ``text/event-stream``
+    """
+    user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    if user is None:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    try:
+        ids = {int(pk) for pk in request.GET.get('ids', '').split(',') if pk.strip()}
+    except ValueError:
+        return JsonResponse({'error': 'ids must be a comma-separated list of integers.'}, status=400)
+    if len(ids) > getattr(settings, 'CAPSULES_EVENTS_MAX_CAPSULES', DEFAULT_MAX_CAPSULES):
+        return JsonResponse({'error': 'Too many capsules.'}, status=400)
+
+    visible = TimeCapsule.objects.visible_to(user).filter(pk__in=ids).values_list('pk', flat=True)
+    states = await load_states([pk async for pk in visible])
+    if isinstance(request, ASGIRequest):
+        hub = get_hub()
+        content = _stream(hub, hub.subscribe(user.pk, states), states)
+    else:
+        retry = getattr(settings, 'CAPSULES_EVENTS_POLL_INTERVAL', DEFAULT_POLL_INTERVAL) * 1000
+        content = [f'retry: {retry}\n\n'] + [
+            _format(status_event(state)) for state in states.values()
+        ]
+
+    response = StreamingHttpResponse(content, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Disable response buffering in nginx-style proxies
+    response['X-Accel-Buffering'] = 'no'
+    return response
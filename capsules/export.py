@@ -0,0 +1,241 @@
+"""Streaming ZIP export of a capsule's files.
+
+The archive is produced while it is being sent: :func:`stream_zip` is a
+generator for a ``StreamingHttpResponse`` that yields the archive in
+chunks of about ``CAPSULES_EXPORT_CHUNK_SIZE`` bytes. ZIP entries are
+written one after another, each as soon as its bytes arrive from storage,
+with sizes and checksums in data descriptors so nothing has to be seeked
+back to.
+
+Files are fetched by a pool of ``CAPSULES_EXPORT_CONCURRENCY`` threads:
+while one entry is being written, the next ones are already downloading.
+Every fetch hands its chunks over through a small bounded queue, so at
+most ``concurrency * BUFFERED_CHUNKS`` chunks are held in memory however
+big the capsule or its files are; a fetch that is ahead simply waits.
+
+A file that cannot be fetched at all is left out and listed in an
+``export-errors.txt`` entry at the end of the archive. A failure in the
+middle of a file aborts the download, which the client sees as a
+truncated archive.
+"""
+
+import logging
+import os
+import queue
+import re
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .storage import get_content_storage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Chunks a fetch may read ahead of the archive writer
+BUFFERED_CHUNKS = 4
+
+# Already compressed content types are stored rather than deflated
+STORED_TYPES = ('image', 'video')
+
+ERRORS_NAME = 'export-errors.txt'
+
+
+@dataclass
+class ExportEntry:
+    """One file of an export.
+
+    Attributes:
+        name: Path of the file inside the archive
+        backend: Name of the storage backend holding the file
+        key: Backend-specific key of the file
+        size: Size in bytes, None if unknown
+        modified: When the file was uploaded
+        compress: Whether to deflate the file
+    """
+    name: str
+    backend: str
+    key: str
+    size: int = None
+    modified: datetime = None
+    compress: bool = True
+
+
+def _chunk_size():
+    return getattr(settings, 'CAPSULES_EXPORT_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+def _safe_name(title, fallback):
+    name = re.sub(r'[\x00-\x1f/\\:*?"<>|]+', '_', title or '').strip(' ._')
+    return name[:120] or fallback
+
+
+def export_entries(contents):
+    """
+    Describe the files of ``contents`` as archive entries.
+
+    Names come from the content titles plus the stored file's extension;
+    clashes get a `` (2)``, `` (3)``... suffix.
+
+    Args:
+        contents: Iterable of CapsuleContent with a stored file, with
+            their blob selected
+
+    Returns:
+        list: ExportEntry per content, in the order given
+    """
+    entries, taken = [], set()
+    for content in contents:
+        stem = _safe_name(content.title, f'content-{content.pk}')
+        ext = os.path.splitext(content.storage_key)[1].lower()
+        name, n = f'{stem}{ext}', 1
+        while name.lower() in taken or name == ERRORS_NAME:
+            n += 1
+            name = f'{stem} ({n}){ext}'
+        taken.add(name.lower())
+        entries.append(ExportEntry(
+            name=name,
+            backend=content.storage_backend,
+            key=content.storage_key,
+            size=content.blob.size if content.blob_id else None,
+            modified=content.uploaded_at,
+            compress=content.content_type not in STORED_TYPES,
+        ))
+    return entries
+
+
+def archive_name(capsule):
+    """File name offered for the export of ``capsule``."""
+    return f'{slugify(capsule.title) or f"capsule-{capsule.pk}"}.zip'
+
+
+class _StreamBuffer:
+    """Write-only, unseekable file collecting what ZipFile writes."""
+
+    def __init__(self):
+        self._chunks = []
+        self.pending = 0
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.pending += len(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        """Take everything written since the last call."""
+        data = b''.join(self._chunks)
+        self._chunks, self.pending = [], 0
+        return data
+
+
+def _put(chunks, item, cancelled):
+    # Wait for room, but give up once the download was abandoned
+    while not cancelled.is_set():
+        try:
+            chunks.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _fetch(entry, chunks, cancelled):
+    """Read one file into ``chunks``, ending with None or the exception."""
+    try:
+        with get_content_storage(entry.backend).open(entry.key) as f:
+            while not cancelled.is_set():
+                chunk = f.read(_chunk_size())
+                if not chunk:
+                    break
+                if not _put(chunks, chunk, cancelled):
+                    return
+    except Exception as e:
+        _put(chunks, e, cancelled)
+    else:
+        _put(chunks, None, cancelled)
+
+
+def _zipinfo(entry):
+    modified = timezone.localtime(entry.modified) if entry.modified else timezone.localtime()
+    info = zipfile.ZipInfo(entry.name, date_time=modified.timetuple()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED if entry.compress else zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    info.file_size = entry.size or 0
+    return info
+
+
+def stream_zip(entries, concurrency=None):
+    """
+    Generate a ZIP archive of ``entries`` chunk by chunk.
+
+    Args:
+        entries: List of ExportEntry, in archive order
+        concurrency: Files fetched at the same time, defaults to
+            CAPSULES_EXPORT_CONCURRENCY
+
+    Yields:
+        bytes: The next part of the archive
+    """
+    concurrency = concurrency or getattr(settings, 'CAPSULES_EXPORT_CONCURRENCY', DEFAULT_CONCURRENCY)
+    chunk_size = _chunk_size()
+    buffer = _StreamBuffer()
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='capsule-export')
+    upcoming = iter(entries)
+    fetching = deque()
+    failed = []
+
+    def fetch_next():
+        entry = next(upcoming, None)
+        if entry is not None:
+            chunks = queue.Queue(BUFFERED_CHUNKS)
+            executor.submit(_fetch, entry, chunks, cancelled)
+            fetching.append((entry, chunks))
+
+    try:
+        for _ in range(concurrency):
+            fetch_next()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            while fetching:
+                entry, chunks = fetching.popleft()
+                item = chunks.get()
+                if isinstance(item, Exception):
+                    logger.warning("Leaving %s (%s) out of an export: %s", entry.name, entry.key, item)
+                    failed.append(entry.name)
+                else:
+                    # Sizes of legacy files are unknown; reserve room for large ones
+                    with archive.open(_zipinfo(entry), 'w', force_zip64=entry.size is None) as out:
+                        while item is not None:
+                            if isinstance(item, Exception):
+                                raise item
+                            out.write(item)
+                            if buffer.pending >= chunk_size:
+                                yield buffer.pop()
+                            item = chunks.get()
+                fetch_next()
+            if failed:
+                archive.writestr(
+                    ERRORS_NAME,
+                    'These files could not be exported:\n' + ''.join(f'{name}\n' for name in failed),
+                )
+        yield buffer.pop()
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -1,6 +1,11 @@
+import zipfile
+
 from django import forms
+from django.template.defaultfilters import filesizeformat
 from django.utils import timezone
 from .models import TimeCapsule, CapsuleContent
+from .sniffing import sniff_file
+from .uploads import max_upload_size
 from allauth.account.forms import LoginForm
 
 class TimeCapsuleForm(forms.ModelForm):
@@ -56,7 +61,7 @@ class CapsuleContentForm(forms.ModelForm):
     This form handles:
     - Content metadata (title, description)
     - File uploads with size validation
-    - File type validation
+    - File type validation against the file's magic bytes
     - Optional file field when editing existing content
     - Bootstrap styling for form fields
     """
@@ -79,8 +84,8 @@ class CapsuleContentForm(forms.ModelForm):
         """Initialize the form with custom field requirements."""
         super().__init__(*args, **kwargs)
         self.fields['description'].required = True
-        if self.instance and self.instance.pk:
-            self.fields['file'].required = False
+        # A file is only required when creating content
+        self.fields['file'].required = not (self.instance and self.instance.pk)
 
     def clean(self):
         """Validate the form data."""
@@ -88,23 +93,104 @@ class CapsuleContentForm(forms.ModelForm):
         file = cleaned_data.get('file')
         content_type = cleaned_data.get('content_type')
 
+        self.sniffed = None
         if file and not isinstance(file, str):
-            # Check file size
-            if file.size > 5 * 1024 * 1024:  # 5MB limit
-                raise forms.ValidationError("File size must be under 5MB.")
+            # Check file size; large files arrive through chunked uploads
+            if file.size > max_upload_size():
+                raise forms.ValidationError(
+                    f"File size must be under {filesizeformat(max_upload_size())}."
+                )
 
-            # Check file type matches content_type
-            if content_type == 'image' and not file.content_type.startswith('image/'):
+            # Check what the file really is, not what the browser claims
+            self.sniffed = sniff_file(file)
+            if not self.sniffed.is_supported:
+                raise forms.ValidationError(
+                    f"Unsupported file type ({self.sniffed.mime_type})."
+                )
+            if content_type == 'image' and self.sniffed.content_type != 'image':
                 raise forms.ValidationError("File must be an image for image content type.")
-            elif content_type == 'video' and not file.content_type.startswith('video/'):
+            elif content_type == 'video' and self.sniffed.content_type != 'video':
                 raise forms.ValidationError("File must be a video for video content type.")
-            elif content_type == 'document' and not any(
-                file.content_type.startswith(t) for t in ['application/', 'text/']
-            ):
+            elif content_type == 'document' and self.sniffed.content_type != 'document':
                 raise forms.ValidationError("File must be a document for document content type.")
 
         return cleaned_data
 
+class MultipleFileInput(forms.ClearableFileInput):
+    """File input that lets the user pick several files."""
+    allow_multiple_selected = True
+
+
+class MultipleFileField(forms.FileField):
+    """File field whose cleaned value is a list of uploaded files."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('widget', MultipleFileInput(attrs={'class': 'form-control'}))
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        if isinstance(data, (list, tuple)):
+            return [super(MultipleFileField, self).clean(d, initial) for d in data]
+        return [super().clean(data, initial)]
+
+
+class CapsuleContentBulkForm(forms.Form):
+    """
+    Form for adding many files to a time capsule at once.
+    
+    Titles and content types are inferred from each file, and each file is
+    validated on its own by capsules.bulk, so one bad file does not reject
+    the whole batch.
+    """
+    
+    files = MultipleFileField(help_text="Select as many files as you like")
+
+class CapsuleImportForm(forms.Form):
+    """
+    Form for importing a ZIP file of many files into a new time capsule.
+    
+    Every capsule field is optional here; what is left empty is taken from
+    the archive's manifest.json (see capsules.imports).
+    """
+    
+    archive = forms.FileField(
+        help_text="A ZIP file, optionally with a manifest.json",
+        widget=forms.FileInput(attrs={'class': 'form-control', 'accept': '.zip,application/zip'})
+    )
+    title = forms.CharField(
+        max_length=200,
+        required=False,
+        widget=forms.TextInput(attrs={'class': 'form-control'})
+    )
+    description = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={'class': 'form-control', 'rows': 4})
+    )
+    unlock_date = forms.DateTimeField(
+        required=False,
+        widget=forms.DateTimeInput(
+            attrs={'type': 'datetime-local', 'class': 'form-control'},
+            format='%Y-%m-%dT%H:%M'
+        )
+    )
+    is_public = forms.BooleanField(required=False, label="Make the capsule public")
+
+    def clean_archive(self):
+        """
+        Validate that the upload is a ZIP file.
+        
+        Returns:
+            UploadedFile: The archive
+            
+        Raises:
+            ValidationError: If the file is not a ZIP file
+        """
+        archive = self.cleaned_data['archive']
+        if not zipfile.is_zipfile(archive):
+            raise forms.ValidationError("The file must be a ZIP archive.")
+        archive.seek(0)
+        return archive
+
 class CustomLoginForm(LoginForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -0,0 +1,164 @@
+"""Per-user cache of rendered capsule cards and content blocks.
+
+The list and detail pages render the same markup for every visit until a
+capsule or one of its contents changes. Each capsule card and each content
+block is therefore cached on its own, keyed by the viewing user (dates are
+rendered in their time zone), the capsule's ``version`` and its effective
+status::
+
+    capsules:fragment:<kind>:<user>:<pk>:<version>:<status>
+
+``TimeCapsule.version`` changes whenever the capsule or any of its contents
+is saved or deleted (see :func:`bump_capsule_version` and friends, connected
+in ``CapsulesConfig.ready``), so stale entries are never read again and
+simply expire. The effective status in the key switches a capsule's entries
+over the moment its unlock date passes, and entries of capsules that are
+yet to unlock expire at the unlock date.
+
+Fragments embed signed delivery URLs, which may have as little as
+``CAPSULES_DELIVERY_URL_MARGIN`` seconds left when they are taken from the
+URL cache, so entries never live longer than that either.
+
+A page reads all of its fragments with one ``get_many`` and renders and
+stores only the missing ones. ``CAPSULES_FRAGMENT_CACHE_TIMEOUT = 0``
+disables the cache.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from .delivery import DEFAULT_MARGIN
+
+DEFAULT_TIMEOUT = 300
+
+
+def fragment_timeout(capsule, now=None):
+    """
+    Seconds a fragment of ``capsule`` may be cached.
+
+    Args:
+        capsule: The TimeCapsule the fragment belongs to
+        now: Reference time, defaults to the current time
+
+    Returns:
+        int: Timeout in seconds, 0 if the fragment must not be cached
+    """
+    timeout = min(
+        getattr(settings, 'CAPSULES_FRAGMENT_CACHE_TIMEOUT', DEFAULT_TIMEOUT),
+        getattr(settings, 'CAPSULES_DELIVERY_URL_MARGIN', DEFAULT_MARGIN),
+    )
+    if capsule.effective_status != 'unlocked':
+        until_unlock = (capsule.unlock_date - (now or timezone.now())).total_seconds()
+        timeout = min(timeout, int(until_unlock))
+    return max(timeout, 0)
+
+
+def fragment_key(kind, user, pk, capsule):
+    """
+    Cache key of one fragment.
+
+    Args:
+        kind: 'card' or 'content'
+        user: The viewing user
+        pk: Primary key of the rendered object
+        capsule: The capsule the object belongs to (or is)
+
+    Returns:
+        str: The cache key
+    """
+    return (
+        f'capsules:fragment:{kind}:{user.pk}:{pk}:'
+        f'{capsule.version.hex}:{capsule.effective_status}'
+    )
+
+
+def _plan(kind, user, items, now):
+    """Timeouts and cache keys of ``items``; uncacheable items get no key."""
+    timeouts = {pk: fragment_timeout(capsule, now) for pk, capsule in items}
+    keys = {
+        pk: fragment_key(kind, user, pk, capsule)
+        for pk, capsule in items
+        if timeouts[pk]
+    }
+    return timeouts, keys
+
+
+def _entries_by_timeout(rendered, keys, timeouts):
+    # Entries of one page mostly share a timeout; store them per timeout
+    by_timeout = {}
+    for pk, html in rendered.items():
+        if pk in keys:
+            by_timeout.setdefault(timeouts[pk], {})[keys[pk]] = html
+    return by_timeout
+
+
+def cached_fragments(kind, user, items, render_missing, now=None):
+    """
+    Return the rendered fragments of ``items``, rendering only cache misses.
+
+    Args:
+        kind: 'card' or 'content'
+        user: The viewing user
+        items: List of ``(pk, capsule)`` pairs, in page order
+        render_missing: Callable taking the list of missing pks and
+            returning a dict of pk -> rendered HTML
+        now: Reference time for the timeouts, defaults to the current time
+
+    Returns:
+        list: Rendered HTML per item, in the order given
+    """
+    timeouts, keys = _plan(kind, user, items, now or timezone.now())
+    found = cache.get_many(list(keys.values())) if keys else {}
+    fragments = {pk: found[key] for pk, key in keys.items() if key in found}
+
+    missing = [pk for pk, _ in items if pk not in fragments]
+    if missing:
+        rendered = render_missing(missing)
+        fragments.update(rendered)
+        for timeout, entries in _entries_by_timeout(rendered, keys, timeouts).items():
+            cache.set_many(entries, timeout=timeout)
+    return [mark_safe(fragments[pk]) for pk, _ in items]
+
+
+async def acached_fragments(kind, user, items, render_missing, now=None):
+    """
+    Async version of :func:`cached_fragments`.
+
+    ``render_missing`` is a coroutine function here, and the cache is read
+    and written through the async cache API.
+    """
+    timeouts, keys = _plan(kind, user, items, now or timezone.now())
+    found = await cache.aget_many(list(keys.values())) if keys else {}
+    fragments = {pk: found[key] for pk, key in keys.items() if key in found}
+
+    missing = [pk for pk, _ in items if pk not in fragments]
+    if missing:
+        rendered = await render_missing(missing)
+        fragments.update(rendered)
+        for timeout, entries in _entries_by_timeout(rendered, keys, timeouts).items():
+            await cache.aset_many(entries, timeout=timeout)
+    return [mark_safe(fragments[pk]) for pk, _ in items]
+
+
+def bump_capsule_version(sender, instance, update_fields=None, **kwargs):
+    """pre_save receiver giving a saved TimeCapsule a new version."""
+    if update_fields is None or 'version' in update_fields:
+        instance.new_version()
+
+
+def bump_partial_save(sender, instance, created=False, update_fields=None, **kwargs):
+    """post_save receiver covering saves whose update_fields omit version."""
+    if update_fields is not None and 'version' not in update_fields:
+        type(instance).objects.filter(pk=instance.pk).bump_version()
+
+
+def content_changed(sender, instance, origin=None, **kwargs):
+    """post_save/post_delete receiver bumping a content's capsule."""
+    from .models import TimeCapsule
+
+    if origin is not None and getattr(origin, 'model', type(origin)) is not sender:
+        # Cascade from deleting the capsule (or its owner); nothing to invalidate
+        return
+    TimeCapsule.objects.filter(pk=instance.capsule_id).bump_version()
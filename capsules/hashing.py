@@ -0,0 +1,98 @@
+"""Content digests of uploaded files.
+
+Uploads are deduplicated by the SHA-256 of their bytes (see
+``ContentBlob``). To avoid reading a file a second time just to hash it,
+the upload handlers below hash every chunk as Django's multipart parser
+receives it and attach the result to the uploaded file as
+``content_digest``. Enable them with::
+
+    FILE_UPLOAD_HANDLERS = [
+        'capsules.hashing.HashingMemoryFileUploadHandler',
+        'capsules.hashing.HashingTemporaryFileUploadHandler',
+    ]
+
+:func:`file_digest` falls back to hashing the file for anything that did
+not arrive through them.
+"""
+
+import hashlib
+
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler,
+    TemporaryFileUploadHandler,
+)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def new_hasher():
+    """A fresh hash object of the algorithm used for content digests."""
+    return hashlib.sha256()
+
+
+class HashingUploadHandlerMixin:
+    """Hash the chunks of each file that this handler stores."""
+
+    def _hashes(self):
+        return True
+
+    def new_file(self, *args, **kwargs):
+        # Before super(): the memory handler ends new_file by raising StopFutureHandlers
+        self.hasher = new_hasher()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self._hashes():
+            self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is not None:
+            uploaded.content_digest = self.hasher.hexdigest()
+        return uploaded
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    """MemoryFileUploadHandler that records ``content_digest``."""
+
+    def _hashes(self):
+        # Files too large for memory are passed on, and hashed, by the next handler
+        return self.activated
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    """TemporaryFileUploadHandler that records ``content_digest``."""
+
+
+def file_digest(fileobj):
+    """
+    Content digest of an open file.
+
+    Uses the digest computed during the upload when there is one; otherwise
+    hashes the file and restores its read position.
+
+    Args:
+        fileobj: Uploaded file or seekable file-like object
+
+    Returns:
+        str: Hex digest
+    """
+    digest = getattr(fileobj, 'content_digest', None)
+    if digest:
+        return digest
+    hasher = new_hasher()
+    position = fileobj.tell()
+    try:
+        fileobj.seek(0)
+        for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    finally:
+        fileobj.seek(position)
+    return hasher.hexdigest()
+
+
+def path_digest(path):
+    """Content digest of the file at ``path``."""
+    with open(path, 'rb') as f:
+        return file_digest(f)
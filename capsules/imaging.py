@@ -0,0 +1,68 @@
+"""Image resizing with Pillow.
+
+Runs in worker processes of capsules.derivatives, so this module only
+depends on Pillow and never touches Django.
+"""
+
+import os
+
+from PIL import Image, ImageOps
+
+# Output formats of every derivative; browsers without WebP get the JPEG
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+
+def _flatten(image):
+    """Return an RGB copy of ``image``, compositing transparency onto white."""
+    if image.mode == 'RGB':
+        return image
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_derivatives(source, out_dir, sizes):
+    """
+    Write downscaled copies of an image in every format of FORMATS.
+
+    Sizes are rendered from largest to smallest, each from the previous
+    one, and JPEGs are decoded at reduced scale where possible. A size is
+    skipped when the image is not larger than it, except for the smallest
+    size, which is always written.
+
+    Args:
+        source: Path of the original image
+        out_dir: Directory to write the derivatives to
+        sizes: Mapping of size name -> longest side in pixels
+
+    Returns:
+        dict: Size name -> ``{'width', 'height', 'webp', 'jpeg'}``, where
+        the formats map to the paths of the written files
+    """
+    ordered = sorted(sizes.items(), key=lambda item: item[1], reverse=True)
+    smallest = ordered[-1][0]
+    results = {}
+    with Image.open(source) as original:
+        # Let the JPEG decoder downscale by up to 8x while decoding
+        original.draft('RGB', (ordered[0][1], ordered[0][1]))
+        image = _flatten(ImageOps.exif_transpose(original))
+        longest = max(image.size)
+        for name, side in ordered:
+            if longest <= side and name != smallest:
+                continue
+            if max(image.size) > side:
+                image = image.copy()
+                image.thumbnail((side, side), Image.LANCZOS)
+            entry = {'width': image.width, 'height': image.height}
+            for ext, options in FORMATS.items():
+                path = os.path.join(out_dir, f'{name}.{ext}')
+                image.save(path, **options)
+                entry[ext] = path
+            results[name] = entry
+    return results
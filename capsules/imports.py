@@ -0,0 +1,482 @@
+"""Bulk import of a ZIP file or directory into a new time capsule.
+
+Family archives hold thousands of files, which take hours to add one
+``content_add`` request at a time. An import instead:
+
+1. reads the source's optional ``manifest.json``, lists its files in a
+   fixed order and creates the TimeCapsule and an ImportJob
+   (:func:`start_import`),
+2. adds the files in batches of ``CAPSULES_IMPORT_BATCH_SIZE`` through
+   capsules.bulk, which uploads a batch to storage in parallel and creates
+   its rows with a single ``bulk_create`` (:func:`run_import`),
+3. advances the job in the same transaction that creates each batch, so
+   an interrupted import resumes after the last committed batch and never
+   adds a file twice.
+
+After every batch the job records its position and the throughput of the
+current run, which the management command prints as it goes.
+
+The manifest, every key of which is optional::
+
+    {
+        "title": "Letters from grandma",
+        "description": "Scanned by Anna in 2024",
+        "unlock_date": "2040-01-01T00:00:00Z",
+        "is_public": false,
+        "files": [
+            "letters/1952.pdf",
+            {"path": "photos/wedding.jpg", "title": "Wedding", "description": "June 1953"}
+        ]
+    }
+
+Without ``files`` every file of the source is imported in path order,
+leaving out hidden files and ``__MACOSX`` folders.
+
+``manage.py import_capsule`` imports ZIP files and directories on the
+server; the ``capsule/import/`` view imports an uploaded ZIP file in the
+background.
+
+Settings:
+
+- ``CAPSULES_IMPORT_BATCH_SIZE``: files added per batch
+- ``CAPSULES_IMPORT_WORKERS``: background imports per process; 0 imports
+  in process when the transaction commits (used by tests)
+- ``CAPSULES_IMPORT_DIR``: where uploaded archives wait for their import
+- ``CAPSULES_BULK_UPLOAD_CONCURRENCY``: storage uploads per batch
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+
+from .bulk import add_files, infer_title
+from .models import ImportJob
+from .uploads import COPY_BUFFER_SIZE, max_upload_size
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_WORKERS = 1
+
+MANIFEST_NAME = 'manifest.json'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ImportSourceError(Exception):
+    """Raised when an import source, its manifest or one of its files cannot be used."""
+
+
+class _Superseded(Exception):
+    """Raised when another run has advanced the same import."""
+
+
+def import_dir():
+    """Directory holding uploaded archives until they are imported."""
+    return getattr(
+        settings,
+        'CAPSULES_IMPORT_DIR',
+        os.path.join(tempfile.gettempdir(), 'capsule_imports'),
+    )
+
+
+def _is_hidden(path):
+    return any(part.startswith('.') or part == '__MACOSX' for part in path.split('/'))
+
+
+class _Source:
+    """Files of an import source, addressed by '/'-separated relative path."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        pass
+
+    def manifest(self):
+        """The parsed manifest, empty if the source has none."""
+        data = self.read_manifest()
+        if data is None:
+            return {}
+        try:
+            manifest = json.loads(data)
+        except ValueError as e:
+            raise ImportSourceError(f"{MANIFEST_NAME} is not valid JSON: {e}")
+        if not isinstance(manifest, dict):
+            raise ImportSourceError(f"{MANIFEST_NAME} must hold a JSON object.")
+        return manifest
+
+    def files(self, manifest):
+        """
+        List the files to import, in import order.
+
+        Args:
+            manifest: The source's manifest
+
+        Returns:
+            list: Dicts with the ``path``, ``title`` and ``description`` of
+            each file
+
+        Raises:
+            ImportSourceError: If the manifest's file list is malformed
+        """
+        listed = manifest.get('files')
+        if listed is None:
+            return [
+                {'path': path, 'title': '', 'description': ''}
+                for path in self.paths()
+                if path != MANIFEST_NAME and not _is_hidden(path)
+            ]
+        if not isinstance(listed, list):
+            raise ImportSourceError(f'"files" in {MANIFEST_NAME} must be a list.')
+        files = []
+        for item in listed:
+            if isinstance(item, str):
+                item = {'path': item}
+            if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+                raise ImportSourceError(f'Every entry of "files" in {MANIFEST_NAME} needs a path.')
+            files.append({
+                'path': item['path'].strip('/'),
+                'title': str(item.get('title') or '')[:200],
+                'description': str(item.get('description') or ''),
+            })
+        return files
+
+
+class _ZipSource(_Source):
+    def __init__(self, path):
+        try:
+            self.archive = zipfile.ZipFile(path)
+        except (OSError, zipfile.BadZipFile) as e:
+            raise ImportSourceError(f"Cannot read the ZIP file: {e}")
+
+    def close(self):
+        self.archive.close()
+
+    def paths(self):
+        return sorted(info.filename for info in self.archive.infolist() if not info.is_dir())
+
+    def read_manifest(self):
+        try:
+            return self.archive.read(MANIFEST_NAME)
+        except KeyError:
+            return None
+
+    def open(self, path):
+        try:
+            info = self.archive.getinfo(path)
+        except KeyError:
+            raise ImportSourceError("Not found in the source.")
+        if info.file_size > max_upload_size():
+            raise ImportSourceError(f"File size must be under {filesizeformat(max_upload_size())}.")
+        # Extract once; sniffing, hashing and uploading each read the file
+        spooled = tempfile.TemporaryFile()
+        try:
+            with self.archive.open(info) as member:
+                shutil.copyfileobj(member, spooled, COPY_BUFFER_SIZE)
+        except BaseException:
+            spooled.close()
+            raise
+        spooled.seek(0)
+        return File(spooled, name=path)
+
+
+class _DirectorySource(_Source):
+    def __init__(self, path):
+        self.root = os.path.realpath(path)
+
+    def paths(self):
+        found = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for name in filenames:
+                found.append(os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, '/'))
+        return sorted(found)
+
+    def read_manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST_NAME), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def open(self, path):
+        full = os.path.realpath(os.path.join(self.root, path))
+        if not full.startswith(self.root + os.sep):
+            raise ImportSourceError("Outside of the source directory.")
+        if not os.path.isfile(full):
+            raise ImportSourceError("Not found in the source.")
+        return File(open(full, 'rb'), name=path)
+
+
+def open_source(path):
+    """
+    Open a ZIP file or directory for importing.
+
+    Args:
+        path: Path of the ZIP file or directory
+
+    Returns:
+        A context manager giving access to the source's files
+
+    Raises:
+        ImportSourceError: If ``path`` is neither
+    """
+    if os.path.isdir(path):
+        return _DirectorySource(path)
+    if os.path.isfile(path):
+        return _ZipSource(path)
+    raise ImportSourceError(f"{path} is neither a ZIP file nor a directory.")
+
+
+def start_import(user, source, name=None, uploaded=False, **fields):
+    """
+    Create the capsule and the job for importing ``source``.
+
+    Capsule fields given here take precedence over the manifest's; the
+    title falls back to one derived from the source's name.
+
+    Args:
+        user: The user importing the files, who will own the capsule
+        source: Path of the ZIP file or directory
+        name: Name to derive a title from, defaults to the source's
+        uploaded: Whether ``source`` is an uploaded archive to remove once
+            the import is done
+        **fields: ``title``, ``description``, ``unlock_date`` and
+            ``is_public`` of the capsule
+
+    Returns:
+        ImportJob: The new job, not started yet
+
+    Raises:
+        ImportSourceError: If the source or its manifest cannot be used, or
+            the capsule fields are invalid
+    """
+    from .forms import TimeCapsuleForm
+
+    source = os.path.abspath(source)
+    with open_source(source) as src:
+        manifest = src.manifest()
+        files = src.files(manifest)
+    if not files:
+        raise ImportSourceError("There are no files to import.")
+
+    form = TimeCapsuleForm({
+        'title': fields.get('title') or manifest.get('title') or infer_title(name or source),
+        'description': fields.get('description') or manifest.get('description') or '',
+        'unlock_date': fields.get('unlock_date') or manifest.get('unlock_date'),
+    })
+    form.fields['description'].required = False
+    if not form.is_valid():
+        raise ImportSourceError(' '.join(
+            f"{field}: {' '.join(errors)}" for field, errors in form.errors.items()
+        ))
+    is_public = fields.get('is_public')
+    with transaction.atomic():
+        capsule = form.save(commit=False)
+        capsule.creator = user
+        capsule.status = 'active'
+        capsule.is_public = bool(manifest.get('is_public')) if is_public is None else is_public
+        capsule.save()
+        job = ImportJob.objects.create(
+            user=user, capsule=capsule, source=source, uploaded=uploaded, total=len(files)
+        )
+    logger.info("Started import %s of %s files from %s", job.pk, job.total, source)
+    return job
+
+
+def run_import(job, batch_size=None, concurrency=None, report=None):
+    """
+    Import the files of ``job`` that have not been handled yet.
+
+    A file that cannot be read or added is recorded in ``job.failures``
+    and does not stop the import. Safe to call again after an interruption
+    or failure; if two runs overlap, the one that falls behind stops.
+
+    Args:
+        job: The ImportJob to run
+        batch_size: Files added per batch, defaults to
+            CAPSULES_IMPORT_BATCH_SIZE
+        concurrency: Storage uploads per batch, defaults to
+            CAPSULES_BULK_UPLOAD_CONCURRENCY
+        report: Called with the job after every batch
+
+    Returns:
+        ImportJob: The job, updated
+
+    Raises:
+        ImportSourceError: If the source no longer matches the import or the
+            capsule is locked; the job is marked failed, as for any other
+            error
+    """
+    batch_size = batch_size or getattr(settings, 'CAPSULES_IMPORT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    ImportJob.objects.filter(pk=job.pk).update(status='running', error='', updated_at=timezone.now())
+    job.status, job.error = 'running', ''
+    started = time.monotonic()
+    run = {'files': 0, 'bytes': 0}
+
+    def advance(count, failures, results):
+        added = [result.content for result in results if result.ok]
+        size = sum(content.blob.size for content in added)
+        failures = failures + [
+            {'path': result.name, 'error': result.error} for result in results if not result.ok
+        ]
+        run['files'] += count
+        run['bytes'] += size
+        elapsed = max(time.monotonic() - started, 1e-6)
+        changes = {
+            'position': job.position + count,
+            'failures': job.failures + failures,
+            'files_per_second': run['files'] / elapsed,
+            'bytes_per_second': run['bytes'] / elapsed,
+        }
+        # Only the run that holds the current position may advance it
+        if not ImportJob.objects.filter(pk=job.pk, position=job.position).update(
+            imported=F('imported') + len(added),
+            bytes_imported=F('bytes_imported') + size,
+            updated_at=timezone.now(),
+            **changes,
+        ):
+            raise _Superseded()
+        for field, value in changes.items():
+            setattr(job, field, value)
+        job.imported += len(added)
+        job.bytes_imported += size
+
+    try:
+        with open_source(job.source) as source:
+            files = source.files(source.manifest())
+            if len(files) != job.total:
+                raise ImportSourceError("The source has changed since the import started.")
+            capsule = job.capsule
+            capsule.refresh_from_db()
+            if capsule.is_locked:
+                raise ImportSourceError("The capsule is locked.")
+
+            while not job.is_finished:
+                batch = files[job.position:job.position + batch_size]
+                with ExitStack() as stack:
+                    opened, failures = [], []
+                    for item in batch:
+                        try:
+                            fileobj = stack.enter_context(source.open(item['path']))
+                        except (ImportSourceError, OSError, RuntimeError, zipfile.BadZipFile) as e:
+                            failures.append({'path': item['path'], 'error': str(e)})
+                            continue
+                        fileobj.content_title = item['title']
+                        fileobj.content_description = item['description']
+                        opened.append(fileobj)
+                    add_files(
+                        capsule, opened, concurrency,
+                        on_created=lambda results: advance(len(batch), failures, results),
+                    )
+                if report is not None:
+                    report(job)
+    except _Superseded:
+        logger.warning("Import %s was advanced by another run; stopping this one", job.pk)
+        job.refresh_from_db()
+        return job
+    except Exception as e:
+        ImportJob.objects.filter(pk=job.pk).update(
+            status='failed', error=str(e)[:255], updated_at=timezone.now()
+        )
+        job.status, job.error = 'failed', str(e)[:255]
+        raise
+
+    ImportJob.objects.filter(pk=job.pk).update(status='done', updated_at=timezone.now())
+    job.status = 'done'
+    if job.uploaded:
+        try:
+            os.remove(job.source)
+        except FileNotFoundError:
+            pass
+    logger.info(
+        "Finished import %s: %s of %s files added, %s failed",
+        job.pk, job.imported, job.total, len(job.failures)
+    )
+    return job
+
+
+def store_archive(fileobj):
+    """
+    Keep an uploaded archive on disk until its import is done.
+
+    Args:
+        fileobj: The uploaded ZIP file
+
+    Returns:
+        str: Path of the stored copy
+    """
+    os.makedirs(import_dir(), exist_ok=True)
+    path = os.path.join(import_dir(), f'{uuid.uuid4().hex}.zip')
+    with open(path, 'wb') as out:
+        for chunk in fileobj.chunks():
+            out.write(chunk)
+    return path
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'CAPSULES_IMPORT_WORKERS', DEFAULT_WORKERS),
+                thread_name_prefix='capsule-import',
+            )
+        return _executor
+
+
+def _log_progress(job):
+    logger.info(
+        "Import %s: %s/%s files, %.1f files/s, %s/s",
+        job.pk, job.position, job.total, job.files_per_second,
+        filesizeformat(job.bytes_per_second),
+    )
+
+
+def _run_in_worker(job_id):
+    # Worker threads get their own database connections; drop them when done
+    try:
+        run_import(
+            ImportJob.objects.select_related('capsule').get(pk=job_id),
+            report=_log_progress,
+        )
+    except Exception:
+        logger.exception("Import %s failed", job_id)
+    finally:
+        close_old_connections()
+
+
+def enqueue_import(job):
+    """
+    Run ``job`` in the background once the transaction commits.
+
+    An import cut short by a restart is picked up again with
+    ``manage.py import_capsule --resume <id>``.
+
+    Args:
+        job: The ImportJob to run
+    """
+    if getattr(settings, 'CAPSULES_IMPORT_WORKERS', DEFAULT_WORKERS):
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_worker, job.pk))
+    else:
+        transaction.on_commit(lambda: _run_in_worker(job.pk))
@@ -0,0 +1,87 @@
+"""Per-request performance counters for the capsules app.
+
+The request metrics middleware installs a :class:`RequestMetrics` for the
+duration of each request. Code that talks to file storage wraps the call in
+:func:`track_storage` so its time is attributed to the current request.
+Outside a request (management commands, background threads) tracking is a
+no-op.
+
+Queries are timed by :func:`db_wrapper`, which is installed on every
+database connection when it is opened and reads the current request's
+metrics from a context variable. The async ORM runs queries on other
+threads through ``sync_to_async``, which carries the context along, so
+those queries count towards the request as well.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current_metrics = ContextVar('capsules_request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Counters collected while serving a single request.
+
+    Attributes:
+        db_time: Seconds spent executing database queries
+        db_queries: Number of database queries executed
+        storage_time: Seconds spent in file storage calls
+        storage_calls: Number of file storage calls
+    """
+
+    def __init__(self):
+        self.db_time = 0.0
+        self.db_queries = 0
+        self.storage_time = 0.0
+        self.storage_calls = 0
+
+
+def current_metrics():
+    """Return the metrics of the request being served, or None."""
+    return _current_metrics.get()
+
+
+def activate(metrics):
+    """Make ``metrics`` the current request's metrics and return a reset token."""
+    return _current_metrics.set(metrics)
+
+
+def deactivate(token):
+    """Restore the metrics that were current before :func:`activate`."""
+    _current_metrics.reset(token)
+
+
+def db_wrapper(execute, sql, params, many, context):
+    """Database execute wrapper that times queries run for a request."""
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - started
+        metrics.db_queries += 1
+
+
+def install_db_wrapper(sender, connection, **kwargs):
+    """Install :func:`db_wrapper` on a newly opened database connection."""
+    # The wrapper list outlives reconnects of the same connection object
+    if db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_wrapper)
+
+
+@contextmanager
+def track_storage():
+    """Attribute the time spent in the enclosed block to file storage."""
+    metrics = _current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.storage_time += time.perf_counter() - started
+        metrics.storage_calls += 1
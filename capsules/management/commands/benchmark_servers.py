@@ -0,0 +1,252 @@
+"""Management command that compares the WSGI and ASGI deployments.
+
+Usage:
+    python manage.py benchmark_servers
+    python manage.py benchmark_servers --paths /capsules/ /capsule/12/ \\
+        --concurrency 64 --duration 30 --workers 4 --json results.json
+
+Starts the app twice with gunicorn, with the same number of worker
+processes: once through ``time_capsule.wsgi`` (sync workers, synchronous
+views) and once through ``time_capsule.asgi`` (uvicorn workers, the async
+views of capsules.async_views). Each server is loaded with
+``--concurrency`` keep-alive connections for ``--duration`` seconds,
+logged in as a benchmark user, and the requests per second and the
+p50/p95/p99 latencies are reported per deployment.
+
+The servers use the configured database, so run it against a database
+holding realistic data. Without ``--paths`` the capsule list and the
+detail page of the benchmark user's newest capsule are requested.
+"""
+
+import http.client
+import json
+import math
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import timezone
+
+from capsules.models import TimeCapsule
+
+# Deployment name -> gunicorn arguments and the environment it runs with
+DEPLOYMENTS = {
+    'wsgi': (['time_capsule.wsgi:application'], {'CAPSULES_ASYNC_VIEWS': 'False'}),
+    'asgi': (
+        ['time_capsule.asgi:application', '-k', 'uvicorn.workers.UvicornWorker'],
+        {'CAPSULES_ASYNC_VIEWS': 'True'},
+    ),
+}
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+
+    Args:
+        sorted_values: Ascending list of numbers
+        fraction: Percentile as a fraction, e.g. 0.99
+
+    Returns:
+        float: The percentile, or 0 for an empty list
+    """
+    if not sorted_values:
+        return 0
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors, duration):
+    """
+    Summarize one load run.
+
+    Args:
+        latencies: Seconds per successful request
+        errors: Number of failed (not 200) requests
+        duration: Wall time of the run in seconds
+
+    Returns:
+        dict: Requests per second and latencies in milliseconds
+    """
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / duration, 1) if duration else 0,
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else 0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def run_load(port, paths, cookie, concurrency, duration):
+    """
+    Request ``paths`` round-robin over ``concurrency`` connections.
+
+    Args:
+        port: Port of the server on localhost
+        paths: URL paths to request
+        cookie: Cookie header sent with every request
+        concurrency: Number of simultaneous keep-alive connections
+        duration: Seconds to keep requesting
+
+    Returns:
+        dict: See :func:`summarize`
+    """
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    # As forwarded by the TLS-terminating router, so nothing redirects to https
+    headers = {'Cookie': cookie, 'X-Forwarded-Proto': 'https'}
+    deadline = time.monotonic() + duration
+
+    def client(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        own, failed, i = [], 0, offset
+        while time.monotonic() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    failed += 1
+                    continue
+                own.append(time.perf_counter() - started)
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        conn.close()
+        with lock:
+            latencies.extend(own)
+            errors[0] += failed
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors[0], time.monotonic() - started)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError(f'The server exited with status {process.returncode}.')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError(f'The server did not start listening on port {port}.')
+
+
+class Command(BaseCommand):
+    help = 'Compare requests per second and tail latency of the WSGI and ASGI deployments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paths', nargs='+', help='URL paths to request')
+        parser.add_argument('--username', default='benchmark', help='User to log in as')
+        parser.add_argument('--concurrency', type=int, default=32,
+                            help='Simultaneous connections')
+        parser.add_argument('--duration', type=float, default=20,
+                            help='Seconds of load per deployment')
+        parser.add_argument('--warmup', type=float, default=3,
+                            help='Seconds of load before measuring')
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Worker processes per server')
+        parser.add_argument('--deployments', nargs='+', choices=DEPLOYMENTS,
+                            default=list(DEPLOYMENTS), help='Deployments to compare')
+        parser.add_argument('--json', metavar='PATH', help='Also write the results to PATH')
+
+    def _session_cookie(self, username):
+        user, _ = get_user_model().objects.get_or_create(username=username)
+        engine = import_module(settings.SESSION_ENGINE)
+        session = engine.SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return user, f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+    def _default_paths(self, user):
+        paths = [reverse('capsules:capsule_list')]
+        capsule = TimeCapsule.objects.filter(creator=user).order_by('-created_at').first()
+        if capsule is None:
+            capsule = TimeCapsule.objects.create(
+                creator=user,
+                title='Benchmark capsule',
+                description='Created by benchmark_servers',
+                unlock_date=timezone.now() + timedelta(days=365),
+            )
+        paths.append(reverse('capsules:capsule_detail', args=[capsule.pk]))
+        return paths
+
+    def _serve(self, name, workers):
+        args, env = DEPLOYMENTS[name]
+        port = _free_port()
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', *args, '--workers', str(workers),
+             '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+            env={**os.environ, **env, 'CAPSULES_LOG_LEVEL': 'WARNING'},
+        )
+        try:
+            _wait_for_port(port, process)
+        except CommandError:
+            process.kill()
+            raise
+        return process, port
+
+    def handle(self, *args, **options):
+        user, cookie = self._session_cookie(options['username'])
+        paths = options['paths'] or self._default_paths(user)
+        results = {
+            'paths': paths,
+            'concurrency': options['concurrency'],
+            'workers': options['workers'],
+            'duration': options['duration'],
+            'deployments': {},
+        }
+        for name in options['deployments']:
+            self.stdout.write(f'Benchmarking {name}...')
+            process, port = self._serve(name, options['workers'])
+            try:
+                if options['warmup']:
+                    run_load(port, paths, cookie, options['concurrency'], options['warmup'])
+                results['deployments'][name] = run_load(
+                    port, paths, cookie, options['concurrency'], options['duration']
+                )
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+
+        for name, row in results['deployments'].items():
+            self.stdout.write(
+                f"{name:<5} {row['rps']:>9.1f} req/s  p50 {row['p50_ms']:>8.2f} ms  "
+                f"p95 {row['p95_ms']:>8.2f} ms  p99 {row['p99_ms']:>8.2f} ms  "
+                f"{row['errors']} errors"
+            )
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(results, f, indent=2)
@@ -0,0 +1,368 @@
+"""Management command that benchmarks every capsules URL on synthetic data.
+
+Usage:
+    python manage.py benchmark_urls
+    python manage.py benchmark_urls --users 50 --capsules 40 --contents 12 \\
+        --requests 200 --json before.json
+    python manage.py benchmark_urls --cleanup
+
+Seeds ``--users`` users named ``loadtest-<n>``, each with ``--capsules``
+capsules of mixed status (active, locked, unlocked, and due but not yet
+swept; some public) and ``--contents`` contents per capsule. The files of
+these contents live in :class:`SyntheticStorage`, which stores nothing,
+reads every file as the same 64 KiB and never talks to the network.
+Seeded data is kept, so later runs measure the same data set; ``--reseed``
+replaces it and ``--cleanup`` deletes it. Run it against a scratch
+database.
+
+Every route of ``capsules/urls.py`` is then requested ``--requests`` times
+in-process, round-robin over the seeded users, each logged in and asking
+for their own objects. Routes are requested with GET, and every request
+runs in a transaction that is rolled back afterwards, so views that change
+data on GET leave the data set as it was. For each route the p50/p95/p99
+latencies, the number of database queries (not counting the savepoints
+that stand in for the request's own transactions) and the bytes rendered
+are reported. ``--json`` writes
+the results to a file to compare runs before and after a change.
+"""
+
+import io
+import json
+import random
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from capsules import search, timeline
+from capsules.delivery import make_token
+from capsules.management.commands.benchmark_servers import percentile
+from capsules.models import CapsuleContent, ImportJob, TimeCapsule, UploadSession
+from capsules.storage import ContentStorage, make_ref
+from capsules.urls import urlpatterns
+
+USERNAME_PREFIX = 'loadtest-'
+
+# Kind of capsule -> relative frequency in the seeded data
+CAPSULE_MIX = {'active': 3, 'locked': 2, 'unlocked': 4, 'due': 1}
+CONTENT_MIX = {'image': 6, 'video': 2, 'document': 2}
+EXTENSIONS = {'image': 'jpg', 'video': 'mp4', 'document': 'pdf'}
+PUBLIC_FRACTION = 0.2
+
+# What every synthetic file reads as
+SYNTHETIC_FILE = bytes(range(256)) * 256
+
+WORDS = (
+    'summer holiday birthday wedding graduation letter photo family garden '
+    'beach mountain city school friends music recipe journey winter spring '
+    'autumn memory future promise secret dream home harbour lighthouse '
+    'concert picnic festival anniversary road trip notes diary postcard'
+).split()
+
+# Statements of nested transactions, which are not counted as queries
+SAVEPOINT_SQL = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+# Routes whose ``pk`` is a content rather than a capsule
+CONTENT_ROUTES = {'content_edit', 'content_delete', 'api_content', 'api_content_file'}
+
+
+class SyntheticStorage(ContentStorage):
+    """Storage backend that keeps nothing; URLs point to a reserved domain."""
+    name = 'synthetic'
+
+    def save(self, name, fileobj, resource_type='auto'):
+        return f'{uuid.uuid4().hex}-{name}'
+
+    def url(self, key):
+        return f'https://storage.invalid/{key}'
+
+    def open(self, key):
+        return io.BytesIO(SYNTHETIC_FILE)
+
+    def delete(self, key):
+        pass
+
+
+def _words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def _synthetic_capsule(user, rng, now):
+    kind = rng.choices(list(CAPSULE_MIX), weights=list(CAPSULE_MIX.values()))[0]
+    if kind in ('active', 'locked'):
+        unlock_date = now + timedelta(days=rng.uniform(1, 365))
+    elif kind == 'due':
+        unlock_date = now - timedelta(hours=rng.uniform(1, 48))
+    else:
+        unlock_date = now - timedelta(days=rng.uniform(1, 365))
+    return TimeCapsule(
+        creator=user,
+        title=_words(rng, rng.randint(2, 5)).capitalize(),
+        description=_words(rng, rng.randint(10, 60)),
+        unlock_date=unlock_date,
+        status='locked' if kind == 'due' else kind,
+        is_public=rng.random() < PUBLIC_FRACTION,
+    )
+
+
+def _synthetic_content(capsule, rng):
+    content_type = rng.choices(list(CONTENT_MIX), weights=list(CONTENT_MIX.values()))[0]
+    key = f'{uuid.uuid4().hex}.{EXTENSIONS[content_type]}'
+    derivatives = {}
+    if content_type == 'image':
+        derivatives = {
+            size: {
+                'width': width,
+                'height': width * 3 // 4,
+                'webp': make_ref(SyntheticStorage.name, f'{key}-{size}.webp'),
+                'jpeg': make_ref(SyntheticStorage.name, f'{key}-{size}.jpg'),
+            }
+            for size, width in (('thumb', 320), ('medium', 960), ('large', 1920))
+        }
+    return CapsuleContent(
+        capsule=capsule,
+        title=_words(rng, rng.randint(1, 4)).capitalize(),
+        description=_words(rng, rng.randint(0, 20)),
+        content_type=content_type,
+        storage_backend=SyntheticStorage.name,
+        storage_key=key,
+        derivatives=derivatives,
+    )
+
+
+def seed(users, capsules_per_user, contents_per_capsule, rng):
+    """
+    Create the synthetic users and their capsules, keeping existing ones.
+
+    Rows are bulk-created; the search index and the public timeline, which
+    are normally maintained by signals, are updated in batch.
+
+    Args:
+        users: Number of users
+        capsules_per_user: Capsules each user should have
+        contents_per_capsule: Contents of each new capsule
+        rng: random.Random used for all choices
+
+    Returns:
+        list: The users
+    """
+    User = get_user_model()
+    now = timezone.now()
+    seeded = []
+    for n in range(users):
+        user, _ = User.objects.get_or_create(
+            username=f'{USERNAME_PREFIX}{n}',
+            defaults={'email': f'{USERNAME_PREFIX}{n}@example.com'},
+        )
+        seeded.append(user)
+        missing = capsules_per_user - user.time_capsules.count()
+        if missing <= 0:
+            continue
+        capsules = TimeCapsule.objects.bulk_create(
+            [_synthetic_capsule(user, rng, now) for _ in range(missing)]
+        )
+        contents = CapsuleContent.objects.bulk_create(
+            [_synthetic_content(capsule, rng) for capsule in capsules
+             for _ in range(contents_per_capsule)],
+            batch_size=1000,
+        )
+        search.index('capsule', [capsule.pk for capsule in capsules])
+        search.index('content', [content.pk for content in contents])
+        timeline.add_unlocked([capsule.pk for capsule in capsules])
+    return seeded
+
+
+def _fixtures(user):
+    """Objects of ``user`` to fill in the URL arguments of each route."""
+    capsules = list(user.time_capsules.values_list('pk', flat=True).order_by('pk'))
+    contents = list(
+        CapsuleContent.objects.filter(capsule__creator=user)
+        .values_list('pk', 'storage_backend', 'storage_key').order_by('pk')
+    )
+    if not capsules or not contents:
+        raise CommandError(f'{user.username} has no capsules or contents to request.')
+    upload = UploadSession.objects.filter(user=user).first() or UploadSession.objects.create(
+        user=user, capsule_id=capsules[0], filename='upload.jpg', mime_type='image/jpeg',
+        size=10 * 1024 * 1024, chunk_size=5 * 1024 * 1024,
+    )
+    job = ImportJob.objects.filter(user=user).first() or ImportJob.objects.create(
+        user=user, capsule_id=capsules[0], source='loadtest.zip', status='done',
+    )
+    expires = time.time() + 24 * 60 * 60
+    return {
+        'capsule': capsules,
+        'content': [pk for pk, _, _ in contents],
+        'upload_id': [upload.pk],
+        'import_id': [job.pk],
+        'token': [make_token(make_ref(backend, key), expires) for _, backend, key in contents],
+    }
+
+
+def _path(name, converters, fixtures, i):
+    kwargs = {}
+    for arg in converters:
+        if arg == 'pk':
+            kind = 'content' if name in CONTENT_ROUTES else 'capsule'
+        elif arg == 'content_id':
+            kind = 'content'
+        elif arg in ('upload_id', 'import_id', 'token'):
+            kind = arg
+        else:
+            raise CommandError(f'Route {name} takes an unknown argument {arg!r}.')
+        values = fixtures[kind]
+        kwargs[arg] = values[i % len(values)]
+    return reverse(f'capsules:{name}', kwargs=kwargs)
+
+
+def measure(client, path):
+    """
+    Request ``path`` once, rolling back whatever the request writes.
+
+    Args:
+        client: Logged-in test client
+        path: URL path
+
+    Returns:
+        tuple: ``(seconds, queries, bytes, status)``
+    """
+    queries = 0
+
+    def count(execute, sql, params, many, context):
+        nonlocal queries
+        if not sql.lstrip().upper().startswith(SAVEPOINT_SQL):
+            queries += 1
+        return execute(sql, params, many, context)
+
+    with transaction.atomic():
+        started = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = client.get(path, secure=True)
+            if response.streaming:
+                size = sum(len(chunk) for chunk in response.streaming_content)
+            else:
+                size = len(response.content)
+        elapsed = time.perf_counter() - started
+        transaction.set_rollback(True)
+    return elapsed, queries, size, response.status_code
+
+
+def summarize_route(samples):
+    """
+    Summarize the samples of one route.
+
+    Args:
+        samples: List of :func:`measure` results
+
+    Returns:
+        dict: Latencies in milliseconds, queries and bytes per request and
+        the number of responses per status code
+    """
+    latencies = sorted(s[0] for s in samples)
+    queries = [s[1] for s in samples]
+    sizes = [s[2] for s in samples]
+    statuses = {}
+    for s in samples:
+        statuses[str(s[3])] = statuses.get(str(s[3]), 0) + 1
+    return {
+        'requests': len(samples),
+        'statuses': statuses,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'mean_queries': round(statistics.fmean(queries), 2),
+        'max_queries': max(queries),
+        'mean_bytes': round(statistics.fmean(sizes)),
+        'max_bytes': max(sizes),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Seed synthetic capsules and report latency, queries and bytes of every capsules URL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Users to seed')
+        parser.add_argument('--capsules', type=int, default=25, help='Capsules per user')
+        parser.add_argument('--contents', type=int, default=8, help='Contents per capsule')
+        parser.add_argument('--requests', type=int, default=50, help='Measured requests per route')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Unmeasured requests per route before measuring')
+        parser.add_argument('--routes', nargs='+', help='Only request the routes with these names')
+        parser.add_argument('--random-seed', type=int, default=0, help='Seed of the data generator')
+        parser.add_argument('--reseed', action='store_true', help='Replace previously seeded data')
+        parser.add_argument('--cleanup', action='store_true',
+                            help='Delete the seeded data and exit')
+        parser.add_argument('--json', metavar='PATH', help='Also write the results to PATH')
+
+    def _delete_seeded(self):
+        deleted, _ = get_user_model().objects.filter(username__startswith=USERNAME_PREFIX).delete()
+        self.stdout.write(f'Deleted {deleted} seeded rows')
+
+    def handle(self, *args, **options):
+        backends = {
+            **getattr(settings, 'CAPSULES_STORAGE_BACKENDS', {}),
+            SyntheticStorage.name: f'{__name__}.SyntheticStorage',
+        }
+        with override_settings(CAPSULES_STORAGE_BACKENDS=backends):
+            if options['cleanup'] or options['reseed']:
+                self._delete_seeded()
+                if options['cleanup']:
+                    return
+            self._run(options)
+
+    def _run(self, options):
+        started = time.monotonic()
+        users = seed(
+            options['users'], options['capsules'], options['contents'],
+            random.Random(options['random_seed']),
+        )
+        if not users:
+            raise CommandError('At least one user is needed.')
+        self.stdout.write(f'Seeded {len(users)} users in {time.monotonic() - started:.1f} s')
+
+        host = next((h for h in settings.ALLOWED_HOSTS if h and h[0] not in '.*'), 'localhost')
+        clients = []
+        for user in users:
+            client = Client(HTTP_HOST=host)
+            client.force_login(user)
+            clients.append((client, _fixtures(user)))
+
+        routes = [
+            (pattern.name, list(pattern.pattern.converters))
+            for pattern in urlpatterns
+            if not options['routes'] or pattern.name in options['routes']
+        ]
+        results = {
+            'users': options['users'],
+            'capsules_per_user': options['capsules'],
+            'contents_per_capsule': options['contents'],
+            'requests_per_route': options['requests'],
+            'routes': {},
+        }
+        for name, converters in routes:
+            samples = []
+            for i in range(options['warmup'] + options['requests']):
+                client, fixtures = clients[i % len(clients)]
+                sample = measure(client, _path(name, converters, fixtures, i // len(clients)))
+                if i >= options['warmup']:
+                    samples.append(sample)
+            if samples:
+                results['routes'][name] = summarize_route(samples)
+
+        for name, row in results['routes'].items():
+            statuses = ','.join(f'{code}x{count}' for code, count in sorted(row['statuses'].items()))
+            self.stdout.write(
+                f"{name:<24} p50 {row['p50_ms']:>8.2f} ms  p95 {row['p95_ms']:>8.2f} ms  "
+                f"p99 {row['p99_ms']:>8.2f} ms  {row['mean_queries']:>6.1f} queries  "
+                f"{row['mean_bytes']:>8} bytes  {statuses}"
+            )
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(results, f, indent=2)
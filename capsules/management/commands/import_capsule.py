@@ -0,0 +1,109 @@
+"""Management command that imports a ZIP file or directory as a time capsule.
+
+Usage:
+    python manage.py import_capsule family.zip --user anna
+    python manage.py import_capsule /srv/scans --user anna --unlock-date 2040-01-01
+    python manage.py import_capsule --resume <import id>
+
+Importing the same source for the same user again resumes its unfinished
+import instead of starting over; ``--resume`` continues any import by id,
+e.g. an uploaded archive whose background import was cut short. See
+capsules.imports for the manifest format.
+"""
+
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+
+from capsules.imports import ImportSourceError, run_import, start_import
+from capsules.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = 'Import the files of a ZIP file or directory into a new time capsule.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', help='ZIP file or directory to import')
+        parser.add_argument('--user', help='Username of the capsule owner')
+        parser.add_argument('--title', help="Capsule title, instead of the manifest's")
+        parser.add_argument('--description', help="Capsule description, instead of the manifest's")
+        parser.add_argument('--unlock-date', help="Capsule unlock date, instead of the manifest's")
+        parser.add_argument(
+            '--public',
+            action='store_true',
+            default=None,
+            help='Make the capsule public',
+        )
+        parser.add_argument('--batch-size', type=int, help='Files added per batch')
+        parser.add_argument('--concurrency', type=int, help='Storage uploads per batch')
+        parser.add_argument('--resume', metavar='IMPORT_ID', help='Continue the import with this id')
+
+    def handle(self, *args, **options):
+        job = self._resumed(options) if options['resume'] else self._started(options)
+        try:
+            run_import(
+                job,
+                batch_size=options['batch_size'],
+                concurrency=options['concurrency'],
+                report=self._report,
+            )
+        except ImportSourceError as e:
+            raise CommandError(str(e))
+        for failure in job.failures:
+            self.stderr.write(f"{failure['path']}: {failure['error']}")
+        self.stdout.write(
+            f"Imported {job.imported} of {job.total} files "
+            f"({filesizeformat(job.bytes_imported)}) into capsule {job.capsule_id}, "
+            f"{len(job.failures)} failed"
+        )
+
+    def _resumed(self, options):
+        try:
+            job = ImportJob.objects.select_related('capsule').filter(pk=options['resume']).first()
+        except ValidationError:
+            job = None
+        if job is None:
+            raise CommandError(f"No import with id {options['resume']}.")
+        self.stdout.write(f"Resuming import {job.pk} at file {job.position} of {job.total}")
+        return job
+
+    def _started(self, options):
+        if not options['source'] or not options['user']:
+            raise CommandError('Give a source and --user, or --resume.')
+        user = get_user_model().objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f"No user named {options['user']}.")
+        job = (
+            ImportJob.objects.select_related('capsule')
+            .filter(user=user, source=os.path.abspath(options['source']))
+            .exclude(status='done')
+            .order_by('-created_at')
+            .first()
+        )
+        if job is not None:
+            self.stdout.write(f"Resuming import {job.pk} at file {job.position} of {job.total}")
+            return job
+        try:
+            job = start_import(
+                user,
+                options['source'],
+                title=options['title'],
+                description=options['description'],
+                unlock_date=options['unlock_date'],
+                is_public=options['public'],
+            )
+        except ImportSourceError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            f"Started import {job.pk} of {job.total} files into capsule {job.capsule_id}"
+        )
+        return job
+
+    def _report(self, job):
+        self.stdout.write(
+            f"{job.position}/{job.total} files, "
+            f"{job.files_per_second:.1f} files/s, {filesizeformat(job.bytes_per_second)}/s"
+        )
@@ -0,0 +1,50 @@
+"""Management command that purges deleted capsules and their stored files.
+
+Usage:
+    python manage.py purge_deleted
+    python manage.py purge_deleted --loop --interval 300
+
+Deleting a capsule only hides it; this removes the rows of deleted
+capsules in batches and deletes the stored files no content uses any
+more, retrying failed deletions with backoff. Safe to run from several
+dynos at once, see capsules.deletion.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from capsules.deletion import delete_pending_files, purge_deleted_capsules
+
+
+class Command(BaseCommand):
+    help = 'Remove deleted time capsules and delete their stored files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Contents or files handled per transaction',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep purging every --interval seconds instead of exiting',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=300.0,
+            help='Seconds between purges when --loop is given',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            capsules = purge_deleted_capsules(batch_size=options['batch_size'])
+            deleted, failed = delete_pending_files(batch_size=options['batch_size'])
+            self.stdout.write(
+                f"Purged {capsules} capsules, deleted {deleted} stored files, {failed} failed"
+            )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
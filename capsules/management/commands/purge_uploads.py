@@ -0,0 +1,24 @@
+"""Management command that discards abandoned chunked uploads.
+
+Usage:
+    python manage.py purge_uploads
+
+Sessions without a chunk for CAPSULES_UPLOAD_SESSION_TTL seconds are
+deleted together with their partial files, see capsules.uploads. Contents
+whose background upload has been pending for CAPSULES_UPLOAD_STALE_AFTER
+seconds are marked failed, see capsules.pipeline.
+"""
+
+from django.core.management.base import BaseCommand
+
+from capsules.pipeline import fail_stale_uploads
+from capsules.uploads import purge_stale_uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete upload sessions that have been inactive for too long.'
+
+    def handle(self, *args, **options):
+        count = purge_stale_uploads()
+        failed = fail_stale_uploads()
+        self.stdout.write(f"Discarded {count} stale uploads, marked {failed} interrupted uploads failed")
@@ -0,0 +1,27 @@
+"""Management command that refills the full-text search index.
+
+Usage:
+    python manage.py rebuild_search_index
+    python manage.py rebuild_search_index --database replica
+
+The index is kept up to date on every save and delete (see
+capsules.search); rebuilding is only needed after writing rows behind the
+app's back, e.g. restoring a dump without the index tables' contents.
+"""
+
+from django.core.management.base import BaseCommand
+
+from capsules.search import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Re-index every time capsule and content for full-text search.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias to index')
+
+    def handle(self, *args, **options):
+        counts = rebuild(using=options['database'])
+        self.stdout.write(
+            f"Indexed {counts['capsule']} capsules and {counts['content']} contents"
+        )
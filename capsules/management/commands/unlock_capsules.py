@@ -0,0 +1,59 @@
+"""Management command that unlocks every capsule whose unlock date has passed.
+
+Usage:
+    python manage.py unlock_capsules
+    python manage.py unlock_capsules --loop --interval 60
+
+Safe to run from several dynos at once, see capsules.sweeper. With
+--loop (the Procfile's clock process) every round also marks uploads lost
+to a restart failed, see capsules.pipeline.fail_stale_uploads.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from capsules.pipeline import fail_stale_uploads
+from capsules.sweeper import DEFAULT_BATCH_SIZE, sweep_due_capsules, sweep_round
+
+
+class Command(BaseCommand):
+    help = 'Move all due time capsules to their next state in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Maximum number of capsules updated per statement',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep sweeping every --interval seconds instead of exiting',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=60.0,
+            help='Seconds between sweeps when --loop is given',
+        )
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            self._sweep(options['batch_size'])
+            return
+        # Like the in-process sweeper: a failed round is logged and retried
+        while True:
+            with sweep_round(options['interval']):
+                self._sweep(options['batch_size'])
+                fail_stale_uploads()
+            time.sleep(options['interval'])
+
+    def _sweep(self, batch_size):
+        result = sweep_due_capsules(batch_size=batch_size)
+        self.stdout.write(
+            f"Locked {result.moved.get('active', 0)}, "
+            f"unlocked {result.moved.get('locked', 0)} capsules "
+            f"in {result.duration * 1000:.1f} ms"
+        )
@@ -0,0 +1,83 @@
+"""Middleware for the capsules app."""
+
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import instrumentation
+
+logger = logging.getLogger('capsules.requests')
+
+
+class RequestMetricsMiddleware:
+    """
+    Log one structured line per request with its timing breakdown.
+
+    Records wall time, database time and query count, and the time spent
+    in file storage calls. The line is emitted at INFO level on the
+    ``capsules.requests`` logger; when that level is disabled the
+    middleware collects nothing. Queries count wherever they run, including
+    the threads the async ORM hands them to (see capsules.instrumentation).
+
+    The middleware is sync and async capable, so under ASGI it adds no
+    thread hop of its own. WhiteNoise and allauth's AccountMiddleware are
+    sync only, so the request still crosses into a thread behind them.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not logger.isEnabledFor(logging.INFO):
+            return self.get_response(request)
+
+        metrics = instrumentation.RequestMetrics()
+        token = instrumentation.activate(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            wall_time = time.perf_counter() - started
+            instrumentation.deactivate(token)
+        self._log(request, response, metrics, wall_time)
+        return response
+
+    async def __acall__(self, request):
+        if not logger.isEnabledFor(logging.INFO):
+            return await self.get_response(request)
+
+        metrics = instrumentation.RequestMetrics()
+        token = instrumentation.activate(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            wall_time = time.perf_counter() - started
+            instrumentation.deactivate(token)
+        self._log(request, response, metrics, wall_time)
+        return response
+
+    def _log(self, request, response, metrics, wall_time):
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'wall_ms': round(wall_time * 1000, 2),
+            'db_ms': round(metrics.db_time * 1000, 2),
+            'db_queries': metrics.db_queries,
+            'storage_ms': round(metrics.storage_time * 1000, 2),
+            'storage_calls': metrics.storage_calls,
+        }
+        logger.info(
+            ' '.join(f'{key}={value}' for key, value in fields.items()),
+            extra={'request_metrics': fields},
+        )
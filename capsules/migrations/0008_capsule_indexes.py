@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0007_alter_capsulecontent_content_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='capsulecontent',
+            index=models.Index(fields=['capsule', 'uploaded_at'], name='content_capsule_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timecapsule',
+            index=models.Index(fields=['creator', '-created_at'], name='capsule_creator_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timecapsule',
+            index=models.Index(fields=['status', 'unlock_date'], name='capsule_status_unlock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timecapsule',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['unlock_date'], name='capsule_public_unlock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timecapsule',
+            index=models.Index(condition=models.Q(('status', 'locked')), fields=['unlock_date'], name='capsule_locked_unlock_idx'),
+        ),
+    ]
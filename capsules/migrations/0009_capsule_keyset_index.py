@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0008_capsule_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='timecapsule',
+            name='capsule_creator_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='timecapsule',
+            index=models.Index(fields=['creator', '-created_at', '-id'], name='capsule_creator_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:51
+
+import capsules.storage
+import cloudinary.models
+from django.db import migrations, models
+
+
+def copy_legacy_files(apps, schema_editor):
+    """Point existing contents at their Cloudinary files."""
+    CapsuleContent = apps.get_model('capsules', 'CapsuleContent')
+    CapsuleContent.objects.exclude(file='').update(
+        storage_backend='cloudinary', storage_key=models.F('file')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0009_capsule_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='capsulecontent',
+            name='storage_backend',
+            field=models.CharField(default=capsules.storage.default_storage_name, help_text='Name of the storage backend holding the file', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='capsulecontent',
+            name='storage_key',
+            field=models.CharField(blank=True, help_text='Backend-specific key of the stored file', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='capsulecontent',
+            name='file',
+            field=cloudinary.models.CloudinaryField(blank=True, help_text='Legacy Cloudinary reference; new uploads are kept in storage_key', max_length=255, verbose_name='file'),
+        ),
+        migrations.RunPython(copy_legacy_files, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('capsules', '0010_content_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(help_text='Original name of the file', max_length=255)),
+                ('mime_type', models.CharField(help_text='MIME type reported by the client', max_length=100)),
+                ('size', models.BigIntegerField(help_text='Total size of the file in bytes')),
+                ('chunk_size', models.PositiveIntegerField(help_text='Size of every chunk but the last')),
+                ('received', models.BigIntegerField(default=0, help_text='Bytes acknowledged so far')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('capsule', models.ForeignKey(help_text='The time capsule the file is uploaded to', on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='capsules.timecapsule')),
+                ('user', models.ForeignKey(help_text='The user uploading the file', on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['updated_at'], name='upload_updated_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0011_upload_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='capsulecontent',
+            name='upload_error',
+            field=models.CharField(blank=True, help_text='Why the last upload failed', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='capsulecontent',
+            name='upload_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', help_text='Whether the file has reached storage (see capsules.pipeline)', max_length=10),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0012_content_upload_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='capsulecontent',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=dict, help_text='Downscaled copies of an image (see capsules.derivatives)'),
+        ),
+    ]
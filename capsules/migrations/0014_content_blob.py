@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0013_content_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(help_text="SHA-256 of the file's bytes", max_length=64, unique=True)),
+                ('size', models.BigIntegerField(help_text='Size of the file in bytes')),
+                ('storage_backend', models.CharField(help_text='Name of the storage backend holding the file', max_length=20)),
+                ('storage_key', models.CharField(help_text='Backend-specific key of the stored file', max_length=255)),
+                ('derivatives', models.JSONField(blank=True, default=dict, help_text='Downscaled copies of an image (see capsules.derivatives)')),
+                ('ref_count', models.PositiveIntegerField(default=0, help_text='Number of contents using this file')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='capsulecontent',
+            name='blob',
+            field=models.ForeignKey(blank=True, help_text='Shared stored file; storage_backend and storage_key copy it', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='contents', to='capsules.contentblob'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:17
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0014_content_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timecapsule',
+            name='version',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, help_text='Changes whenever the capsule or its contents change; keys cached fragments'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_timeline(apps, schema_editor):
+    """Add the public capsules that are already unlocked."""
+    TimeCapsule = apps.get_model('capsules', 'TimeCapsule')
+    PublicTimelineEntry = apps.get_model('capsules', 'PublicTimelineEntry')
+    rows = TimeCapsule.objects.filter(is_public=True, status='unlocked').values_list('pk', 'unlock_date')
+    PublicTimelineEntry.objects.bulk_create(
+        (PublicTimelineEntry(capsule_id=pk, unlocked_at=unlock_date) for pk, unlock_date in rows),
+        batch_size=1000,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0015_capsule_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublicTimelineEntry',
+            fields=[
+                ('capsule', models.OneToOneField(help_text='The unlocked public capsule', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='timeline_entry', serialize=False, to='capsules.timecapsule')),
+                ('unlocked_at', models.DateTimeField(help_text='When the capsule unlocked')),
+            ],
+            options={
+                'verbose_name_plural': 'public timeline entries',
+                'ordering': ['-unlocked_at'],
+                'indexes': [models.Index(fields=['-unlocked_at', '-capsule'], name='timeline_keyset_idx')],
+            },
+        ),
+        migrations.RunPython(fill_timeline, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:55
+
+from django.conf import settings
+from django.db import migrations
+
+# The index as capsules.search defined it when this migration was written.
+# Later changes to that module must not change what this migration does;
+# a backend set with CAPSULES_SEARCH_BACKEND is installed and filled by
+# `manage.py rebuild_search_index` instead.
+FIELDS = {
+    'capsule': ('title', 'description', 'contents'),
+    'content': ('title', 'description'),
+}
+POSTGRES_WEIGHTS = 'ABC'
+
+
+def _sources(apps, aggregate):
+    capsules = apps.get_model('capsules', 'TimeCapsule')._meta.db_table
+    contents = apps.get_model('capsules', 'CapsuleContent')._meta.db_table
+    text = aggregate.format("cc.title || ' ' || cc.description")
+    return {
+        'capsule': (
+            f"SELECT c.id, c.title, c.description, "
+            f"COALESCE((SELECT {text} FROM {contents} cc WHERE cc.capsule_id = c.id), '') "
+            f"FROM {capsules} c"
+        ),
+        'content': f'SELECT c.id, c.title, c.description FROM {contents} c',
+    }
+
+
+def _create_sqlite(apps, cursor):
+    for kind, source in _sources(apps, "group_concat({}, ' ')").items():
+        table = f'capsules_{kind}_search'
+        fields = ', '.join(FIELDS[kind])
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} "
+            f"USING fts5({fields}, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(f'INSERT INTO {table} (rowid, {fields}) {source}')
+
+
+def _create_postgresql(apps, cursor):
+    config = getattr(settings, 'CAPSULES_SEARCH_CONFIG', 'english')
+    for kind, source in _sources(apps, "string_agg({}, ' ')").items():
+        table = f'capsules_{kind}_search'
+        fields = FIELDS[kind]
+        document = ' || '.join(
+            f"setweight(to_tsvector(%s::regconfig, COALESCE(src.{name}, '')), '{weight}')"
+            for name, weight in zip(fields, POSTGRES_WEIGHTS)
+        )
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} ('
+            f'object_id bigint PRIMARY KEY, document tsvector NOT NULL)'
+        )
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {table}_document_idx ON {table} USING GIN (document)'
+        )
+        cursor.execute(
+            f"INSERT INTO {table} (object_id, document) "
+            f"SELECT src.id, {document} FROM ({source}) AS src (id, {', '.join(fields)})",
+            [config] * len(fields),
+        )
+
+
+def create_index(apps, schema_editor):
+    """Create the search index tables of the database vendor and fill them."""
+    create = {'sqlite': _create_sqlite, 'postgresql': _create_postgresql}.get(
+        schema_editor.connection.vendor
+    )
+    if create:
+        with schema_editor.connection.cursor() as cursor:
+            create(apps, cursor)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor not in ('sqlite', 'postgresql'):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for kind in FIELDS:
+            cursor.execute(f'DROP TABLE IF EXISTS capsules_{kind}_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0016_public_timeline'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('capsules', '0017_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('source', models.CharField(help_text='Path of the ZIP file or directory imported', max_length=500)),
+                ('uploaded', models.BooleanField(default=False, help_text='Whether the source is an uploaded archive, removed once imported')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('total', models.PositiveIntegerField(default=0, help_text='Number of files to import')),
+                ('position', models.PositiveIntegerField(default=0, help_text='Files handled so far')),
+                ('imported', models.PositiveIntegerField(default=0, help_text='Files added to the capsule')),
+                ('bytes_imported', models.BigIntegerField(default=0, help_text='Bytes of the files added')),
+                ('failures', models.JSONField(blank=True, default=list, help_text='Files that could not be imported, with the reason')),
+                ('files_per_second', models.FloatField(default=0, help_text='Throughput of the latest run')),
+                ('bytes_per_second', models.FloatField(default=0, help_text='Throughput of the latest run')),
+                ('error', models.CharField(blank=True, help_text='Why the import stopped, if it failed', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('capsule', models.ForeignKey(help_text='The time capsule created for the import', on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='capsules.timecapsule')),
+                ('user', models.ForeignKey(help_text='The user importing the files', on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
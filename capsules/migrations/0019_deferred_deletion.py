@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:03
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0018_import_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingStorageDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('storage_backend', models.CharField(help_text='Name of the storage backend holding the file', max_length=20)),
+                ('storage_key', models.CharField(help_text='Backend-specific key of the stored file', max_length=255)),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='Failed deletion attempts')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, help_text='When to try deleting the file next')),
+                ('last_error', models.CharField(blank=True, help_text='Why the last attempt failed', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='timecapsule',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, help_text='When the capsule was deleted; its rows are purged in the background', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='timecapsule',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='capsule_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pendingstoragedeletion',
+            index=models.Index(fields=['next_attempt_at'], name='pending_deletion_due_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='pendingstoragedeletion',
+            constraint=models.UniqueConstraint(fields=('storage_backend', 'storage_key'), name='pending_deletion_unique'),
+        ),
+    ]
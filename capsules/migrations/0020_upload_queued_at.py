@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:42
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def date_pending_uploads(apps, schema_editor):
+    """Give uploads pending already a queue time, so the stale sweep sees them."""
+    CapsuleContent = apps.get_model('capsules', 'CapsuleContent')
+    CapsuleContent.objects.filter(upload_status='pending').update(upload_queued_at=F('uploaded_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0019_deferred_deletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='capsulecontent',
+            name='upload_queued_at',
+            field=models.DateTimeField(blank=True, help_text='When the pending upload was handed to the pipeline', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='capsulecontent',
+            index=models.Index(condition=models.Q(('upload_status', 'pending')), fields=['upload_queued_at'], name='content_pending_upload_idx'),
+        ),
+        migrations.RunPython(date_pending_uploads, migrations.RunPython.noop),
+    ]
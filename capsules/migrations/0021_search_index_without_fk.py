@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:10
+
+from django.db import migrations
+
+
+def drop_foreign_keys(apps, schema_editor):
+    """Drop the foreign keys 0017 gave the PostgreSQL index tables."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for kind in ('capsule', 'content'):
+            cursor.execute(
+                f'ALTER TABLE IF EXISTS capsules_{kind}_search '
+                f'DROP CONSTRAINT IF EXISTS capsules_{kind}_search_object_id_fkey'
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0020_upload_queued_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_foreign_keys, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,136 @@
-from django.db import models
+import logging
+import uuid
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Concat
 from django.contrib.auth.models import User
+from django.core.files import File
 from django.utils import timezone
 from django.urls import reverse
 from cloudinary.models import CloudinaryField
 
+from .hashing import file_digest
+from .sniffing import RESOURCE_TYPES
+from .storage import default_storage_name, get_content_storage, make_ref, split_ref
+
+logger = logging.getLogger(__name__)
+
+
+class TimeCapsuleQuerySet(models.QuerySet):
+    """QuerySet with helpers for reading capsule state without writing it."""
+
+    def with_effective_status(self, now=None):
+        """
+        Annotate each capsule with the status it has at ``now``.
+        
+        Capsules that are active or locked but past their unlock date are
+        reported as unlocked, even if the unlock sweeper has not persisted
+        the transition yet.
+        
+        Args:
+            now: Reference time, defaults to the current time
+            
+        Returns:
+            TimeCapsuleQuerySet: Queryset annotated with ``effective_status``
+        """
+        now = now or timezone.now()
+        return self.annotate(
+            effective_status=Case(
+                When(
+                    status__in=TimeCapsule.DUE_STATUSES,
+                    unlock_date__lte=now,
+                    then=Value('unlocked'),
+                ),
+                default=F('status'),
+                output_field=models.CharField(),
+            )
+        )
+
+    def visible_to(self, user):
+        """
+        Restrict the queryset to capsules ``user`` may view.
+        
+        The rule of capsule_detail, applied in the query: a user sees their
+        own capsules and public ones.
+        
+        Args:
+            user: The requesting user (may be anonymous)
+            
+        Returns:
+            TimeCapsuleQuerySet: The visible capsules
+        """
+        return self.filter(Q(creator_id=user.pk) | Q(is_public=True))
+
+    def bump_version(self):
+        """
+        Give every capsule in the queryset a new ``version``.
+        
+        Needed after queryset updates of capsules or their contents, which
+        bypass the signals that normally do this (see capsules.fragments).
+        
+        Returns:
+            int: Number of capsules updated
+        """
+        return self.update(version=uuid.uuid4())
+
+    def with_content_count(self):
+        """
+        Annotate each capsule with its number of contents.
+        
+        Uses a correlated subquery on the (capsule, uploaded_at) index rather
+        than a JOIN with GROUP BY, so it is only evaluated for the rows that
+        are actually returned and the outer query keeps its index ordering.
+        
+        Returns:
+            TimeCapsuleQuerySet: Queryset annotated with ``content_count``
+        """
+        contents = CapsuleContent.objects.filter(capsule=OuterRef('pk')).order_by()
+        return self.annotate(
+            content_count=Coalesce(
+                Subquery(
+                    contents.values('capsule').annotate(n=Count('pk')).values('n'),
+                    output_field=models.IntegerField(),
+                ),
+                0,
+            )
+        )
+
+    def with_card_data(self):
+        """
+        Annotate each capsule with the data shown on its list card.
+        
+        Both values are correlated subqueries, so the list page needs no
+        extra query per capsule.
+        
+        Returns:
+            TimeCapsuleQuerySet: Queryset annotated with ``content_count``,
+            ``cover_file`` (storage reference of the first image, or None)
+            and ``cover_derivatives`` (that image's derivatives)
+        """
+        contents = CapsuleContent.objects.filter(capsule=OuterRef('pk')).order_by()
+        covers = contents.filter(content_type='image').exclude(storage_key='').order_by('uploaded_at')
+        return self.with_content_count().annotate(
+            cover_file=Subquery(
+                covers.annotate(
+                    ref=Concat('storage_backend', Value(':'), 'storage_key',
+                               output_field=models.CharField())
+                ).values('ref')[:1],
+                output_field=models.CharField(),
+            ),
+            cover_derivatives=Subquery(
+                covers.values('derivatives')[:1],
+                output_field=models.JSONField(),
+            ),
+        )
+
+
+class TimeCapsuleManager(models.Manager.from_queryset(TimeCapsuleQuerySet)):
+    """Default manager, hiding capsules that are being deleted."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
 
 class TimeCapsule(models.Model):
     """
@@ -26,6 +153,9 @@ class TimeCapsule(models.Model):
         ('unlocked', 'Unlocked')
     ]
 
+    # Statuses that become 'unlocked' once the unlock date has passed
+    DUE_STATUSES = ('active', 'locked')
+
     # Basic information
     title = models.CharField(max_length=200, help_text="The name of your time capsule")
     description = models.TextField(blank=True, help_text="A description of what this time capsule contains or represents")
@@ -51,7 +181,21 @@ class TimeCapsule(models.Model):
         default=False, 
         help_text="If checked, this capsule will be visible to everyone when unlocked"
     )
+    version = models.UUIDField(
+        default=uuid.uuid4,
+        editable=False,
+        help_text="Changes whenever the capsule or its contents change; keys cached fragments"
+    )
+    deleted_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the capsule was deleted; its rows are purged in the background"
+    )
     
+    objects = TimeCapsuleManager()
+    # Includes deleted capsules, for the purge (see capsules.deletion)
+    all_objects = TimeCapsuleQuerySet.as_manager()
+
     def __str__(self):
         """String representation of the capsule."""
         return self.title
@@ -63,14 +207,11 @@ class TimeCapsule(models.Model):
         Returns:
             bool: True if the current time is past the unlock date, False otherwise
         """
-        now = timezone.localtime(timezone.now())
-        unlock_date_local = timezone.localtime(self.unlock_date)
-        print(f"\nChecking if capsule '{self.title}' is unlockable:")
-        print(f"Current time (Berlin): {now}")
-        print(f"Unlock date (Berlin): {unlock_date_local}")
-        print(f"Current status: {self.status}")
-        is_time_passed = now >= unlock_date_local
-        print(f"Time has passed: {is_time_passed}")
+        is_time_passed = timezone.now() >= self.unlock_date
+        logger.debug(
+            "Capsule %s unlockable=%s (status=%s, unlock_date=%s)",
+            self.pk, is_time_passed, self.status, self.unlock_date
+        )
         return is_time_passed
 
     def check_and_unlock(self):
@@ -87,17 +228,43 @@ class TimeCapsule(models.Model):
         if self.status == 'active':
             # If it's active and past unlock date, lock it
             if timezone.localtime(timezone.now()) >= timezone.localtime(self.unlock_date):
-                print(f"\nLocking active capsule '{self.title}'")
+                logger.debug("Locking active capsule %s", self.pk)
                 self.status = 'locked'
                 self.save()
                 return False
         elif self.status == 'locked' and self.is_unlockable():
-            print(f"\nUnlocking capsule '{self.title}'")
+            logger.debug("Unlocking capsule %s", self.pk)
             self.status = 'unlocked'
             self.save()
             return True
         return False
 
+    def new_version(self):
+        """Assign a new ``version``, saved with the capsule."""
+        self.version = uuid.uuid4()
+
+    @property
+    def effective_status(self):
+        """
+        The status of the capsule at the current time.
+        
+        Uses the value annotated by ``with_effective_status()`` when the
+        capsule was loaded through it, so templates never trigger a write.
+        
+        Returns:
+            str: 'active', 'locked' or 'unlocked'
+        """
+        if '_effective_status' in self.__dict__:
+            return self.__dict__['_effective_status']
+        if self.status in self.DUE_STATUSES and timezone.now() >= self.unlock_date:
+            return 'unlocked'
+        return self.status
+
+    @effective_status.setter
+    def effective_status(self, value):
+        """Store the value annotated by the queryset."""
+        self.__dict__['_effective_status'] = value
+
     @property
     def is_locked(self):
         """
@@ -106,7 +273,7 @@ class TimeCapsule(models.Model):
         Returns:
             bool: True if the capsule is locked and cannot be unlocked yet
         """
-        return self.status == 'locked' and not self.is_unlockable()
+        return self.effective_status == 'locked'
 
     def save(self, *args, **kwargs):
         """
@@ -121,10 +288,239 @@ class TimeCapsule(models.Model):
                 self.status = 'unlocked'
             else:
                 self.status = 'active'
+        # The annotated status is stale once the stored status changes
+        self.__dict__.pop('_effective_status', None)
         super().save(*args, **kwargs)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # A user's capsules, newest first, keyset-paginated on (created_at, id)
+            models.Index(fields=['creator', '-created_at', '-id'], name='capsule_creator_keyset_idx'),
+            # Due-capsule lookups by the unlock sweeper
+            models.Index(fields=['status', 'unlock_date'], name='capsule_status_unlock_idx'),
+            # Public and locked capsules are small, hot subsets; partial
+            # indexes are ignored on backends that do not support them
+            models.Index(
+                fields=['unlock_date'],
+                name='capsule_public_unlock_idx',
+                condition=Q(is_public=True),
+            ),
+            models.Index(
+                fields=['unlock_date'],
+                name='capsule_locked_unlock_idx',
+                condition=Q(status='locked'),
+            ),
+            # Deleted capsules waiting to be purged
+            models.Index(
+                fields=['deleted_at'],
+                name='capsule_deleted_idx',
+                condition=Q(deleted_at__isnull=False),
+            ),
+        ]
+
+
+class PublicTimelineEntry(models.Model):
+    """
+    A public capsule on the discovery feed, in the order it unlocked.
+
+    The feed is maintained incrementally rather than queried from the
+    capsules table: the unlock sweeper appends the public capsules it
+    unlocks, and saving or deleting a capsule adds or removes its entry
+    (see capsules.timeline).
+    """
+
+    capsule = models.OneToOneField(
+        TimeCapsule,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='timeline_entry',
+        help_text="The unlocked public capsule"
+    )
+    unlocked_at = models.DateTimeField(help_text="When the capsule unlocked")
+
+    def __str__(self):
+        """String representation of the entry."""
+        return f'{self.capsule_id} at {self.unlocked_at}'
+
+    class Meta:
+        ordering = ['-unlocked_at']
+        verbose_name_plural = 'public timeline entries'
+        indexes = [
+            # The feed, newest first, keyset-paginated on (unlocked_at, capsule)
+            models.Index(fields=['-unlocked_at', '-capsule'], name='timeline_keyset_idx'),
+        ]
+
+
+class CapsuleContentQuerySet(models.QuerySet):
+    """QuerySet applying the access rules of capsule contents in SQL."""
+
+    def live(self):
+        """
+        Exclude the contents of capsules that are being deleted.
+        
+        The default manager includes them, so that queries which do not
+        serve users (the purge, uploads, derivatives) need no JOIN.
+        
+        Returns:
+            CapsuleContentQuerySet: Contents of capsules not deleted
+        """
+        return self.filter(capsule__deleted_at__isnull=True)
+
+    def visible_to(self, user, now=None):
+        """
+        Restrict the queryset to contents ``user`` may access.
+        
+        The rules of serve_protected_file, applied in the query: users see
+        the contents of their own and of public capsules, and each row is annotated with ``file_available``, which is False
+        while the capsule is locked or the content has no file yet.
+        
+        Args:
+            user: The requesting user (may be anonymous)
+            now: Reference time for the lock, defaults to the current time
+            
+        Returns:
+            CapsuleContentQuerySet: The visible contents
+        """
+        now = now or timezone.now()
+        contents = self.live().filter(
+            Q(capsule__creator_id=user.pk) | Q(capsule__is_public=True)
+        )
+        hidden = Q(capsule__status='locked', capsule__unlock_date__gt=now) | Q(storage_key='')
+        return contents.annotate(
+            file_available=Case(
+                When(hidden, then=Value(False)),
+                default=Value(True),
+                output_field=models.BooleanField(),
+            )
+        )
+
+
+class ContentBlobManager(models.Manager):
+    """Reference-counted access to stored files."""
+
+    def acquire(self, digest, size, storage, transfer):
+        """
+        Take a reference to the blob with ``digest``, storing it if new.
+        
+        Args:
+            digest: Content digest of the file (see capsules.hashing)
+            size: Size of the file in bytes
+            storage: Backend to store a new file in
+            transfer: Callable storing the file in ``storage`` and returning
+                its key; only called when no blob has ``digest`` yet
+                
+        Returns:
+            tuple: The ContentBlob and whether it was just created
+        """
+        with transaction.atomic():
+            if self.filter(digest=digest).update(ref_count=F('ref_count') + 1):
+                return self.get(digest=digest), False
+        key = transfer()
+        try:
+            with transaction.atomic():
+                blob = self.create(
+                    digest=digest,
+                    size=size,
+                    storage_backend=storage.name,
+                    storage_key=key,
+                    ref_count=1,
+                )
+        except IntegrityError:
+            # The same bytes were stored concurrently; keep that copy
+            storage.delete(key)
+            return self.acquire(digest, size, storage, transfer)
+        return blob, True
+
+    def add_references(self, counts):
+        """
+        Take several references at once.
+        
+        Args:
+            counts: Mapping of blob pk -> number of new references
+        """
+        for pk, count in counts.items():
+            self.filter(pk=pk).update(ref_count=F('ref_count') + count)
+
+    def release(self, pk):
+        """
+        Drop a reference to a blob, deleting it and its files at zero.
+        
+        The stored files are deleted once the transaction commits.
+        
+        Args:
+            pk: Primary key of the ContentBlob
+        """
+        with transaction.atomic():
+            self.filter(pk=pk, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+            blob = self.select_for_update().filter(pk=pk, ref_count=0).first()
+            if blob is not None:
+                blob.delete()
+                transaction.on_commit(blob.delete_files)
+                logger.info("Freed blob %s", blob.digest)
+
+
+class ContentBlob(models.Model):
+    """
+    A stored file, shared by every CapsuleContent with the same bytes.
+    
+    Uploads are keyed by their content digest, so uploading a known file
+    again only adds a reference instead of storing another copy.
+    ``ref_count`` counts the contents pointing here; the blob and its files
+    are deleted when it drops to zero. Contents stored before deduplication
+    have no blob.
+    """
+
+    digest = models.CharField(
+        max_length=64,
+        unique=True,
+        help_text="SHA-256 of the file's bytes"
+    )
+    size = models.BigIntegerField(help_text="Size of the file in bytes")
+    storage_backend = models.CharField(
+        max_length=20,
+        help_text="Name of the storage backend holding the file"
+    )
+    storage_key = models.CharField(
+        max_length=255,
+        help_text="Backend-specific key of the stored file"
+    )
+    derivatives = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Downscaled copies of an image (see capsules.derivatives)"
+    )
+    ref_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of contents using this file"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ContentBlobManager()
+
+    @property
+    def storage_ref(self):
+        """Storage reference (``"<backend>:<key>"``) of the file."""
+        return make_ref(self.storage_backend, self.storage_key)
+
+    def delete_files(self):
+        """Delete the stored file and its derivatives."""
+        from .derivatives import derivative_refs
+
+        keys = {}
+        for ref in [self.storage_ref] + derivative_refs(self.derivatives):
+            backend, key = split_ref(ref)
+            keys.setdefault(backend, []).append(key)
+        for backend, backend_keys in keys.items():
+            try:
+                get_content_storage(backend).delete_many(backend_keys)
+            except Exception as e:
+                logger.warning("Could not delete files of blob %s, retrying later: %s", self.digest, e)
+                PendingStorageDeletion.objects.enqueue(make_ref(backend, key) for key in backend_keys)
+
+    def __str__(self):
+        """String representation of the blob."""
+        return f'{self.digest[:12]} ({self.ref_count} refs)'
 
 
 class CapsuleContent(models.Model):
@@ -142,6 +538,12 @@ class CapsuleContent(models.Model):
         ('document', 'Document')
     ]
     
+    UPLOAD_STATUSES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed')
+    ]
+    
     # Relationship to capsule
     capsule = models.ForeignKey(
         TimeCapsule, 
@@ -160,7 +562,47 @@ class CapsuleContent(models.Model):
         'file',
         resource_type='auto',
         folder='capsule_contents',
-        help_text="The actual file to be stored in the time capsule"
+        blank=True,
+        help_text="Legacy Cloudinary reference; new uploads are kept in storage_key"
+    )
+    storage_backend = models.CharField(
+        max_length=20,
+        default=default_storage_name,
+        help_text="Name of the storage backend holding the file"
+    )
+    storage_key = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text="Backend-specific key of the stored file"
+    )
+    blob = models.ForeignKey(
+        ContentBlob,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='contents',
+        help_text="Shared stored file; storage_backend and storage_key copy it"
+    )
+    upload_status = models.CharField(
+        max_length=10,
+        choices=UPLOAD_STATUSES,
+        default='ready',
+        help_text="Whether the file has reached storage (see capsules.pipeline)"
+    )
+    upload_error = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text="Why the last upload failed"
+    )
+    upload_queued_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the pending upload was handed to the pipeline"
+    )
+    derivatives = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Downscaled copies of an image (see capsules.derivatives)"
     )
     uploaded_at = models.DateTimeField(
         auto_now_add=True,
@@ -175,25 +617,71 @@ class CapsuleContent(models.Model):
         help_text="Description of what this content represents"
     )
 
+    objects = CapsuleContentQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
         """
-        Override save method to add logging for debugging file uploads.
+        Override save method to store newly uploaded files.
         
-        Logs various file attributes to help track upload issues.
+        A file assigned to ``file`` (e.g. by CapsuleContentForm) is written
+        to the default storage backend, unless the same bytes are stored
+        already, and replaced by its ``storage_key``. The blob of the
+        previous file is released once the row points at the new one.
         """
-        print("\n=== Saving CapsuleContent ===")
-        print(f"Title: {self.title}")
-        print(f"Content Type: {self.content_type}")
-        print(f"File: {self.file}")
-        print(f"File name: {self.file.name if self.file else 'No file'}")
-        if hasattr(self.file, 'file') and self.file.file:
-            print(f"File size: {self.file.size} bytes")
-            if hasattr(self.file, 'content_type'):
-                print(f"File content type: {self.file.content_type}")
-        super().save(*args, **kwargs)
-        print(f"Saved successfully with ID: {self.pk}")
-        if self.file:
-            print(f"File URL: {self.file.url}")
+        if not isinstance(self.file, File):
+            super().save(*args, **kwargs)
+            logger.debug("Saved content %s", self.pk)
+            return
+        previous = self.blob_id
+        self.store_file(self.file)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # Released after the save: the row's PROTECT reference is gone now
+            if previous:
+                ContentBlob.objects.release(previous)
+        logger.debug("Saved content %s", self.pk)
+
+    def store_file(self, fileobj, backend=None):
+        """
+        Point this content at the blob of ``fileobj``, storing it if new.
+        
+        Does not save; a blob the content pointed at before is still
+        referenced by the row and is released by :meth:`save`.
+        
+        Args:
+            fileobj: The uploaded file
+            backend: Backend name for new files, defaults to
+                CAPSULES_DEFAULT_STORAGE
+        """
+        storage = get_content_storage(backend)
+        resource_type = RESOURCE_TYPES.get(self.content_type, 'auto')
+        logger.debug(
+            "Storing file for content %s (title=%r, content_type=%s, name=%s, size=%s, backend=%s)",
+            self.pk, self.title, self.content_type, fileobj.name,
+            getattr(fileobj, 'size', None), storage.name
+        )
+        blob, created = ContentBlob.objects.acquire(
+            file_digest(fileobj),
+            fileobj.size,
+            storage,
+            lambda: storage.save(fileobj.name, fileobj, resource_type),
+        )
+        self.use_blob(blob)
+        self.file = ''
+
+    def use_blob(self, blob):
+        """Point this content at ``blob`` without saving."""
+        self.blob = blob
+        self.storage_backend = blob.storage_backend
+        self.storage_key = blob.storage_key
+        self.derivatives = blob.derivatives
+
+    @property
+    def storage_ref(self):
+        """Storage reference (``"<backend>:<key>"``) of the file, or ''."""
+        if not self.storage_key:
+            return ''
+        return make_ref(self.storage_backend, self.storage_key)
 
     def get_file_url(self):
         """Get the protected URL for the file"""
@@ -205,3 +693,188 @@ class CapsuleContent(models.Model):
 
     class Meta:
         ordering = ['uploaded_at']
+        indexes = [
+            # Contents of one capsule in upload order
+            models.Index(fields=['capsule', 'uploaded_at'], name='content_capsule_uploaded_idx'),
+            # Pending uploads, for the sweep of those lost to a restart
+            models.Index(
+                fields=['upload_queued_at'],
+                name='content_pending_upload_idx',
+                condition=Q(upload_status='pending'),
+            ),
+        ]
+
+
+def release_content_blob(sender, instance, **kwargs):
+    """post_delete receiver dropping a deleted content's blob reference."""
+    if instance.blob_id:
+        ContentBlob.objects.release(instance.blob_id)
+
+
+class UploadSession(models.Model):
+    """
+    A chunked, resumable file upload in progress.
+    
+    The client sends the file in chunks of ``chunk_size`` bytes; each
+    accepted chunk advances ``received``, so an interrupted upload resumes
+    from there. The bytes live in a temporary file (see capsules.uploads)
+    until the upload is completed and turned into a CapsuleContent.
+    """
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions',
+        help_text="The user uploading the file"
+    )
+    capsule = models.ForeignKey(
+        TimeCapsule,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions',
+        help_text="The time capsule the file is uploaded to"
+    )
+    filename = models.CharField(max_length=255, help_text="Original name of the file")
+    mime_type = models.CharField(max_length=100, help_text="MIME type reported by the client")
+    size = models.BigIntegerField(help_text="Total size of the file in bytes")
+    chunk_size = models.PositiveIntegerField(help_text="Size of every chunk but the last")
+    received = models.BigIntegerField(default=0, help_text="Bytes acknowledged so far")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def is_complete(self):
+        """Whether every byte of the file has been received."""
+        return self.received >= self.size
+
+    def __str__(self):
+        """String representation of the upload."""
+        return f'{self.filename} ({self.received}/{self.size})'
+
+    class Meta:
+        indexes = [
+            # Stale sessions are purged by last activity
+            models.Index(fields=['updated_at'], name='upload_updated_idx'),
+        ]
+
+
+class ImportJob(models.Model):
+    """
+    A bulk import of an archive or directory into a new time capsule.
+    
+    The files of the source are imported in a fixed order, one batch at a
+    time; every batch advances ``position`` in the same transaction that
+    creates its contents, so an interrupted import resumes after the last
+    committed batch without adding any file twice (see capsules.imports).
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='import_jobs',
+        help_text="The user importing the files"
+    )
+    capsule = models.ForeignKey(
+        TimeCapsule,
+        on_delete=models.CASCADE,
+        related_name='import_jobs',
+        help_text="The time capsule created for the import"
+    )
+    source = models.CharField(max_length=500, help_text="Path of the ZIP file or directory imported")
+    uploaded = models.BooleanField(
+        default=False,
+        help_text="Whether the source is an uploaded archive, removed once imported"
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    total = models.PositiveIntegerField(default=0, help_text="Number of files to import")
+    position = models.PositiveIntegerField(default=0, help_text="Files handled so far")
+    imported = models.PositiveIntegerField(default=0, help_text="Files added to the capsule")
+    bytes_imported = models.BigIntegerField(default=0, help_text="Bytes of the files added")
+    failures = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Files that could not be imported, with the reason"
+    )
+    files_per_second = models.FloatField(default=0, help_text="Throughput of the latest run")
+    bytes_per_second = models.FloatField(default=0, help_text="Throughput of the latest run")
+    error = models.CharField(max_length=255, blank=True, help_text="Why the import stopped, if it failed")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def is_finished(self):
+        """Whether every file has been handled."""
+        return self.position >= self.total
+
+    def __str__(self):
+        """String representation of the import."""
+        return f'{self.source} ({self.position}/{self.total})'
+
+
+class PendingStorageDeletionManager(models.Manager):
+    """Queue of stored files to delete."""
+
+    def enqueue(self, refs):
+        """
+        Queue stored files for deletion; files queued already are skipped.
+        
+        Args:
+            refs: Storage references (``"<backend>:<key>"``) of the files
+        """
+        rows = []
+        for ref in refs:
+            backend, key = split_ref(ref)
+            rows.append(self.model(storage_backend=backend, storage_key=key))
+        self.bulk_create(rows, ignore_conflicts=True)
+
+
+class PendingStorageDeletion(models.Model):
+    """
+    A stored file waiting to be deleted.
+    
+    Files are deleted in batches by capsules.deletion, which retries a
+    failed batch with exponential backoff until
+    ``CAPSULES_STORAGE_DELETE_RETRIES`` attempts have failed; the row then
+    stays for inspection.
+    """
+    
+    storage_backend = models.CharField(
+        max_length=20,
+        help_text="Name of the storage backend holding the file"
+    )
+    storage_key = models.CharField(
+        max_length=255,
+        help_text="Backend-specific key of the stored file"
+    )
+    attempts = models.PositiveIntegerField(default=0, help_text="Failed deletion attempts")
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        help_text="When to try deleting the file next"
+    )
+    last_error = models.CharField(max_length=255, blank=True, help_text="Why the last attempt failed")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = PendingStorageDeletionManager()
+
+    def __str__(self):
+        """String representation of the queued file."""
+        return make_ref(self.storage_backend, self.storage_key)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['storage_backend', 'storage_key'], name='pending_deletion_unique'
+            ),
+        ]
+        indexes = [
+            # Due files, oldest first
+            models.Index(fields=['next_attempt_at'], name='pending_deletion_due_idx'),
+        ]
@@ -0,0 +1,162 @@
+"""Pagination helpers for large capsule tables.
+
+- Keyset (cursor) pagination for capsule and content lists: pages are
+  addressed by an opaque cursor encoding the ``(created_at, id)`` (or
+  another timestamp field) of the last row on the previous page instead of
+  an OFFSET, so every page costs the same index range scan no matter how
+  deep the user scrolls.
+- An admin paginator that avoids an exact ``COUNT(*)`` on huge tables.
+"""
+
+import base64
+from dataclasses import dataclass
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+DEFAULT_PAGE_SIZE = 24
+
+
+@dataclass
+class KeysetPage:
+    """A single page of a keyset-paginated queryset.
+
+    Attributes:
+        items: The objects on this page
+        next_cursor: Cursor for the following page, or None on the last page
+    """
+    items: list
+    next_cursor: str = None
+
+    @property
+    def has_next(self):
+        """Whether another page follows this one."""
+        return self.next_cursor is not None
+
+
+def encode_cursor(obj, field='created_at'):
+    """
+    Encode the position of ``obj`` as an opaque, URL-safe cursor.
+
+    Args:
+        obj: Object with a ``field`` timestamp and a ``pk``
+        field: Name of the timestamp the list is ordered by
+
+    Returns:
+        str: The cursor
+    """
+    raw = f'{getattr(obj, field).isoformat()}|{obj.pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by :func:`encode_cursor`.
+
+    Args:
+        cursor: The cursor string
+
+    Returns:
+        tuple: ``(created_at, pk)``, or None if the cursor is malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded).decode().split('|')
+        created_at = parse_datetime(created_at)
+        pk = int(pk)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        return None
+    if created_at is None:
+        return None
+    return created_at, pk
+
+
+def _page_query(queryset, cursor, page_size, field, descending):
+    """The rows of the page following ``cursor``, plus one."""
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        value, pk = position
+        after = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{field}__{after}': value}) | Q(**{field: value, f'pk__{after}': pk})
+        )
+    sign = '-' if descending else ''
+    # Fetch one extra row to learn whether another page follows
+    return queryset.order_by(f'{sign}{field}', f'{sign}pk')[:page_size + 1]
+
+
+def _make_page(items, page_size, field):
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor(items[-1], field)
+    return KeysetPage(items=items, next_cursor=next_cursor)
+
+
+def paginate_keyset(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE,
+                    field='created_at', descending=True):
+    """
+    Return the page of ``queryset`` that follows ``cursor``, newest first.
+
+    Args:
+        queryset: Queryset of objects with a ``field`` timestamp and ``pk``
+        cursor: Cursor of the previous page, or None for the first page
+        page_size: Maximum number of objects per page
+        field: Timestamp field to order by, with ``pk`` breaking ties
+        descending: False to list oldest first instead
+
+    Returns:
+        KeysetPage: The requested page
+    """
+    items = list(_page_query(queryset, cursor, page_size, field, descending))
+    return _make_page(items, page_size, field)
+
+
+async def apaginate_keyset(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE,
+                           field='created_at', descending=True):
+    """Async version of :func:`paginate_keyset`."""
+    items = [obj async for obj in _page_query(queryset, cursor, page_size, field, descending)]
+    return _make_page(items, page_size, field)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that uses the planner's row estimate for unfiltered tables.
+
+    On PostgreSQL an unfiltered queryset is counted from ``pg_class.reltuples``
+    once the estimate exceeds ``exact_count_threshold``; small tables,
+    filtered querysets and other backends are counted exactly. The filter
+    of the model's default manager does not count as one: the rows it hides
+    (capsules waiting to be purged) are too few to matter for an estimate.
+    """
+
+    exact_count_threshold = 100000
+
+    @cached_property
+    def count(self):
+        """Total number of objects, estimated for large unfiltered tables."""
+        estimate = self._estimated_count()
+        if estimate is not None and estimate > self.exact_count_threshold:
+            return estimate
+        return super().count
+
+    def _estimated_count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is None or query.distinct:
+            return None
+        if query.where and query.where != queryset.model._default_manager.all().query.where:
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [connection.ops.quote_name(queryset.model._meta.db_table)],
+            )
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
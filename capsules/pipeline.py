@@ -0,0 +1,324 @@
+"""Background upload pipeline for capsule contents.
+
+Uploading a file to Cloudinary can take several seconds, which used to
+block a gunicorn worker for the whole request. Instead, views now:
+
+1. spool the uploaded file to local disk (:func:`spool_file`),
+2. save the CapsuleContent with ``upload_status='pending'`` and return,
+3. hand the spooled file to a bounded thread pool once the transaction
+   commits (:func:`enqueue_upload`).
+
+The file is hashed while it is spooled. The worker looks the digest up in
+``ContentBlob`` and only uploads bytes that are not stored yet, retrying
+with exponential backoff; it then marks the row ``ready`` (pointing it at
+the shared blob) or ``failed``. New images then get their responsive
+derivatives (see capsules.derivatives). The spooled file is removed either
+way.
+
+Jobs and spooled files only live in the process that queued them, so a
+restart loses them. :func:`fail_stale_uploads` marks rows still pending
+after ``CAPSULES_UPLOAD_STALE_AFTER`` seconds failed, so their owners see
+that the file has to be uploaded again; the ``unlock_capsules --loop``
+clock process and ``purge_uploads`` run it.
+
+Settings:
+
+- ``CAPSULES_UPLOAD_WORKERS``: threads per process uploading files; 0
+  uploads inline when the transaction commits (used by tests)
+- ``CAPSULES_UPLOAD_RETRIES``: attempts per file before giving up
+- ``CAPSULES_UPLOAD_RETRY_DELAY``: seconds before the first retry, doubled
+  for every further retry
+- ``CAPSULES_SPOOL_DIR``: where files wait for their upload
+- ``CAPSULES_UPLOAD_STALE_AFTER``: seconds after which a pending upload
+  is considered lost
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .derivatives import build_derivatives
+from .hashing import new_hasher, path_digest
+from .models import CapsuleContent, ContentBlob, TimeCapsule
+from .sniffing import RESOURCE_TYPES
+from .storage import get_content_storage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 2.0
+DEFAULT_STALE_AFTER = 60 * 60
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def spool_dir():
+    """Directory holding files waiting for their upload."""
+    return getattr(
+        settings,
+        'CAPSULES_SPOOL_DIR',
+        os.path.join(tempfile.gettempdir(), 'capsule_spool'),
+    )
+
+
+def spool_file(fileobj):
+    """
+    Copy an uploaded file to the spool directory, hashing it on the way.
+
+    Args:
+        fileobj: The uploaded file
+
+    Returns:
+        tuple: Path of the spooled copy and the file's content digest
+    """
+    os.makedirs(spool_dir(), exist_ok=True)
+    ext = os.path.splitext(fileobj.name or '')[1].lower()
+    path = os.path.join(spool_dir(), f'{uuid.uuid4().hex}{ext}')
+    # Reuse the digest taken by the upload handler if there is one
+    digest = getattr(fileobj, 'content_digest', None)
+    hasher = None if digest else new_hasher()
+    chunks = fileobj.chunks() if hasattr(fileobj, 'chunks') else iter(lambda: fileobj.read(1024 * 1024), b'')
+    with open(path, 'wb') as out:
+        for chunk in chunks:
+            out.write(chunk)
+            if hasher:
+                hasher.update(chunk)
+    return path, digest or hasher.hexdigest()
+
+
+def adopt_file(path):
+    """
+    Move a file that is already on local disk into the spool directory.
+
+    Args:
+        path: Path of the file, e.g. a completed chunked upload
+
+    Returns:
+        str: Path of the spooled file
+    """
+    os.makedirs(spool_dir(), exist_ok=True)
+    spooled = os.path.join(spool_dir(), f'{uuid.uuid4().hex}{os.path.splitext(path)[1]}')
+    shutil.move(path, spooled)
+    return spooled
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'CAPSULES_UPLOAD_WORKERS', DEFAULT_WORKERS),
+                thread_name_prefix='capsule-upload',
+            )
+        return _executor
+
+
+def save_pending(content, fileobj):
+    """
+    Save ``content`` right away and upload ``fileobj`` in the background.
+
+    Args:
+        content: Unsaved or existing CapsuleContent the file belongs to
+        fileobj: The uploaded file; it is spooled before this returns
+    """
+    path, digest = spool_file(fileobj)
+    enqueue_upload(content, path, fileobj.name, digest)
+
+
+def enqueue_upload(content, path, name, digest=None):
+    """
+    Mark ``content`` pending and upload the spooled file once committed.
+
+    An existing file stays in place, and is served, until the new one is
+    ready.
+
+    Args:
+        content: The CapsuleContent the file belongs to
+        path: Path of the spooled file; the pipeline takes ownership
+        name: Original file name
+        digest: Content digest of the file, computed by the worker if None
+    """
+    content.file = ''
+    content.upload_status = 'pending'
+    content.upload_error = ''
+    content.upload_queued_at = timezone.now()
+    content.save()
+    backend = get_content_storage().name
+    logger.info("Queued upload of %s for content %s to %s", name, content.pk, backend)
+
+    _submit_on_commit(process_upload, content.pk, content.content_type, path, name, backend, digest)
+
+
+def _submit_on_commit(func, *args):
+    """Run ``func(*args)`` on the thread pool once the transaction commits."""
+    if getattr(settings, 'CAPSULES_UPLOAD_WORKERS', DEFAULT_WORKERS):
+        transaction.on_commit(lambda: _get_executor().submit(_in_worker, func, *args))
+    else:
+        transaction.on_commit(lambda: func(*args))
+
+
+def _in_worker(func, *args):
+    # Worker threads get their own database connections; drop them when done
+    try:
+        func(*args)
+    except Exception:
+        logger.exception("%s crashed for content %s", func.__name__, args[0])
+    finally:
+        close_old_connections()
+
+
+def process_upload(content_id, content_type, path, name, backend, digest=None):
+    """
+    Store a spooled file and record the outcome on its content row.
+
+    A file whose bytes are stored already is not uploaded again; the row
+    just takes a reference to the existing blob.
+
+    Args:
+        content_id: Primary key of the CapsuleContent
+        content_type: 'image', 'video' or 'document'
+        path: Path of the spooled file; removed afterwards
+        name: Original file name
+        backend: Name of the storage backend to upload new files to
+        digest: Content digest of the file; hashed here if None (chunked
+            uploads arrive over several requests and cannot be hashed
+            as they stream in)
+
+    Returns:
+        str: The resulting upload status, 'ready' or 'failed'
+    """
+    storage = get_content_storage(backend)
+    resource_type = RESOURCE_TYPES.get(content_type, 'auto')
+
+    try:
+        try:
+            blob, created = ContentBlob.objects.acquire(
+                digest or path_digest(path),
+                os.path.getsize(path),
+                storage,
+                lambda: _transfer(content_id, storage, path, name, resource_type),
+            )
+        except Exception as e:
+            CapsuleContent.objects.filter(pk=content_id).update(
+                upload_status='failed', upload_error=str(e)[:255]
+            )
+            TimeCapsule.objects.filter(contents=content_id).bump_version()
+            return 'failed'
+
+        with transaction.atomic():
+            content = CapsuleContent.objects.select_for_update().filter(pk=content_id).first()
+            if content is not None:
+                previous = content.blob_id
+                content.use_blob(blob)
+                content.upload_status = 'ready'
+                content.upload_error = ''
+                content.save(update_fields=[
+                    'blob', 'storage_backend', 'storage_key', 'derivatives',
+                    'upload_status', 'upload_error',
+                ])
+                if previous:
+                    ContentBlob.objects.release(previous)
+        if content is None:
+            # The content was deleted while its file was uploading
+            ContentBlob.objects.release(blob.pk)
+            return 'ready'
+        logger.info(
+            "Stored content %s in %s (%s)",
+            content_id, blob.storage_backend, 'uploaded' if created else 'deduplicated'
+        )
+        if created and content_type == 'image':
+            build_derivatives(content_id, path, storage, blob.pk)
+    finally:
+        _remove(path)
+    return 'ready'
+
+
+def _transfer(content_id, storage, path, name, resource_type):
+    """Upload a spooled file, retrying with backoff; returns its key."""
+    retries = getattr(settings, 'CAPSULES_UPLOAD_RETRIES', DEFAULT_RETRIES)
+    delay = getattr(settings, 'CAPSULES_UPLOAD_RETRY_DELAY', DEFAULT_RETRY_DELAY)
+    for attempt in range(1, retries + 1):
+        try:
+            with open(path, 'rb') as spooled:
+                return storage.save(name, spooled, resource_type)
+        except Exception as e:
+            logger.warning(
+                "Upload of content %s failed (attempt %s/%s): %s",
+                content_id, attempt, retries, e
+            )
+            if attempt == retries:
+                raise
+            time.sleep(delay * 2 ** (attempt - 1))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def fail_stale_uploads(now=None):
+    """
+    Mark uploads pending for longer than CAPSULES_UPLOAD_STALE_AFTER failed.
+
+    Their job and spooled file were lost with the process that queued
+    them, so they would otherwise stay pending for good.
+
+    Args:
+        now: Reference time, defaults to the current time
+
+    Returns:
+        int: Number of uploads marked failed
+    """
+    stale_after = getattr(settings, 'CAPSULES_UPLOAD_STALE_AFTER', DEFAULT_STALE_AFTER)
+    cutoff = (now or timezone.now()) - timedelta(seconds=stale_after)
+    with transaction.atomic():
+        stale = CapsuleContent.objects.filter(upload_status='pending', upload_queued_at__lt=cutoff)
+        capsule_ids = list(stale.values_list('capsule_id', flat=True).distinct())
+        count = stale.update(
+            upload_status='failed',
+            upload_error='The upload was interrupted; please upload the file again.',
+        )
+        if count:
+            TimeCapsule.objects.filter(pk__in=capsule_ids).bump_version()
+    if count:
+        logger.warning("Marked %s interrupted uploads failed", count)
+    return count
+
+
+def enqueue_derivatives(content, fileobj):
+    """
+    Build the derivatives of an image that is already in storage.
+
+    Used when the original was uploaded by the request itself (e.g. by
+    capsules.bulk); the file is spooled and processed once committed.
+
+    Args:
+        content: The saved CapsuleContent
+        fileobj: The uploaded image
+    """
+    path, _ = spool_file(fileobj)
+    _submit_on_commit(
+        process_derivatives, content.pk, path, content.storage_backend, content.blob_id
+    )
+
+
+def process_derivatives(content_id, path, backend, blob_id=None):
+    """Build the derivatives of a spooled image, then remove the file."""
+    try:
+        build_derivatives(content_id, path, get_content_storage(backend), blob_id)
+    finally:
+        _remove(path)
@@ -0,0 +1,501 @@
+"""Ranked full-text search over capsules and their contents.
+
+Two documents are indexed:
+
+- ``capsule``: a capsule's title, description, and the titles and
+  descriptions of all its contents
+- ``content``: a content's title and description
+
+The index lives next to the tables it covers and is kept up to date row by
+row: saving or deleting a capsule or content re-indexes the documents it
+appears in (see the receivers below, connected in ``CapsulesConfig.ready``),
+and code that writes rows without signals calls :func:`index` itself. A
+capsule document aggregates all of its contents, so content changes only
+re-index their own row right away; their capsules are re-indexed once the
+transaction commits, each once however many of its contents changed (see
+:func:`index_on_commit`).
+
+Backends are picked by database vendor, or set explicitly with
+``CAPSULES_SEARCH_BACKEND`` (dotted path of a :class:`SearchBackend`
+subclass):
+
+- ``sqlite``: an FTS5 table per document, ranked by BM25
+- ``postgresql``: a table of weighted ``tsvector`` documents per kind with
+  a GIN index, ranked by ``ts_rank_cd`` in the text search configuration
+  ``CAPSULES_SEARCH_CONFIG``
+- anything else: :class:`SearchBackend` itself, which scans with
+  ``icontains`` and does not rank
+
+The index tables of the two vendor backends are created by migration 0017;
+``manage.py rebuild_search_index`` creates missing tables and refills them. Every word of a query must match, as a
+prefix, somewhere in the document.
+"""
+
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import CapsuleContent, TimeCapsule
+
+DEFAULT_BACKENDS = {
+    'sqlite': 'capsules.search.SQLiteSearchBackend',
+    'postgresql': 'capsules.search.PostgresSearchBackend',
+}
+
+# Words of a query beyond this are ignored
+MAX_TERMS = 10
+
+# Fields of each document, most important first
+FIELDS = {
+    'capsule': ('title', 'description', 'contents'),
+    'content': ('title', 'description'),
+}
+
+# Fields of a capsule document that may match while its contents are hidden
+PUBLIC_FIELDS = ('title', 'description')
+
+KINDS = {TimeCapsule: 'capsule', CapsuleContent: 'content'}
+MODELS = {kind: model for model, kind in KINDS.items()}
+
+# Documents waiting for their transaction to commit, per thread
+_pending = threading.local()
+
+
+def parse_terms(query):
+    """
+    Split a search query into the words that must match.
+
+    Args:
+        query: Text entered by the user
+
+    Returns:
+        list: Lower-cased words, at most MAX_TERMS
+    """
+    return re.findall(r'\w+', (query or '').lower())[:MAX_TERMS]
+
+
+def _source_sql(kind, aggregate):
+    """SELECT of the pk and the FIELDS of every ``kind`` document."""
+    capsules = TimeCapsule._meta.db_table
+    contents = CapsuleContent._meta.db_table
+    if kind == 'capsule':
+        text = aggregate.format("cc.title || ' ' || cc.description")
+        return (
+            f"SELECT c.id, c.title, c.description, "
+            f"COALESCE((SELECT {text} FROM {contents} cc WHERE cc.capsule_id = c.id), '') "
+            f"FROM {capsules} c"
+        )
+    return f'SELECT c.id, c.title, c.description FROM {contents} c'
+
+
+def _chunks(pks, size=500):
+    pks = list(pks)
+    for start in range(0, len(pks), size):
+        yield pks[start:start + size]
+
+
+class SearchBackend:
+    """
+    Fallback backend without an index: matches with ``icontains``.
+
+    Subclasses keep an index table per document kind and override every
+    method.
+
+    Attributes:
+        vendor: Database vendor the backend works with, None for any
+    """
+    vendor = None
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self):
+        """Create the index tables."""
+
+    def uninstall(self):
+        """Drop the index tables."""
+
+    def index(self, kind, pks):
+        """
+        (Re-)index documents.
+
+        Args:
+            kind: 'capsule' or 'content'
+            pks: Primary keys of the documents; missing rows are skipped
+        """
+
+    def remove(self, kind, pks):
+        """Remove documents from the index."""
+
+    def clear(self, kind):
+        """Remove every document of ``kind`` from the index."""
+
+    def lookup(self, kind, terms, fields=None):
+        """
+        Condition and rank of documents matching every term.
+
+        Args:
+            kind: 'capsule' or 'content'
+            terms: Words from :func:`parse_terms`, not empty
+            fields: FIELDS the terms may match in, defaults to all
+
+        Returns:
+            tuple: ``(Q, expression)``; the rank is higher for better
+            matches and NULL for documents that do not match
+        """
+        fields = fields or FIELDS[kind]
+        condition = Q()
+        for term in terms:
+            any_field = Q()
+            for name in fields:
+                if name == 'contents':
+                    any_field |= Q(pk__in=CapsuleContent.objects.filter(
+                        Q(title__icontains=term) | Q(description__icontains=term)
+                    ).values('capsule_id'))
+                else:
+                    any_field |= Q(**{f'{name}__icontains': term})
+            condition &= any_field
+        return condition, Value(0.0)
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """FTS5 tables whose rowid is the primary key of the document."""
+    vendor = 'sqlite'
+
+    # Column weights of bm25(), in FIELDS order
+    WEIGHTS = (10.0, 4.0, 1.0)
+
+    def _table(self, kind):
+        return f'capsules_{kind}_search'
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            for kind, fields in FIELDS.items():
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {self._table(kind)} "
+                    f"USING fts5({', '.join(fields)}, tokenize = 'unicode61 remove_diacritics 2')"
+                )
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            for kind in FIELDS:
+                cursor.execute(f'DROP TABLE IF EXISTS {self._table(kind)}')
+
+    def index(self, kind, pks):
+        table = self._table(kind)
+        source = _source_sql(kind, "group_concat({}, ' ')")
+        with self.connection.cursor() as cursor:
+            for chunk in _chunks(pks):
+                marks = ', '.join(['%s'] * len(chunk))
+                cursor.execute(f'DELETE FROM {table} WHERE rowid IN ({marks})', chunk)
+                cursor.execute(
+                    f"INSERT INTO {table} (rowid, {', '.join(FIELDS[kind])}) "
+                    f"{source} WHERE c.id IN ({marks})",
+                    chunk,
+                )
+
+    def remove(self, kind, pks):
+        with self.connection.cursor() as cursor:
+            for chunk in _chunks(pks):
+                marks = ', '.join(['%s'] * len(chunk))
+                cursor.execute(f'DELETE FROM {self._table(kind)} WHERE rowid IN ({marks})', chunk)
+
+    def clear(self, kind):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self._table(kind)}')
+
+    def lookup(self, kind, terms, fields=None):
+        table = self._table(kind)
+        query = ' '.join(f'"{term}"*' for term in terms)
+        if fields:
+            query = f"{{{' '.join(fields)}}} : ({query})"
+        weights = ', '.join(str(w) for w in self.WEIGHTS[:len(FIELDS[kind])])
+        outer = self.connection.ops.quote_name(MODELS[kind]._meta.db_table)
+        return (
+            Q(pk__in=RawSQL(f'SELECT rowid FROM {table} WHERE {table} MATCH %s', [query])),
+            # bm25() is lower for better matches
+            RawSQL(
+                f'SELECT -bm25({table}, {weights}) FROM {table} '
+                f'WHERE {table} MATCH %s AND rowid = {outer}."id"',
+                [query],
+                output_field=FloatField(),
+            ),
+        )
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Tables of weighted tsvector documents with a GIN index.
+
+    The tables have no foreign key to the indexed rows: Django does not
+    know them, so ``flush`` and test truncation could not empty the
+    indexed tables past one. Deletes remove their documents instead.
+    """
+    vendor = 'postgresql'
+
+    # tsvector weight of each of FIELDS
+    WEIGHTS = 'ABC'
+
+    def _table(self, kind):
+        return f'capsules_{kind}_search'
+
+    def _config(self):
+        return getattr(settings, 'CAPSULES_SEARCH_CONFIG', 'english')
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            for kind in FIELDS:
+                table = self._table(kind)
+                cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS {table} ('
+                    f'object_id bigint PRIMARY KEY, document tsvector NOT NULL)'
+                )
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {table}_document_idx ON {table} USING GIN (document)'
+                )
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            for kind in FIELDS:
+                cursor.execute(f'DROP TABLE IF EXISTS {self._table(kind)}')
+
+    def index(self, kind, pks):
+        fields = FIELDS[kind]
+        document = ' || '.join(
+            f"setweight(to_tsvector(%s::regconfig, COALESCE(src.{name}, '')), '{weight}')"
+            for name, weight in zip(fields, self.WEIGHTS)
+        )
+        source = _source_sql(kind, "string_agg({}, ' ')")
+        table = self._table(kind)
+        with self.connection.cursor() as cursor:
+            for chunk in _chunks(pks):
+                cursor.execute(
+                    f"INSERT INTO {table} (object_id, document) "
+                    f"SELECT src.id, {document} "
+                    f"FROM ({source} WHERE c.id = ANY(%s)) AS src (id, {', '.join(fields)}) "
+                    f"ON CONFLICT (object_id) DO UPDATE SET document = EXCLUDED.document",
+                    [self._config()] * len(fields) + [chunk],
+                )
+
+    def remove(self, kind, pks):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self._table(kind)} WHERE object_id = ANY(%s)', [list(pks)]
+            )
+
+    def clear(self, kind):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self._table(kind)}')
+
+    def lookup(self, kind, terms, fields=None):
+        table = self._table(kind)
+        weights = ''.join(
+            weight for name, weight in zip(FIELDS[kind], self.WEIGHTS)
+            if fields is None or name in fields
+        )
+        query = ' & '.join(f'{term}:*{weights}' for term in terms)
+        tsquery = 'to_tsquery(%s::regconfig, %s)'
+        outer = self.connection.ops.quote_name(MODELS[kind]._meta.db_table)
+        return (
+            Q(pk__in=RawSQL(
+                f'SELECT object_id FROM {table} WHERE document @@ {tsquery}',
+                [self._config(), query],
+            )),
+            RawSQL(
+                f'SELECT ts_rank_cd(document, {tsquery}) FROM {table} '
+                f'WHERE object_id = {outer}."id" AND document @@ {tsquery}',
+                [self._config(), query, self._config(), query],
+                output_field=FloatField(),
+            ),
+        )
+
+
+def get_search_backend(using='default'):
+    """
+    Return the search backend of a database.
+
+    Args:
+        using: Database alias
+
+    Returns:
+        SearchBackend: The configured backend, else the one for the
+        database vendor
+    """
+    connection = connections[using]
+    path = getattr(settings, 'CAPSULES_SEARCH_BACKEND', None) or DEFAULT_BACKENDS.get(connection.vendor)
+    backend_class = import_string(path) if path else SearchBackend
+    return backend_class(connection)
+
+
+def index(kind, pks, using='default'):
+    """Re-index the ``kind`` documents of ``pks``; see :meth:`SearchBackend.index`."""
+    pks = [pk for pk in pks if pk is not None]
+    if pks:
+        get_search_backend(using).index(kind, pks)
+
+
+def index_on_commit(kind, pks, using='default'):
+    """
+    Re-index documents once the current transaction commits.
+
+    Documents queued within one transaction are indexed together, each
+    once. Outside a transaction they are indexed right away.
+
+    Args:
+        kind: 'capsule' or 'content'
+        pks: Primary keys of the documents
+        using: Database alias
+    """
+    if not hasattr(_pending, 'documents'):
+        _pending.documents = defaultdict(set)
+    _pending.documents[using, kind].update(pk for pk in pks if pk is not None)
+    # Every queued document is indexed by the first callback to run
+    transaction.on_commit(lambda: _index_pending(using), using=using)
+
+
+def _index_pending(using):
+    for key in [key for key in _pending.documents if key[0] == using]:
+        index(key[1], _pending.documents.pop(key), using=using)
+
+
+def rebuild(using='default'):
+    """
+    Create any missing index tables and index every capsule and content
+    from scratch.
+
+    Returns:
+        dict: Number of documents indexed per kind
+    """
+    backend = get_search_backend(using)
+    backend.install()
+    counts = {}
+    for kind, model in MODELS.items():
+        backend.clear(kind)
+        # Every row, deleted capsules included; searches filter those out
+        pks = list(model._base_manager.using(using).values_list('pk', flat=True).order_by('pk'))
+        for chunk in _chunks(pks, 5000):
+            backend.index(kind, chunk)
+        counts[kind] = len(pks)
+    return counts
+
+
+def matches(model, query, fields=None, using='default'):
+    """
+    Condition selecting the rows of ``model`` that match ``query``.
+
+    For use inside other queries, e.g. ``capsule__in``; unlike
+    :func:`search` it does not rank.
+
+    Args:
+        model: TimeCapsule or CapsuleContent
+        query: Text entered by the user
+        fields: FIELDS the terms may match in, defaults to all
+        using: Database alias
+
+    Returns:
+        Q: The condition, or None if the query has no words
+    """
+    terms = parse_terms(query)
+    if not terms:
+        return None
+    return get_search_backend(using).lookup(KINDS[model], terms, fields)[0]
+
+
+def search(queryset, query, hidden_contents=None, also=None):
+    """
+    Filter ``queryset`` to the rows matching ``query``, best match first.
+
+    Args:
+        queryset: Queryset of TimeCapsule or CapsuleContent
+        query: Text entered by the user
+        hidden_contents: For capsules, a Q of those whose contents must not
+            be matched (e.g. locked ones); only their title and description
+            are then searched
+        also: Q of further rows to return, ranked below every match (e.g.
+            lookups on related rows the index does not cover)
+
+    Returns:
+        QuerySet: Matching rows annotated with ``search_rank`` (higher is
+        better) and ordered by it
+    """
+    terms = parse_terms(query)
+    if not terms:
+        if also is None:
+            return queryset.none()
+        return (
+            queryset.filter(also)
+            .annotate(search_rank=Value(0.0, output_field=FloatField()))
+            .order_by('-pk')
+        )
+    kind = KINDS[queryset.model]
+    backend = get_search_backend(queryset.db)
+    condition, rank = backend.lookup(kind, terms)
+    if hidden_contents is not None:
+        public_condition, public_rank = backend.lookup(kind, terms, PUBLIC_FIELDS)
+        condition = (condition & ~hidden_contents) | (public_condition & hidden_contents)
+        rank = Case(When(hidden_contents, then=public_rank), default=rank)
+    if also is not None:
+        condition |= also
+    return (
+        queryset.filter(condition)
+        .annotate(search_rank=Coalesce(rank, Value(0.0), output_field=FloatField()))
+        .order_by(F('search_rank').desc(), '-pk')
+    )
+
+
+def search_capsules(user, query, now=None):
+    """
+    Search the capsules ``user`` may view.
+
+    The contents of locked capsules are hidden from everyone, so they are
+    not matched either.
+
+    Args:
+        user: The requesting user
+        query: Text entered by the user
+        now: Reference time for the lock, defaults to the current time
+
+    Returns:
+        TimeCapsuleQuerySet: See :func:`search`
+    """
+    now = now or timezone.now()
+    locked = Q(status='locked', unlock_date__gt=now)
+    return search(TimeCapsule.objects.visible_to(user), query, hidden_contents=locked)
+
+
+def capsule_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    """post_save receiver re-indexing a capsule whose text may have changed."""
+    if raw or (update_fields is not None and not {'title', 'description'} & set(update_fields)):
+        return
+    index('capsule', [instance.pk], using=kwargs.get('using', 'default'))
+
+
+def capsule_deleted(sender, instance, **kwargs):
+    """post_delete receiver removing a capsule from the index."""
+    get_search_backend(kwargs.get('using', 'default')).remove('capsule', [instance.pk])
+
+
+def content_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    """post_save receiver re-indexing a content, and its capsule on commit."""
+    if raw or (update_fields is not None and not {'title', 'description'} & set(update_fields)):
+        return
+    using = kwargs.get('using', 'default')
+    index('content', [instance.pk], using=using)
+    index_on_commit('capsule', [instance.capsule_id], using=using)
+
+
+def content_deleted(sender, instance, origin=None, **kwargs):
+    """post_delete receiver removing a content, re-indexing its capsule on commit."""
+    using = kwargs.get('using', 'default')
+    get_search_backend(using).remove('content', [instance.pk])
+    if origin is not None and getattr(origin, 'model', type(origin)) is not sender:
+        # Cascade from deleting the capsule, which leaves the index itself
+        return
+    index_on_commit('capsule', [instance.capsule_id], using=using)
@@ -0,0 +1,189 @@
+"""Content-type detection from magic bytes.
+
+Browsers report whatever MIME type the operating system associates with a
+file's extension, so the declared type of an upload cannot be trusted.
+:func:`sniff` looks at the first :data:`SNIFF_BYTES` bytes of the file
+instead and maps the detected MIME type to one of
+``CapsuleContent.CONTENT_TYPES`` and to the storage ``resource_type``.
+
+Only the head of the stream is ever read, and detection is a handful of
+prefix comparisons, so it is cheap enough to run on the first chunk of a
+streaming upload before the rest of the file has arrived. See
+``manage.py benchmark_sniffer`` for timings over a sample corpus.
+"""
+
+from dataclasses import dataclass
+
+# Bytes of the file inspected; enough for every signature below
+SNIFF_BYTES = 4096
+
+# Storage resource type for each content type
+RESOURCE_TYPES = {
+    'image': 'image',
+    'video': 'video',
+    'document': 'raw',
+}
+
+# (prefix, MIME type) pairs checked in order
+_PREFIXES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+    (b'%PDF-', 'application/pdf'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/msword'),
+    (b'{\\rtf', 'application/rtf'),
+    (b'ID3', 'audio/mpeg'),
+    (b'OggS', 'application/ogg'),
+    (b'fLaC', 'audio/flac'),
+    (b'MZ', 'application/x-msdownload'),
+    (b'\x7fELF', 'application/x-executable'),
+)
+
+# RIFF containers: form type at bytes 8-12
+_RIFF_TYPES = {
+    b'WEBP': 'image/webp',
+    b'AVI ': 'video/x-msvideo',
+    b'WAVE': 'audio/wav',
+}
+
+# ISO base media files: major brand at bytes 8-12
+_FTYP_BRANDS = {
+    b'heic': 'image/heic',
+    b'heix': 'image/heic',
+    b'mif1': 'image/heif',
+    b'msf1': 'image/heif',
+    b'avif': 'image/avif',
+    b'qt  ': 'video/quicktime',
+    b'M4A ': 'audio/mp4',
+    b'3gp4': 'video/3gpp',
+    b'3gp5': 'video/3gpp',
+    b'3g2a': 'video/3gpp2',
+}
+
+# Office Open XML and OpenDocument packages are ZIP files
+_ZIP_MARKERS = (
+    (b'word/', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+    (b'xl/', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    (b'ppt/', 'application/vnd.openxmlformats-officedocument.presentationml.presentation'),
+    (b'mimetypeapplication/vnd.oasis.opendocument.text', 'application/vnd.oasis.opendocument.text'),
+    (b'mimetypeapplication/vnd.oasis.opendocument.spreadsheet', 'application/vnd.oasis.opendocument.spreadsheet'),
+)
+
+# Detected types that may not be stored even though their family matches
+_REJECTED = {'application/x-msdownload', 'application/x-executable', 'application/ogg'}
+
+# Control bytes that never appear in text files
+_BINARY_BYTES = bytes(range(0, 8)) + bytes(range(14, 27)) + bytes(range(28, 32))
+
+
+@dataclass(frozen=True)
+class SniffResult:
+    """What a file turned out to be.
+
+    Attributes:
+        mime_type: Detected MIME type, 'application/octet-stream' if unknown
+        content_type: 'image', 'video' or 'document', or None if the file
+            cannot be stored as capsule content
+    """
+    mime_type: str
+    content_type: str = None
+
+    @property
+    def resource_type(self):
+        """Storage resource type for the file, or None if unsupported."""
+        return RESOURCE_TYPES.get(self.content_type)
+
+    @property
+    def is_supported(self):
+        """Whether the file can be stored as capsule content."""
+        return self.content_type is not None
+
+
+def _detect_mime(head):
+    for prefix, mime_type in _PREFIXES:
+        if head.startswith(prefix):
+            return mime_type
+    tag = head[8:12]
+    if head.startswith(b'BM') and head[6:10] == b'\x00\x00\x00\x00':
+        return 'image/bmp'
+    if head.startswith(b'RIFF'):
+        return _RIFF_TYPES.get(tag, 'application/octet-stream')
+    if head[4:8] == b'ftyp':
+        return _FTYP_BRANDS.get(tag, 'video/mp4')
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'video/webm' if b'webm' in head[:64] else 'video/x-matroska'
+    if head.startswith(b'PK\x03\x04'):
+        for marker, mime_type in _ZIP_MARKERS:
+            if marker in head:
+                return mime_type
+        return 'application/zip'
+    if head and _is_text(head):
+        return 'text/plain'
+    return 'application/octet-stream'
+
+
+def _is_text(head):
+    sample = head[:512]
+    if len(sample.translate(None, _BINARY_BYTES)) != len(sample):
+        return False
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # The head may end in the middle of a multi-byte character
+        return e.start >= len(head) - 3 and e.reason == 'unexpected end of data'
+    return True
+
+
+def content_type_for_mime(mime_type):
+    """
+    Map a MIME type to one of CapsuleContent.CONTENT_TYPES.
+
+    Returns:
+        str: 'image', 'video' or 'document', or None if not supported
+    """
+    if mime_type in _REJECTED:
+        return None
+    if mime_type.startswith('image/'):
+        return 'image'
+    if mime_type.startswith('video/'):
+        return 'video'
+    if mime_type.startswith('application/') and mime_type != 'application/octet-stream':
+        return 'document'
+    if mime_type.startswith('text/'):
+        return 'document'
+    return None
+
+
+def sniff(head):
+    """
+    Detect the type of a file from its first bytes.
+
+    Args:
+        head: The first bytes of the file; only SNIFF_BYTES are looked at
+
+    Returns:
+        SniffResult: The detected type
+    """
+    mime_type = _detect_mime(head[:SNIFF_BYTES])
+    return SniffResult(mime_type, content_type_for_mime(mime_type))
+
+
+def sniff_file(fileobj):
+    """
+    Detect the type of an open file without moving its read position.
+
+    Args:
+        fileobj: Seekable file-like object, e.g. an UploadedFile
+
+    Returns:
+        SniffResult: The detected type
+    """
+    position = fileobj.tell()
+    try:
+        head = fileobj.read(SNIFF_BYTES)
+    finally:
+        fileobj.seek(position)
+    return sniff(head)
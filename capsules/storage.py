@@ -0,0 +1,273 @@
+"""Pluggable file storage for capsule contents.
+
+Each ``CapsuleContent`` records the name of the backend its file lives in
+and the backend-specific key of the file. Backends are configured with:
+
+- ``CAPSULES_STORAGE_BACKENDS``: backend name -> dotted path of its class
+- ``CAPSULES_DEFAULT_STORAGE``: backend used for new uploads
+
+Two backends ship with the app:
+
+- ``cloudinary``: files are uploaded to Cloudinary and delivered by
+  redirecting to the Cloudinary URL.
+- ``local``: files are written below ``CAPSULES_LOCAL_STORAGE_ROOT`` and
+  streamed by the delivery view itself (Range requests, conditional GETs
+  and zero-copy ``sendfile`` where the server supports it).
+
+A file is referred to outside the database by its *storage reference*,
+``"<backend>:<key>"``.
+"""
+
+import mimetypes
+import os
+import shutil
+import urllib.request
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils._os import safe_join
+from django.utils.module_loading import import_string
+
+from .instrumentation import track_storage
+
+DEFAULT_BACKENDS = {
+    'cloudinary': 'capsules.storage.CloudinaryContentStorage',
+    'local': 'capsules.storage.LocalContentStorage',
+}
+
+
+@dataclass
+class StoredFileInfo:
+    """Metadata of a stored file.
+
+    Attributes:
+        size: Size in bytes
+        modified: Last modification time (aware datetime)
+        etag: Strong entity tag, including the surrounding quotes
+    """
+    size: int
+    modified: datetime
+    etag: str
+
+
+class ContentStorage:
+    """
+    Base class for capsule content storage backends.
+
+    Attributes:
+        name: Name the backend is registered under
+        supports_streaming: Whether the delivery view can stream files from
+            ``path()`` instead of redirecting to ``url()``
+    """
+    name = None
+    supports_streaming = False
+
+    def save(self, name, fileobj, resource_type='auto'):
+        """
+        Store the contents of ``fileobj``.
+
+        Args:
+            name: Original file name, used for the extension
+            fileobj: File-like object positioned at the start
+            resource_type: 'image', 'video', 'raw' or 'auto'
+
+        Returns:
+            str: Key of the stored file
+        """
+        raise NotImplementedError
+
+    def url(self, key):
+        """Return a URL the file can be fetched from directly."""
+        raise NotImplementedError
+
+    def path(self, key):
+        """Return the local filesystem path of the file, if it has one."""
+        return None
+
+    def open(self, key):
+        """
+        Open a stored file for reading.
+
+        Reads the local file when the backend has one, else downloads it
+        from ``url()`` as it is read.
+
+        Returns:
+            A binary file-like object; the caller closes it
+        """
+        path = self.path(key)
+        if path is not None:
+            return open(path, 'rb')
+        with track_storage():
+            return urllib.request.urlopen(self.url(key), timeout=30)
+
+    def info(self, key):
+        """Return a :class:`StoredFileInfo`, or None if unavailable."""
+        return None
+
+    def delete(self, key):
+        """Delete a file; deleting a missing file is not an error."""
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        """Delete several files, batching where the backend allows it."""
+        for key in keys:
+            self.delete(key)
+
+
+class LocalContentStorage(ContentStorage):
+    """Stores files on the local filesystem below a root directory."""
+    name = 'local'
+    supports_streaming = True
+
+    def __init__(self, root=None):
+        self.root = str(root or getattr(
+            settings,
+            'CAPSULES_LOCAL_STORAGE_ROOT',
+            os.path.join(settings.MEDIA_ROOT, 'capsule_contents'),
+        ))
+
+    def save(self, name, fileobj, resource_type='auto'):
+        ext = os.path.splitext(name or '')[1].lower()
+        token = uuid.uuid4().hex
+        key = f'{token[:2]}/{token}{ext}'
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write next to the target and rename, so readers never see a partial file
+        partial = f'{path}.part'
+        with track_storage(), open(partial, 'wb') as out:
+            if hasattr(fileobj, 'chunks'):
+                for chunk in fileobj.chunks():
+                    out.write(chunk)
+            else:
+                shutil.copyfileobj(fileobj, out)
+        os.replace(partial, path)
+        return key
+
+    def url(self, key):
+        return None
+
+    def path(self, key):
+        return safe_join(self.root, key)
+
+    def info(self, key):
+        try:
+            stat = os.stat(self.path(key))
+        except FileNotFoundError:
+            return None
+        return StoredFileInfo(
+            size=stat.st_size,
+            modified=datetime.fromtimestamp(stat.st_mtime, tz=dt_timezone.utc),
+            etag=f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"',
+        )
+
+    def delete(self, key):
+        with track_storage():
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+
+class CloudinaryContentStorage(ContentStorage):
+    """Stores files in Cloudinary; keys are Cloudinary resource strings."""
+    name = 'cloudinary'
+    folder = 'capsule_contents'
+    # Cloudinary's Admin API deletes at most this many resources per call
+    delete_batch_size = 100
+
+    def __init__(self):
+        from cloudinary.models import CloudinaryField
+        self._field = CloudinaryField(resource_type='auto')
+
+    def _resource(self, key):
+        return self._field.parse_cloudinary_resource(key)
+
+    def save(self, name, fileobj, resource_type='auto'):
+        from cloudinary import uploader
+        if hasattr(fileobj, 'seekable') and fileobj.seekable():
+            fileobj.seek(0)
+        with track_storage():
+            resource = uploader.upload_resource(
+                fileobj,
+                type='upload',
+                resource_type=resource_type,
+                folder=self.folder,
+            )
+        return resource.get_prep_value()
+
+    def url(self, key):
+        return self._resource(key).url
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def delete_many(self, keys):
+        from cloudinary import api
+        by_type = {}
+        for key in keys:
+            resource = self._resource(key)
+            by_type.setdefault(resource.resource_type, []).append(resource.public_id)
+        for resource_type, public_ids in by_type.items():
+            for start in range(0, len(public_ids), self.delete_batch_size):
+                with track_storage():
+                    api.delete_resources(
+                        public_ids[start:start + self.delete_batch_size],
+                        resource_type=resource_type,
+                    )
+
+
+_storages = {}
+
+
+def default_storage_name():
+    """Name of the backend new uploads are stored in."""
+    return getattr(settings, 'CAPSULES_DEFAULT_STORAGE', 'cloudinary')
+
+
+def get_content_storage(name=None):
+    """
+    Return the (cached) storage backend registered under ``name``.
+
+    Args:
+        name: Backend name, defaults to CAPSULES_DEFAULT_STORAGE
+
+    Returns:
+        ContentStorage: The backend instance
+    """
+    name = name or default_storage_name()
+    if name not in _storages:
+        backends = getattr(settings, 'CAPSULES_STORAGE_BACKENDS', DEFAULT_BACKENDS)
+        _storages[name] = import_string(backends[name])()
+    return _storages[name]
+
+
+def reset_storages(setting=None, **kwargs):
+    """Forget cached backend instances when storage settings change."""
+    if setting is None or setting.startswith('CAPSULES_'):
+        _storages.clear()
+
+
+def make_ref(backend, key):
+    """Build the storage reference of a file."""
+    return f'{backend}:{key}'
+
+
+def split_ref(ref):
+    """
+    Split a storage reference into its backend name and key.
+
+    Returns:
+        tuple: ``(backend, key)``
+    """
+    backend, sep, key = ref.partition(':')
+    if not sep:
+        # Bare Cloudinary keys, as signed before files had a backend
+        return 'cloudinary', ref
+    return backend, key
+
+
+def guess_content_type(key):
+    """Guess the MIME type of a stored file from its key."""
+    return mimetypes.guess_type(key)[0] or 'application/octet-stream'
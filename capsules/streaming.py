@@ -0,0 +1,142 @@
+"""Streaming file responses with HTTP Range and conditional GET support.
+
+Used by the delivery view for storage backends that keep files on the
+local filesystem. Responses are ``FileResponse`` objects wrapping a real
+file descriptor, so WSGI servers with ``wsgi.file_wrapper`` (gunicorn)
+send them with zero-copy ``sendfile`` - including byte ranges, because the
+descriptor is positioned at the start of the range and the response
+carries the exact Content-Length.
+"""
+
+import re
+
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile:
+    """
+    Read-only view of ``length`` bytes of an open file starting at ``start``.
+
+    ``fileno()`` is exposed so servers can ``sendfile`` the range directly;
+    everything else reads through :meth:`read`, which never runs past the
+    end of the range.
+    """
+
+    def __init__(self, fileobj, start, length):
+        self.fileobj = fileobj
+        self.remaining = length
+        fileobj.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def close(self):
+        self.fileobj.close()
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range ``Range`` header.
+
+    Args:
+        header: Value of the Range header
+        size: Size of the file in bytes
+
+    Returns:
+        tuple: ``(start, end)`` inclusive, None if the header should be
+        ignored (malformed or multiple ranges), or False if the range
+        cannot be satisfied
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    end = int(last) if last else size - 1
+    return start, min(end, size - 1)
+
+
+def _if_range_matches(request, info):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == info.etag
+    modified = parse_http_date_safe(if_range)
+    return modified is not None and int(info.modified.timestamp()) <= modified
+
+
+def stream_file(request, path, info, content_type, cache_control=None):
+    """
+    Build a response streaming the file at ``path``.
+
+    Honours If-None-Match / If-Modified-Since (304), If-Match /
+    If-Unmodified-Since (412), and single byte ranges with If-Range (206
+    or 416).
+
+    Args:
+        request: The HTTP request
+        path: Filesystem path of the file
+        info: capsules.storage.StoredFileInfo of the file
+        content_type: MIME type to send
+        cache_control: Optional Cache-Control header value
+
+    Returns:
+        HttpResponse: 200, 206, 304, 412 or 416 response
+    """
+    last_modified = int(info.modified.timestamp())
+    response = get_conditional_response(
+        request, etag=info.etag, last_modified=last_modified
+    )
+    if response is None:
+        byte_range = None
+        if request.META.get('HTTP_RANGE') and _if_range_matches(request, info):
+            byte_range = parse_range(request.META['HTTP_RANGE'], info.size)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{info.size}'
+        elif byte_range:
+            start, end = byte_range
+            length = end - start + 1
+            response = FileResponse(
+                RangeFile(open(path, 'rb'), start, length),
+                content_type=content_type,
+                status=206,
+            )
+            response['Content-Length'] = str(length)
+            response['Content-Range'] = f'bytes {start}-{end}/{info.size}'
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = info.etag
+    response['Last-Modified'] = http_date(last_modified)
+    if cache_control:
+        response['Cache-Control'] = cache_control
+    return response
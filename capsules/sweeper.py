@@ -0,0 +1,183 @@
+"""Set-based unlock sweeper for time capsules.
+
+This module moves every capsule whose unlock date has passed to its next
+state with a handful of UPDATE statements instead of loading and saving
+each row individually. It can be run:
+- From the ``unlock_capsules`` management command (cron, Heroku scheduler)
+- As an in-process periodic loop, started by the app config in a process
+  that sets ``CAPSULES_RUN_SWEEPER`` (see below)
+- Directly from views, scoped to a single user's capsules
+
+Several processes may sweep at the same time. On backends that support
+``SELECT ... FOR UPDATE SKIP LOCKED`` each batch of due rows is claimed by
+exactly one sweeper; every UPDATE is also filtered on the source status,
+so a row can never be moved twice.
+
+Public capsules unlocked by a sweep are appended to the public feed (see
+capsules.timeline) in the same transaction as their UPDATE.
+
+Settings:
+
+- ``CAPSULES_RUN_SWEEPER``: start the in-process loop in this process; set
+  it on the command line of the web or worker process that should sweep,
+  not in the environment shared with management commands
+- ``CAPSULES_UNLOCK_SWEEP_INTERVAL``: seconds between in-process sweeps
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .models import TimeCapsule
+from .timeline import add_unlocked
+
+logger = logging.getLogger(__name__)
+
+# Source status -> target status for a capsule whose unlock date has passed.
+# A due active capsule is locked and unlocked within the same sweep, which is
+# what two consecutive calls to check_and_unlock() used to do.
+TRANSITIONS = (
+    ('active', 'locked'),
+    ('locked', 'unlocked'),
+)
+
+DEFAULT_BATCH_SIZE = 500
+
+
+@dataclass
+class SweepResult:
+    """Summary of a single sweep.
+
+    Attributes:
+        moved: Number of rows moved out of each source status
+        duration: Wall time of the sweep in seconds
+    """
+    moved: dict = field(default_factory=dict)
+    duration: float = 0.0
+
+    @property
+    def unlocked(self):
+        """Number of capsules that ended the sweep unlocked."""
+        return self.moved.get('locked', 0)
+
+    @property
+    def total(self):
+        """Total number of row transitions performed."""
+        return sum(self.moved.values())
+
+
+def _claim_batch(queryset, batch_size):
+    """Lock and return the primary keys of the next batch of due rows.
+
+    Rows already claimed by another sweeper are skipped rather than waited
+    on. Backends without row locking fall back to a plain SELECT, which is
+    still safe because the following UPDATE re-checks the source status.
+    """
+    if connection.features.has_select_for_update_skip_locked:
+        queryset = queryset.select_for_update(skip_locked=True)
+    return list(queryset.values_list('pk', flat=True)[:batch_size])
+
+
+def sweep_due_capsules(queryset=None, now=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Move every due capsule in ``queryset`` to its next state.
+
+    Args:
+        queryset: Capsules to consider, defaults to all capsules
+        now: Reference time, defaults to the current time
+        batch_size: Maximum number of rows claimed per UPDATE
+
+    Returns:
+        SweepResult: Number of rows moved per source status and the duration
+    """
+    started = time.monotonic()
+    if queryset is None:
+        queryset = TimeCapsule.objects.all()
+    now = now or timezone.now()
+    result = SweepResult()
+
+    for source, target in TRANSITIONS:
+        moved = 0
+        due = queryset.filter(status=source, unlock_date__lte=now).order_by()
+        while True:
+            with transaction.atomic():
+                pks = _claim_batch(due, batch_size)
+                if not pks:
+                    break
+                moved += TimeCapsule.objects.filter(
+                    pk__in=pks, status=source, unlock_date__lte=now
+                ).update(status=target)
+                if target == 'unlocked':
+                    add_unlocked(pks)
+            if len(pks) < batch_size:
+                break
+        result.moved[source] = moved
+
+    result.duration = time.monotonic() - started
+    return result
+
+
+@contextmanager
+def sweep_round(interval):
+    """
+    Run one round of a sweep loop.
+
+    A failure is logged rather than raised, so the loop retries on its next
+    round, and connections the round left stale or broken are closed.
+
+    Args:
+        interval: Seconds until the next round, for the log message
+    """
+    try:
+        yield
+    except Exception:
+        logger.exception("Unlock sweep failed; retrying in %s seconds", interval)
+    finally:
+        close_old_connections()
+
+
+class PeriodicSweeper(threading.Thread):
+    """Daemon thread that runs :func:`sweep_due_capsules` every ``interval`` seconds."""
+
+    def __init__(self, interval, batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__(name='capsule-unlock-sweeper', daemon=True)
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            with sweep_round(self.interval):
+                sweep_due_capsules(batch_size=self.batch_size)
+
+    def stop(self):
+        """Ask the loop to exit after the current sweep."""
+        self._stopped.set()
+
+
+_periodic_sweeper = None
+_periodic_lock = threading.Lock()
+
+
+def start_periodic_sweeper(interval, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Start the in-process sweeper loop once per process.
+
+    Args:
+        interval: Seconds between sweeps
+        batch_size: Maximum number of rows claimed per UPDATE
+
+    Returns:
+        PeriodicSweeper: The running sweeper thread
+    """
+    global _periodic_sweeper
+    with _periodic_lock:
+        if _periodic_sweeper is None or not _periodic_sweeper.is_alive():
+            _periodic_sweeper = PeriodicSweeper(interval, batch_size)
+            _periodic_sweeper.start()
+        return _periodic_sweeper
@@ -1,14 +1,107 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, RequestFactory, override_settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
 from django.utils import timezone
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from contextlib import ContextDecorator
 from datetime import timedelta
-from .models import TimeCapsule, CapsuleContent
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from unittest import mock
+from .derivatives import srcset
+from .export import ERRORS_NAME
+from .imports import ImportSourceError, run_import, start_import
+from .deletion import delete_pending_files, purge_deleted_capsules
+from .delivery import InvalidDeliveryToken, delivery_url, delivery_urls, make_token, read_token
+from .instrumentation import current_metrics, track_storage
+from .middleware import RequestMetricsMiddleware
+from .management.commands.benchmark_servers import percentile, run_load
+from .management.commands.benchmark_urls import seed
+from .fragments import fragment_key, fragment_timeout
+from .hashing import file_digest
+from .models import (
+    TimeCapsule, CapsuleContent, ContentBlob, ImportJob, PendingStorageDeletion,
+    PublicTimelineEntry, UploadSession,
+)
 from .forms import TimeCapsuleForm, CapsuleContentForm
+from .imaging import render_derivatives
+from .admin import INLINE_MAX_CONTENTS
+from . import async_views, views
+from . import search as search_module
+from .bulk import add_files, infer_title
+from .pagination import EstimatedCountPaginator, paginate_keyset
+from .pipeline import fail_stale_uploads, save_pending
+from .storage import CloudinaryContentStorage, ContentStorage, LocalContentStorage, get_content_storage
+from .sniffing import SNIFF_BYTES, sniff, sniff_file
+from .streaming import parse_range
+from .uploads import purge_stale_uploads, temp_path, write_chunk
+from .search import search, search_capsules
+from .sweeper import PeriodicSweeper, sweep_due_capsules
+from .timeline import feed_page
 
 User = get_user_model()
 
+# File heads recognised by capsules.sniffing
+JPEG_HEAD = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00'
+MP4_HEAD = b'\x00\x00\x00\x18ftypisom\x00\x00\x02\x00'
+PDF_HEAD = b'%PDF-1.7\n'
+
+
+class query_budget(ContextDecorator):
+    """Fail when a block or test runs more than ``max_queries`` queries.
+
+    Usable as a context manager or as a decorator on test methods::
+
+        with query_budget(4):
+            self.client.get(url)
+
+        @query_budget(4)
+        def test_detail_page(self):
+            ...
+    """
+
+    def __init__(self, max_queries, using='default'):
+        self.max_queries = max_queries
+        self.using = using
+
+    def __enter__(self):
+        self.context = CaptureQueriesContext(connections[self.using])
+        self.context.__enter__()
+        return self.context
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.context.__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return False
+        executed = len(self.context)
+        if executed > self.max_queries:
+            queries = '\n'.join(
+                f'{i}. {query["sql"]}'
+                for i, query in enumerate(self.context.captured_queries, start=1)
+            )
+            raise AssertionError(
+                f'{executed} queries executed, budget is {self.max_queries}\n{queries}'
+            )
+        return False
+
 class TimeCapsuleModelTests(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -176,3 +269,2531 @@ class CapsuleViewTests(TestCase):
             }
         )
         self.assertEqual(response.status_code, 302)  # Redirect after success
+
+class UnlockSweeperTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title='Due Capsule',
+            description='Test Description',
+            unlock_date=timezone.now() + timedelta(days=7),
+        )
+
+    def _make_due(self, status):
+        TimeCapsule.objects.filter(pk=self.capsule.pk).update(
+            status=status,
+            unlock_date=timezone.now() - timedelta(days=1)
+        )
+
+    def test_sweep_unlocks_due_locked_capsule(self):
+        """Test that a due locked capsule is unlocked by the sweeper"""
+        self._make_due('locked')
+        result = sweep_due_capsules()
+        self.capsule.refresh_from_db()
+        self.assertEqual(self.capsule.status, 'unlocked')
+        self.assertEqual(result.unlocked, 1)
+
+    def test_sweep_moves_due_active_capsule_to_unlocked(self):
+        """Test that a due active capsule ends the sweep unlocked"""
+        self._make_due('active')
+        result = sweep_due_capsules()
+        self.capsule.refresh_from_db()
+        self.assertEqual(self.capsule.status, 'unlocked')
+        self.assertEqual(result.moved, {'active': 1, 'locked': 1})
+
+    def test_sweep_ignores_capsules_not_yet_due(self):
+        """Test that capsules with a future unlock date are left alone"""
+        TimeCapsule.objects.filter(pk=self.capsule.pk).update(status='locked')
+        result = sweep_due_capsules()
+        self.capsule.refresh_from_db()
+        self.assertEqual(self.capsule.status, 'locked')
+        self.assertEqual(result.total, 0)
+
+    def test_sweep_is_idempotent(self):
+        """Test that a second sweep does not move the same capsule again"""
+        self._make_due('locked')
+        sweep_due_capsules()
+        self.assertEqual(sweep_due_capsules().total, 0)
+
+    def test_sweep_uses_set_based_updates(self):
+        """Test that the number of queries does not grow with the number of due capsules"""
+        for i in range(20):
+            TimeCapsule.objects.create(
+                creator=self.user,
+                title=f'Capsule {i}',
+                unlock_date=timezone.now() + timedelta(days=7),
+            )
+        TimeCapsule.objects.update(
+            status='locked',
+            unlock_date=timezone.now() - timedelta(days=1)
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            result = sweep_due_capsules()
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(result.unlocked, 21)
+
+    def test_management_command(self):
+        """Test the unlock_capsules management command reports its work"""
+        self._make_due('locked')
+        out = StringIO()
+        call_command('unlock_capsules', stdout=out)
+        self.assertIn('unlocked 1 capsules', out.getvalue())
+
+    def test_periodic_sweeper_logs_failures(self):
+        """Test that a failed periodic sweep is logged and the loop keeps going"""
+        failed = threading.Event()
+
+        def fail(**kwargs):
+            failed.set()
+            raise RuntimeError('database gone')
+
+        sweeper = PeriodicSweeper(interval=0.01)
+        with mock.patch('capsules.sweeper.sweep_due_capsules', side_effect=fail), \
+                self.assertLogs('capsules.sweeper', level='ERROR') as logs:
+            sweeper.start()
+            failed.wait(5)
+            sweeper.stop()
+            sweeper.join(5)
+        self.assertIn('Unlock sweep failed', logs.output[0])
+
+    def test_command_loop_survives_failed_rounds(self):
+        """Test that unlock_capsules --loop logs a failed round and keeps going"""
+        self._make_due('locked')
+
+        class Stop(Exception):
+            pass
+
+        sweeps = [RuntimeError('database gone'), None]
+
+        def sweep(**kwargs):
+            error = sweeps.pop(0)
+            if error:
+                raise error
+            return sweep_due_capsules(**kwargs)
+
+        out = StringIO()
+        with mock.patch('capsules.management.commands.unlock_capsules.sweep_due_capsules', side_effect=sweep), \
+                mock.patch('capsules.management.commands.unlock_capsules.time.sleep', side_effect=[None, Stop]), \
+                mock.patch('capsules.sweeper.close_old_connections') as close, \
+                self.assertLogs('capsules.sweeper', level='ERROR'):
+            with self.assertRaises(Stop):
+                call_command('unlock_capsules', '--loop', stdout=out)
+        self.assertIn('unlocked 1 capsules', out.getvalue())
+        self.assertEqual(close.call_count, 2)
+
+class EffectiveStatusTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title='Due Capsule',
+            description='Test Description',
+            unlock_date=timezone.now() + timedelta(days=7),
+        )
+        TimeCapsule.objects.filter(pk=self.capsule.pk).update(
+            status='locked',
+            unlock_date=timezone.now() - timedelta(days=1)
+        )
+        self.client.login(username='testuser', password='testpass123')
+
+    def test_queryset_annotates_due_capsule_as_unlocked(self):
+        """Test that a due locked capsule reads as unlocked without being saved"""
+        capsule = TimeCapsule.objects.with_effective_status().get(pk=self.capsule.pk)
+        self.assertEqual(capsule.status, 'locked')
+        self.assertEqual(capsule.effective_status, 'unlocked')
+        self.assertFalse(capsule.is_locked)
+
+    def test_property_falls_back_without_annotation(self):
+        """Test that effective_status is computed for unannotated instances"""
+        capsule = TimeCapsule.objects.get(pk=self.capsule.pk)
+        self.assertEqual(capsule.effective_status, 'unlocked')
+
+    def test_future_locked_capsule_stays_locked(self):
+        """Test that a locked capsule before its unlock date reads as locked"""
+        TimeCapsule.objects.filter(pk=self.capsule.pk).update(
+            unlock_date=timezone.now() + timedelta(days=1)
+        )
+        capsule = TimeCapsule.objects.with_effective_status().get(pk=self.capsule.pk)
+        self.assertEqual(capsule.effective_status, 'locked')
+        self.assertTrue(capsule.is_locked)
+
+    def _assert_read_only(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        writes = [
+            q['sql'] for q in ctx.captured_queries
+            if q['sql'].split(' ', 1)[0] in ('INSERT', 'UPDATE', 'DELETE')
+        ]
+        self.assertEqual(writes, [])
+        self.assertContains(response, 'Unlocked')
+
+    def test_capsule_list_does_not_write(self):
+        """Test that the list page shows due capsules as unlocked without writing"""
+        self._assert_read_only(reverse('capsules:capsule_list'))
+
+    def test_capsule_detail_does_not_write(self):
+        """Test that the detail page shows due capsules as unlocked without writing"""
+        self._assert_read_only(
+            reverse('capsules:capsule_detail', kwargs={'pk': self.capsule.pk})
+        )
+
+class QueryPlanTests(TestCase):
+    """Capture query plans for the hot capsule queries and fail on full table scans.
+
+    On PostgreSQL sequential scans are disabled for the session so that the
+    planner only falls back to one when no usable index exists; with the
+    tiny tables of a test database it would otherwise always prefer them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='planner', password='testpass123')
+        cls.capsule = TimeCapsule.objects.create(
+            creator=cls.user,
+            title='Plan Capsule',
+            unlock_date=timezone.now() + timedelta(days=7),
+        )
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest(f'No query plan checks for {connection.vendor}')
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, sorted_by_index=True):
+        """Fail if the plan for ``queryset`` scans a capsules table."""
+        plan = queryset.explain()
+        if connection.vendor == 'sqlite':
+            self.assertNotRegex(plan, r'(?m)SCAN capsules_\w+$', plan)
+            if sorted_by_index:
+                self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan, plan)
+        else:
+            self.assertNotIn('Seq Scan', plan, plan)
+            if sorted_by_index:
+                self.assertNotRegex(plan, r'(?m)^\s*(->\s*)?Sort\b', plan)
+        return plan
+
+    def test_capsule_list_query(self):
+        """Test that a user's capsules are read newest first from an index"""
+        self.assertUsesIndex(
+            TimeCapsule.objects
+            .filter(creator=self.user)
+            .with_effective_status()
+            .order_by('-created_at', '-pk')
+        )
+
+    def test_due_capsule_queries(self):
+        """Test that the unlock sweeper finds due capsules through an index"""
+        for status in TimeCapsule.DUE_STATUSES:
+            self.assertUsesIndex(
+                TimeCapsule.objects
+                .filter(status=status, unlock_date__lte=timezone.now())
+                .order_by()
+            )
+
+    def test_due_locked_capsules_query(self):
+        """Test that due locked capsules are read in unlock order from an index"""
+        self.assertUsesIndex(
+            TimeCapsule.objects
+            .filter(status='locked', unlock_date__lte=timezone.now())
+            .order_by('unlock_date')
+        )
+
+    def test_public_capsule_query(self):
+        """Test that public capsules are filtered through an index"""
+        self.assertUsesIndex(
+            TimeCapsule.objects.filter(is_public=True).order_by('unlock_date')
+        )
+
+    def test_capsule_contents_query(self):
+        """Test that a capsule's contents are read in upload order from an index"""
+        self.assertUsesIndex(CapsuleContent.objects.filter(capsule=self.capsule))
+
+class CapsuleListPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.client.login(username='testuser', password='testpass123')
+
+    def _create_capsules(self, count, contents_per_capsule=0):
+        for i in range(count):
+            capsule = TimeCapsule.objects.create(
+                creator=self.user,
+                title=f'Capsule {i}',
+                unlock_date=timezone.now() + timedelta(days=7),
+            )
+            CapsuleContent.objects.bulk_create([
+                CapsuleContent(
+                    capsule=capsule,
+                    title=f'Photo {j}',
+                    content_type='image',
+                    storage_backend='cloudinary',
+                    storage_key=f'image/upload/v1/capsule_contents/photo_{i}_{j}.jpg',
+                )
+                for j in range(contents_per_capsule)
+            ])
+
+    def test_keyset_pages_cover_all_capsules_once(self):
+        """Test that following next cursors visits every capsule exactly once"""
+        self._create_capsules(7)
+        seen, cursor = [], None
+        while True:
+            page = paginate_keyset(
+                TimeCapsule.objects.filter(creator=self.user), cursor, page_size=3
+            )
+            seen.extend(capsule.pk for capsule in page.items)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        expected = list(
+            TimeCapsule.objects.filter(creator=self.user)
+            .order_by('-created_at', '-pk').values_list('pk', flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+    def test_malformed_cursor_returns_first_page(self):
+        """Test that an invalid cursor is ignored rather than raising"""
+        self._create_capsules(2)
+        page = paginate_keyset(TimeCapsule.objects.all(), 'not-a-cursor!')
+        self.assertEqual(len(page.items), 2)
+
+    def test_card_data_annotations(self):
+        """Test that content count and cover image are annotated per capsule"""
+        self._create_capsules(1, contents_per_capsule=3)
+        capsule = TimeCapsule.objects.with_card_data().get()
+        self.assertEqual(capsule.content_count, 3)
+        self.assertIn('photo_0_0', capsule.cover_file)
+
+    def test_list_query_count_is_constant(self):
+        """Test that the list page does not issue one query per capsule"""
+        url = reverse('capsules:capsule_list')
+        self._create_capsules(2, contents_per_capsule=2)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url)
+        self._create_capsules(10, contents_per_capsule=2)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+        self.assertEqual(len(small), len(large))
+        self.assertContains(response, '2 items')
+
+    def test_fragment_response(self):
+        """Test that fragment requests return only cards and the next sentinel"""
+        self._create_capsules(30)
+        response = self.client.get(reverse('capsules:capsule_list'), {'fragment': 1})
+        self.assertTemplateUsed(response, 'capsules/_capsule_cards.html')
+        self.assertTemplateNotUsed(response, 'capsules/capsule_list.html')
+        self.assertContains(response, 'data-next-url')
+
+class CapsuleDetailQueryBudgetTests(TestCase):
+    # Session, user, capsule with creator, contents
+    DETAIL_QUERY_BUDGET = 4
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title='Budget Capsule',
+            unlock_date=timezone.now() + timedelta(days=7),
+        )
+        self.client.login(username='testuser', password='testpass123')
+        self.url = reverse('capsules:capsule_detail', kwargs={'pk': self.capsule.pk})
+
+    def _add_contents(self, count):
+        CapsuleContent.objects.bulk_create([
+            CapsuleContent(
+                capsule=self.capsule,
+                title=f'Item {i}',
+                content_type=('image', 'video', 'document')[i % 3],
+                storage_backend='cloudinary',
+                storage_key=f'image/upload/v1/capsule_contents/item_{i}.jpg',
+            )
+            for i in range(count)
+        ])
+
+    def test_detail_stays_within_budget(self):
+        """Test that the detail page query count does not grow with its contents"""
+        for count in (1, 12):
+            self._add_contents(count)
+            with query_budget(self.DETAIL_QUERY_BUDGET):
+                response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, '/files/')
+
+    def test_locked_capsule_does_not_render_file_urls(self):
+        """Test that file URLs are not built for locked contents"""
+        self._add_contents(2)
+        TimeCapsule.objects.filter(pk=self.capsule.pk).update(status='locked')
+        with query_budget(self.DETAIL_QUERY_BUDGET):
+            response = self.client.get(self.url)
+        self.assertNotContains(response, '/files/')
+        self.assertContains(response, 'Content locked until')
+
+    def test_query_budget_reports_overrun(self):
+        """Test that the budget helper fails when exceeded"""
+        with self.assertRaises(AssertionError):
+            with query_budget(0):
+                TimeCapsule.objects.count()
+
+class RequestMetricsMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.client.login(username='testuser', password='testpass123')
+
+    def test_logs_one_line_per_request(self):
+        """Test that each request emits a single structured metrics line"""
+        with self.assertLogs('capsules.requests', level='INFO') as logs:
+            self.client.get(reverse('capsules:capsule_list'))
+        self.assertEqual(len(logs.records), 1)
+        metrics = logs.records[0].request_metrics
+        self.assertEqual(metrics['path'], reverse('capsules:capsule_list'))
+        self.assertEqual(metrics['status'], 200)
+        self.assertGreater(metrics['db_queries'], 0)
+        self.assertIn('wall_ms=', logs.output[0])
+
+    def test_async_chain_stays_async(self):
+        """Test that the middleware awaits an async handler without a thread hop"""
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = RequestMetricsMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with self.assertLogs('capsules.requests', level='INFO') as logs:
+            response = async_to_sync(middleware)(RequestFactory().get('/async/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(logs.records[0].request_metrics['path'], '/async/')
+
+    def test_counts_queries_run_on_other_threads(self):
+        """Test that queries the async ORM runs off the request thread are counted"""
+        def count_in_thread():
+            try:
+                return TimeCapsule.objects.count()
+            finally:
+                connection.close()
+
+        async def get_response(request):
+            await sync_to_async(count_in_thread, thread_sensitive=False)()
+            await TimeCapsule.objects.acount()
+            return HttpResponse()
+
+        with self.assertLogs('capsules.requests', level='INFO') as logs:
+            async_to_sync(RequestMetricsMiddleware(get_response))(RequestFactory().get('/'))
+        self.assertEqual(logs.records[0].request_metrics['db_queries'], 2)
+
+    def test_track_storage_outside_request_is_noop(self):
+        """Test that storage tracking works without an active request"""
+        with track_storage():
+            pass
+        self.assertIsNone(current_metrics())
+
+class CapsuleAdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username='admin',
+            email='admin@example.com',
+            password='adminpass123'
+        )
+        self.client.login(username='admin', password='adminpass123')
+
+    def _create_capsules(self, count, contents_per_capsule=2):
+        for i in range(count):
+            capsule = TimeCapsule.objects.create(
+                creator=self.admin,
+                title=f'Capsule {i}',
+                unlock_date=timezone.now() + timedelta(days=7),
+            )
+            CapsuleContent.objects.bulk_create([
+                CapsuleContent(
+                    capsule=capsule,
+                    title=f'Item {j}',
+                    content_type='image',
+                    storage_backend='cloudinary',
+                    storage_key=f'image/upload/v1/capsule_contents/item_{i}_{j}.jpg',
+                )
+                for j in range(contents_per_capsule)
+            ])
+
+    def _assert_constant_queries(self, url):
+        self._create_capsules(2)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url)
+        self._create_capsules(10)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(small), len(large))
+        return response
+
+    def test_capsule_changelist_query_count_is_constant(self):
+        """Test that content counts are annotated rather than counted per row"""
+        response = self._assert_constant_queries(
+            reverse('admin:capsules_timecapsule_changelist')
+        )
+        self.assertContains(response, '<td class="field-content_count">2</td>', html=True)
+
+    def test_content_changelist_query_count_is_constant(self):
+        """Test that capsules are joined and file URLs are not built per row"""
+        response = self._assert_constant_queries(
+            reverse('admin:capsules_capsulecontent_changelist')
+        )
+        self.assertNotContains(response, 'res.cloudinary.com')
+
+    def test_large_capsule_has_no_inline(self):
+        """Test that capsules with many contents link to the changelist instead"""
+        self._create_capsules(1, contents_per_capsule=INLINE_MAX_CONTENTS + 1)
+        capsule = TimeCapsule.objects.get()
+        response = self.client.get(
+            reverse('admin:capsules_timecapsule_change', args=[capsule.pk])
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['inline_admin_formsets'], [])
+        self.assertContains(response, f'?capsule__id__exact={capsule.pk}')
+
+    def test_small_capsule_keeps_inline(self):
+        """Test that small capsules are still edited inline"""
+        self._create_capsules(1)
+        capsule = TimeCapsule.objects.get()
+        response = self.client.get(
+            reverse('admin:capsules_timecapsule_change', args=[capsule.pk])
+        )
+        self.assertEqual(len(response.context['inline_admin_formsets']), 1)
+
+    def test_admin_deletes_go_through_delete_capsule(self):
+        """Test that the delete view and the bulk action only mark capsules deleted"""
+        self._create_capsules(3)
+        first, *rest = TimeCapsule.objects.order_by('pk')
+        self.client.post(
+            reverse('admin:capsules_timecapsule_delete', args=[first.pk]), {'post': 'yes'}
+        )
+        self.client.post(reverse('admin:capsules_timecapsule_changelist'), {
+            'action': 'delete_selected',
+            '_selected_action': [capsule.pk for capsule in rest],
+            'post': 'yes',
+        })
+        self.assertFalse(TimeCapsule.objects.exists())
+        self.assertEqual(TimeCapsule.all_objects.filter(deleted_at__isnull=False).count(), 3)
+        # Rows and files are left to the purge
+        self.assertEqual(CapsuleContent.objects.count(), 6)
+
+    def test_staff_read_private_files_only_through_the_admin_with_permission(self):
+        """Test that staff get no extra file access outside the admin file view"""
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        capsule = TimeCapsule.objects.create(
+            creator=owner, title='Private', unlock_date=timezone.now() - timedelta(days=1)
+        )
+        TimeCapsule.objects.filter(pk=capsule.pk).update(status='unlocked')
+        content = CapsuleContent.objects.create(
+            capsule=capsule, title='Letter', content_type='document',
+            storage_backend='cloudinary', storage_key='raw/upload/v1/letter.pdf',
+        )
+        admin_file = reverse('admin:capsules_capsulecontent_file', args=[content.pk])
+        staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        self.client.login(username='staff', password='testpass123')
+        self.assertEqual(self.client.get(content.get_file_url()).status_code, 403)
+        self.assertEqual(self.client.get(reverse('capsules:capsule_export', args=[capsule.pk])).status_code, 403)
+        self.assertEqual(self.client.get(admin_file).status_code, 403)
+
+        staff.user_permissions.add(Permission.objects.get(codename='view_capsulecontent'))
+        response = self.client.get(admin_file)
+        self.assertRedirects(
+            response, delivery_url(content.storage_ref), fetch_redirect_response=False
+        )
+        self.assertEqual(self.client.get(content.get_file_url()).status_code, 403)
+
+    def test_estimated_paginator_counts_exactly_on_small_tables(self):
+        """Test that the paginator falls back to an exact count"""
+        self._create_capsules(3)
+        paginator = EstimatedCountPaginator(TimeCapsule.objects.order_by('pk'), 2)
+        self.assertEqual(paginator.count, 3)
+
+    def test_estimated_paginator_ignores_the_default_manager_filter(self):
+        """Test that hiding deleted capsules does not force an exact count"""
+        cursor = mock.MagicMock()
+        cursor.__enter__.return_value.fetchone.return_value = (500000,)
+        with mock.patch.object(connection, 'vendor', 'postgresql'), \
+                mock.patch.object(connection, 'cursor', return_value=cursor):
+            estimated = EstimatedCountPaginator(TimeCapsule.objects.with_content_count(), 2)
+            filtered = EstimatedCountPaginator(TimeCapsule.objects.filter(status='locked'), 2)
+            self.assertEqual(estimated._estimated_count(), 500000)
+            self.assertIsNone(filtered._estimated_count())
+
+    def test_delete_confirmation_does_not_collect_contents(self):
+        """Test that the delete page counts contents instead of loading them"""
+        def confirmation_queries(contents):
+            self._create_capsules(1, contents_per_capsule=contents)
+            capsule = TimeCapsule.objects.latest('pk')
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse('admin:capsules_timecapsule_delete', args=[capsule.pk]))
+            self.assertContains(response, f'<li>Capsule contents: {contents}</li>', html=True)
+            return len(ctx)
+
+        self.assertEqual(confirmation_queries(2), confirmation_queries(20))
+
+class SignedDeliveryTests(TestCase):
+    KEY = 'image/upload/v1/capsule_contents/photo.jpg'
+    REF = 'cloudinary:' + KEY
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title='Delivery Capsule',
+            unlock_date=timezone.now() + timedelta(days=7),
+        )
+        self.content = CapsuleContent.objects.create(
+            capsule=self.capsule,
+            title='Photo',
+            content_type='image',
+            storage_backend='cloudinary',
+            storage_key=self.KEY,
+        )
+
+    def test_token_round_trip(self):
+        """Test that a signed token yields its storage key"""
+        token = make_token(self.REF, time.time() + 60)
+        self.assertEqual(read_token(token)[0], self.REF)
+
+    def test_tampered_and_expired_tokens_are_rejected(self):
+        """Test that forged or expired tokens are refused"""
+        token = make_token(self.REF, time.time() + 60)
+        with self.assertRaises(InvalidDeliveryToken):
+            read_token(token[:-2] + 'xx')
+        with self.assertRaises(InvalidDeliveryToken):
+            read_token(make_token(self.REF, time.time() - 1))
+
+    def test_delivery_needs_no_database(self):
+        """Test that serving a signed URL runs no queries"""
+        url = delivery_url(self.REF)
+        # Building the storage URL itself needs Cloudinary credentials
+        storage_url = 'https://cdn.example.com/' + self.KEY
+        with mock.patch.object(CloudinaryContentStorage, 'url', return_value=storage_url):
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], storage_url)
+
+    def test_invalid_token_is_not_found(self):
+        """Test that an invalid token returns 404"""
+        response = self.client.get(reverse('capsules:deliver_file', args=['bogus']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_urls_are_batched_and_cached(self):
+        """Test that URLs are reused from the cache until close to expiry"""
+        first = delivery_urls([self.REF, 'cloudinary:image/upload/v1/other.jpg'])
+        self.assertEqual(len(first), 2)
+        self.assertEqual(delivery_urls([self.REF])[self.REF], first[self.REF])
+
+    def test_detail_page_hides_storage_urls(self):
+        """Test that the detail page links signed URLs, not storage URLs"""
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(
+            reverse('capsules:capsule_detail', kwargs={'pk': self.capsule.pk})
+        )
+        self.assertContains(response, delivery_url(self.REF))
+        self.assertNotContains(response, 'res.cloudinary.com')
+
+    def test_protected_file_redirects_to_signed_url(self):
+        """Test that the permission-checked view hands out a signed URL"""
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(self.content.get_file_url())
+        self.assertRedirects(response, delivery_url(self.REF), fetch_redirect_response=False)
+
+
+class LocalStorageStreamingTests(TestCase):
+    DATA = bytes(range(256)) * 40
+
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        overrides = override_settings(
+            CAPSULES_DEFAULT_STORAGE='local',
+            CAPSULES_LOCAL_STORAGE_ROOT=tmp.name,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title='Local Capsule',
+            unlock_date=timezone.now() + timedelta(days=7),
+        )
+        self.content = CapsuleContent.objects.create(
+            capsule=self.capsule,
+            title='Clip',
+            content_type='video',
+            file=SimpleUploadedFile('clip.mp4', self.DATA, content_type='video/mp4'),
+        )
+        self.url = delivery_url(self.content.storage_ref)
+
+    def test_upload_is_written_to_local_storage(self):
+        """Test that saving an uploaded file stores it in the default backend"""
+        self.assertEqual(self.content.storage_backend, 'local')
+        path = get_content_storage('local').path(self.content.storage_key)
+        with open(path, 'rb') as stored:
+            self.assertEqual(stored.read(), self.DATA)
+        self.assertFalse(os.path.exists(path + '.part'))
+
+    def test_full_file_is_streamed(self):
+        """Test that the delivery view streams the whole file with validators"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.DATA)
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        self.assertTrue(response['Cache-Control'].startswith('private'))
+
+    def test_byte_range(self):
+        """Test that a Range request returns only the requested bytes"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.DATA)}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(b''.join(response.streaming_content), self.DATA[100:200])
+
+    def test_suffix_range(self):
+        """Test that a suffix range returns the end of the file"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.DATA[-10:])
+
+    def test_unsatisfiable_range(self):
+        """Test that a range past the end of the file returns 416"""
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.DATA)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.DATA)}')
+
+    def test_conditional_get(self):
+        """Test that a matching If-None-Match returns 304"""
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_stale_if_range_returns_full_file(self):
+        """Test that a Range with a stale If-Range is served in full"""
+        response = self.client.get(
+            self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_file_is_not_found(self):
+        """Test that a token for a deleted file returns 404"""
+        get_content_storage('local').delete(self.content.storage_key)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_parse_range(self):
+        """Test Range header parsing edge cases"""
+        self.assertEqual(parse_range('bytes=0-', 10), (0, 9))
+        self.assertEqual(parse_range('bytes=5-100', 10), (5, 9))
+        self.assertEqual(parse_range('bytes=-20', 10), (0, 9))
+        self.assertIs(parse_range('bytes=10-', 10), False)
+        self.assertIsNone(parse_range('bytes=0-1,4-5', 10))
+        self.assertIsNone(parse_range('items=0-1', 10))
+
+
+class ChunkedUploadTests(TestCase):
+    DATA = b'0123456789abcdef' * 160
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        overrides = override_settings(
+            CAPSULES_DEFAULT_STORAGE='local',
+            CAPSULES_LOCAL_STORAGE_ROOT=os.path.join(tmp.name, 'storage'),
+            CAPSULES_UPLOAD_TEMP_DIR=os.path.join(tmp.name, 'uploads'),
+            CAPSULES_UPLOAD_CHUNK_SIZE=1000,
+            CAPSULES_SPOOL_DIR=os.path.join(tmp.name, 'spool'),
+            CAPSULES_UPLOAD_WORKERS=0,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title='Upload Capsule',
+            unlock_date=timezone.now() + timedelta(days=7),
+        )
+        self.client.login(username='testuser', password='testpass123')
+
+    def _start(self, size=None):
+        response = self.client.post(
+            reverse('capsules:upload_start', kwargs={'pk': self.capsule.pk}),
+            {'filename': 'notes.txt', 'size': size or len(self.DATA), 'mime_type': 'text/plain'},
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def _put(self, session, offset, data):
+        return self.client.put(
+            f"{session['upload_url']}?offset={offset}",
+            data=data,
+            content_type='application/octet-stream',
+        )
+
+    def test_chunks_are_assembled_into_content(self):
+        """Test that a complete upload becomes a stored CapsuleContent"""
+        session = self._start()
+        self.assertEqual(session['chunk_size'], 1000)
+        for offset in range(0, len(self.DATA), 1000):
+            response = self._put(session, offset, self.DATA[offset:offset + 1000])
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['offset'], len(self.DATA))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(session['complete_url'], {
+                'title': 'Notes',
+                'description': 'Large notes',
+                'content_type': 'document',
+            })
+        self.assertEqual(response.status_code, 201)
+        content = CapsuleContent.objects.get(pk=response.json()['content_id'])
+        self.assertEqual(content.upload_status, 'ready')
+        self.assertEqual(content.capsule, self.capsule)
+        with open(get_content_storage('local').path(content.storage_key), 'rb') as stored:
+            self.assertEqual(stored.read(), self.DATA)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_interrupted_upload_resumes_from_acknowledged_offset(self):
+        """Test that the server reports where to resume and rejects gaps"""
+        session = self._start()
+        self._put(session, 0, self.DATA[:1000])
+        # A short chunk is acknowledged for exactly the bytes it carried
+        response = self._put(session, 1000, self.DATA[1000:1500])
+        self.assertEqual(response.json()['offset'], 1500)
+        response = self._put(session, 3000, self.DATA[3000:4000])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 1500)
+
+        state = self.client.get(session['upload_url']).json()
+        self.assertEqual(state['offset'], 1500)
+
+    def test_lost_partial_file_restarts_the_upload(self):
+        """Test that a partial file gone after a restart sends the client back to 0"""
+        session = self._start()
+        self._put(session, 0, self.DATA[:1000])
+        os.remove(temp_path(UploadSession.objects.get(pk=session['upload_id'])))
+        response = self._put(session, 1000, self.DATA[1000:2000])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 0)
+        self.assertEqual(self.client.get(session['upload_url']).json()['offset'], 0)
+        response = self._put(session, 0, self.DATA[:1000])
+        self.assertEqual(response.json()['offset'], 1000)
+
+    def test_chunk_is_read_before_the_row_is_locked(self):
+        """Test that a slow client is read without the session lock held"""
+        upload = UploadSession.objects.get(pk=self._start()['upload_id'])
+        depth = len(connection.savepoint_ids)
+        depths = []
+
+        class SlowStream(io.BytesIO):
+            def read(self, size=-1):
+                depths.append(len(connection.savepoint_ids))
+                return super().read(size)
+
+        self.assertEqual(write_chunk(upload, 0, SlowStream(self.DATA[:1000]), 1000), 1000)
+        self.assertEqual(set(depths), {depth})
+
+    def test_unsupported_file_is_refused_on_first_chunk(self):
+        """Test that the first chunk is sniffed before the rest is accepted"""
+        session = self._start()
+        response = self._put(session, 0, b'MZ\x90\x00' + self.DATA[4:1000])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['offset'], 0)
+
+    def test_oversized_chunk_is_rejected(self):
+        """Test that a chunk larger than the session's chunk size is refused"""
+        session = self._start()
+        response = self._put(session, 0, self.DATA[:1001])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['offset'], 0)
+
+    def test_incomplete_upload_cannot_be_completed(self):
+        """Test that completing before all bytes arrived fails"""
+        session = self._start()
+        self._put(session, 0, self.DATA[:1000])
+        response = self.client.post(session['complete_url'], {
+            'title': 'Notes', 'description': 'Notes', 'content_type': 'document',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CapsuleContent.objects.exists())
+
+    @override_settings(CAPSULES_MAX_UPLOAD_SIZE=100)
+    def test_upload_size_limit(self):
+        """Test that files over CAPSULES_MAX_UPLOAD_SIZE are refused"""
+        response = self.client.post(
+            reverse('capsules:upload_start', kwargs={'pk': self.capsule.pk}),
+            {'filename': 'big.mp4', 'size': 101, 'mime_type': 'video/mp4'},
+        )
+        self.assertEqual(response.status_code, 400)
+        form = CapsuleContentForm(
+            data={'title': 'Big', 'description': 'Big', 'content_type': 'video'},
+            files={'file': SimpleUploadedFile('big.mp4', b'x' * 101, content_type='video/mp4')},
+        )
+        self.assertFalse(form.is_valid())
+
+    def test_sessions_are_private(self):
+        """Test that another user cannot see or extend an upload"""
+        session = self._start()
+        User.objects.create_user(username='other', password='testpass123')
+        self.client.login(username='other', password='testpass123')
+        self.assertEqual(self.client.get(session['upload_url']).status_code, 404)
+        self.assertEqual(self._put(session, 0, self.DATA[:1000]).status_code, 404)
+
+    def test_stale_sessions_are_purged(self):
+        """Test that idle sessions and their partial files are discarded"""
+        session = UploadSession.objects.get(pk=self._start()['upload_id'])
+        path = temp_path(session)
+        self.assertEqual(purge_stale_uploads(), 0)
+        self.assertEqual(purge_stale_uploads(now=timezone.now() + timedelta(days=2)), 1)
+        self.assertFalse(os.path.exists(path))
+
+
+class FailingStorage(ContentStorage):
+    """Storage backend whose uploads always fail, counting the attempts."""
+    name = 'failing'
+    attempts = 0
+
+    def save(self, name, fileobj, resource_type='auto'):
+        FailingStorage.attempts += 1
+        raise ConnectionError('storage unavailable')
+
+
+class UploadPipelineTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        overrides = override_settings(
+            CAPSULES_DEFAULT_STORAGE='local',
+            CAPSULES_LOCAL_STORAGE_ROOT=os.path.join(tmp.name, 'storage'),
+            CAPSULES_SPOOL_DIR=os.path.join(tmp.name, 'spool'),
+            CAPSULES_UPLOAD_WORKERS=0,
+            CAPSULES_UPLOAD_RETRY_DELAY=0,
+            CAPSULES_DERIVATIVE_WORKERS=0,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.spool = os.path.join(tmp.name, 'spool')
+
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title='Pipeline Capsule',
+            unlock_date=timezone.now() + timedelta(days=7),
+        )
+
+    def _content(self):
+        return CapsuleContent(
+            capsule=self.capsule,
+            title='Photo',
+            description='A photo',
+            content_type='image',
+        )
+
+    def _upload(self):
+        return SimpleUploadedFile('photo.jpg', JPEG_HEAD + b'jpeg bytes', content_type='image/jpeg')
+
+    def test_content_is_pending_until_upload_runs(self):
+        """Test that the row is saved pending and becomes ready after commit"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            content = self._content()
+            save_pending(content, self._upload())
+            content.refresh_from_db()
+            self.assertEqual(content.upload_status, 'pending')
+            self.assertEqual(content.storage_key, '')
+
+        for callback in callbacks:
+            callback()
+        content.refresh_from_db()
+        self.assertEqual(content.upload_status, 'ready')
+        self.assertEqual(content.storage_backend, 'local')
+        with open(get_content_storage('local').path(content.storage_key), 'rb') as stored:
+            self.assertEqual(stored.read(), JPEG_HEAD + b'jpeg bytes')
+        self.assertEqual(os.listdir(self.spool), [])
+
+    def test_failed_upload_is_retried_then_marked_failed(self):
+        """Test that uploads are retried and failures are recorded"""
+        FailingStorage.attempts = 0
+        backends = {'local': 'capsules.storage.LocalContentStorage',
+                    'failing': 'capsules.tests.FailingStorage'}
+        with override_settings(CAPSULES_STORAGE_BACKENDS=backends,
+                               CAPSULES_DEFAULT_STORAGE='failing',
+                               CAPSULES_UPLOAD_RETRIES=3):
+            with self.captureOnCommitCallbacks(execute=True):
+                content = self._content()
+                save_pending(content, self._upload())
+        content.refresh_from_db()
+        self.assertEqual(FailingStorage.attempts, 3)
+        self.assertEqual(content.upload_status, 'failed')
+        self.assertIn('storage unavailable', content.upload_error)
+        self.assertEqual(os.listdir(self.spool), [])
+
+    def test_detail_shows_placeholder_for_pending_content(self):
+        """Test that pending items render a placeholder instead of a file"""
+        with self.captureOnCommitCallbacks():
+            save_pending(self._content(), self._upload())
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(
+            reverse('capsules:capsule_detail', kwargs={'pk': self.capsule.pk})
+        )
+        self.assertContains(response, 'upload-placeholder')
+        self.assertNotContains(response, '/files/')
+
+    def test_uploads_lost_to_a_restart_are_marked_failed(self):
+        """Test that uploads whose job never ran are failed once stale"""
+        content = self._content()
+        # The process queuing the upload dies before the transaction's hooks run
+        save_pending(content, self._upload())
+        self.assertEqual(fail_stale_uploads(), 0)
+        out = StringIO()
+        with mock.patch('capsules.pipeline.timezone.now', return_value=timezone.now() + timedelta(hours=2)):
+            call_command('purge_uploads', stdout=out)
+        self.assertIn('marked 1 interrupted uploads failed', out.getvalue())
+        content.refresh_from_db()
+        self.assertEqual(content.upload_status, 'failed')
+        self.assertIn('upload the file again', content.upload_error)
+
+    def test_content_add_returns_before_upload(self):
+        """Test that content_add responds with the upload still queued"""
+        self.client.login(username='testuser', password='testpass123')
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                reverse('capsules:content_add', kwargs={'pk': self.capsule.pk}),
+                {
+                    'title': 'Photo',
+                    'description': 'A photo',
+                    'content_type': 'image',
+                    'file': self._upload(),
+                },
+            )
+        self.assertEqual(response.status_code, 302)
+        # The other callback re-indexes the capsule for search
+        uploads = [callback for callback in callbacks if callback.__module__ == 'capsules.pipeline']
+        self.assertEqual(len(uploads), 1)
+        self.assertEqual(self.capsule.contents.get().upload_status, 'pending')
+
+
+class FlakyStorage(LocalContentStorage):
+    """Local storage that fails for files named 'bad*' and tracks concurrency."""
+    name = 'flaky'
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+
+    def save(self, name, fileobj, resource_type='auto'):
+        with self.lock:
+            FlakyStorage.active += 1
+            FlakyStorage.peak = max(FlakyStorage.peak, FlakyStorage.active)
+        try:
+            time.sleep(0.02)
+            if name.startswith('bad'):
+                raise ConnectionError('storage unavailable')
+            return super().save(name, fileobj, resource_type)
+        finally:
+            with self.lock:
+                FlakyStorage.active -= 1
+
+
+class ContentBulkAddTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        overrides = override_settings(
+            CAPSULES_STORAGE_BACKENDS={'flaky': 'capsules.tests.FlakyStorage'},
+            CAPSULES_DEFAULT_STORAGE='flaky',
+            CAPSULES_LOCAL_STORAGE_ROOT=tmp.name,
+            CAPSULES_BULK_UPLOAD_CONCURRENCY=2,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        FlakyStorage.peak = 0
+
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title='Bulk Capsule',
+            unlock_date=timezone.now() + timedelta(days=7),
+        )
+        self.client.login(username='testuser', password='testpass123')
+        self.url = reverse('capsules:content_add_many', kwargs={'pk': self.capsule.pk})
+
+    def _files(self):
+        return [
+            SimpleUploadedFile(f'beach_day-{i}.jpg', JPEG_HEAD, content_type='image/jpeg')
+            for i in range(4)
+        ] + [
+            # The browser's MIME type is ignored in favour of the magic bytes
+            SimpleUploadedFile('clip.mp4', MP4_HEAD, content_type='application/octet-stream'),
+            SimpleUploadedFile('song.mp3', b'ID3\x04\x00', content_type='audio/mpeg'),
+            SimpleUploadedFile('bad.pdf', PDF_HEAD, content_type='application/pdf'),
+        ]
+
+    def test_files_are_added_with_per_file_results(self):
+        """Test that valid files are added and failures are reported per file"""
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                self.url, {'files': self._files()}, HTTP_ACCEPT='application/json'
+            )
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['added'], 5)
+        statuses = {r['name']: r['status'] for r in data['results']}
+        self.assertEqual(statuses['song.mp3'], 'error')
+        self.assertEqual(statuses['bad.pdf'], 'error')
+        self.assertEqual(statuses['clip.mp4'], 'created')
+
+        contents = {c.title: c for c in self.capsule.contents.all()}
+        self.assertEqual(contents['Clip'].content_type, 'video')
+        self.assertEqual(contents['Beach day 0'].content_type, 'image')
+        self.assertTrue(all(c.storage_key for c in contents.values()))
+        inserts = [q for q in ctx.captured_queries
+                   if q['sql'].startswith('INSERT INTO "capsules_capsulecontent"')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_duplicate_files_share_one_blob(self):
+        """Test that identical files in a batch are uploaded once"""
+        self.client.post(self.url, {'files': self._files()}, HTTP_ACCEPT='application/json')
+        blob = ContentBlob.objects.get(digest=hashlib.sha256(JPEG_HEAD).hexdigest())
+        self.assertEqual(blob.ref_count, 4)
+        self.assertEqual(
+            set(self.capsule.contents.filter(content_type='image').values_list('storage_key', flat=True)),
+            {blob.storage_key},
+        )
+        self.assertEqual(ContentBlob.objects.count(), 2)
+
+    def test_uploads_respect_concurrency_limit(self):
+        """Test that no more than the configured uploads run at once"""
+        self.client.post(self.url, {'files': self._files()}, HTTP_ACCEPT='application/json')
+        self.assertGreater(FlakyStorage.peak, 1)
+        self.assertLessEqual(FlakyStorage.peak, 2)
+
+    def test_form_mode_redirects_with_messages(self):
+        """Test that a plain form post redirects back to the capsule"""
+        response = self.client.post(self.url, {'files': self._files()[:2]})
+        self.assertRedirects(
+            response, reverse('capsules:capsule_detail', kwargs={'pk': self.capsule.pk})
+        )
+        self.assertEqual(self.capsule.contents.count(), 2)
+
+    def test_infer_title(self):
+        """Test that titles are derived from file names"""
+        self.assertEqual(infer_title('IMG_2024-summer.JPG'), 'IMG 2024 summer')
+        self.assertEqual(infer_title('.jpg'), '.jpg')
+        self.assertEqual(infer_title('a' * 300 + '.png'), 'A' + 'a' * 199)
+
+
+class ContentSniffingTests(TestCase):
+    def test_detects_types_from_magic_bytes(self):
+        """Test that common formats map to content and resource types"""
+        cases = {
+            JPEG_HEAD: ('image/jpeg', 'image', 'image'),
+            b'\x89PNG\r\n\x1a\n\x00': ('image/png', 'image', 'image'),
+            b'RIFF\x00\x00\x00\x00WEBPVP8 ': ('image/webp', 'image', 'image'),
+            b'\x00\x00\x00\x18ftypheic': ('image/heic', 'image', 'image'),
+            MP4_HEAD: ('video/mp4', 'video', 'video'),
+            b'\x00\x00\x00\x14ftypqt  ': ('video/quicktime', 'video', 'video'),
+            b'\x1a\x45\xdf\xa3\x9f\x42\x82\x84webm': ('video/webm', 'video', 'video'),
+            PDF_HEAD: ('application/pdf', 'document', 'raw'),
+            'Liebe Grüße\n'.encode(): ('text/plain', 'document', 'raw'),
+        }
+        for head, expected in cases.items():
+            result = sniff(head)
+            self.assertEqual(
+                (result.mime_type, result.content_type, result.resource_type), expected
+            )
+
+    def test_unsupported_files(self):
+        """Test that executables, audio and unknown binaries are refused"""
+        for head in (b'MZ\x90\x00', b'\x7fELF\x02', b'ID3\x04\x00', bytes(range(32))):
+            self.assertFalse(sniff(head).is_supported, head)
+
+    def test_text_cut_inside_multibyte_character(self):
+        """Test that a head ending mid-character is still text"""
+        head = ('x' * (SNIFF_BYTES - 1) + 'é').encode()[:SNIFF_BYTES]
+        self.assertEqual(sniff(head).mime_type, 'text/plain')
+
+    def test_sniff_file_keeps_position(self):
+        """Test that sniffing an upload leaves it ready to be read"""
+        upload = SimpleUploadedFile('photo.jpg', JPEG_HEAD + b'rest')
+        self.assertEqual(sniff_file(upload).content_type, 'image')
+        self.assertEqual(upload.read(), JPEG_HEAD + b'rest')
+
+    def test_form_rejects_mislabelled_file(self):
+        """Test that the form checks the real type, not the declared one"""
+        form = CapsuleContentForm(
+            data={'title': 'Photo', 'description': 'Photo', 'content_type': 'image'},
+            files={'file': SimpleUploadedFile('photo.jpg', b'MZ\x90\x00', content_type='image/jpeg')},
+        )
+        self.assertFalse(form.is_valid())
+        form = CapsuleContentForm(
+            data={'title': 'Clip', 'description': 'Clip', 'content_type': 'video'},
+            files={'file': SimpleUploadedFile('clip.bin', MP4_HEAD, content_type='application/octet-stream')},
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.sniffed.mime_type, 'video/mp4')
+
+    def test_benchmark_command(self):
+        """Test that the benchmark runs over the built-in corpus"""
+        out = StringIO()
+        call_command('benchmark_sniffer', '--iterations', '3', '--json', stdout=out)
+        report = json.loads(out.getvalue())
+        by_file = {row['file']: row for row in report['results']}
+        self.assertEqual(by_file['clip.mp4']['content_type'], 'video')
+        self.assertIsNone(by_file['setup.exe']['content_type'])
+
+
+def _image_file(name='photo.png', size=(2400, 1600), mode='RGBA'):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new(mode, size, (200, 120, 40, 255) if mode == 'RGBA' else (200, 120, 40)).save(
+        buffer, format='PNG'
+    )
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(
+    CAPSULES_DEFAULT_STORAGE='local',
+    CAPSULES_UPLOAD_WORKERS=0,
+    CAPSULES_DERIVATIVE_WORKERS=0,
+    CAPSULES_IMAGE_SIZES={'thumb': 320, 'medium': 960, 'large': 1920},
+)
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        overrides = override_settings(
+            CAPSULES_LOCAL_STORAGE_ROOT=os.path.join(tmp.name, 'storage'),
+            CAPSULES_SPOOL_DIR=os.path.join(tmp.name, 'spool'),
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title='Photo Capsule',
+            unlock_date=timezone.now() + timedelta(days=7),
+        )
+
+    def _add_image(self, upload):
+        content = CapsuleContent(capsule=self.capsule, title='Photo', content_type='image')
+        with self.captureOnCommitCallbacks(execute=True):
+            save_pending(content, upload)
+        content.refresh_from_db()
+        return content
+
+    def test_upload_builds_webp_and_jpeg_derivatives(self):
+        """Test that every size is stored in both formats after the upload"""
+        from PIL import Image
+        content = self._add_image(_image_file())
+        self.assertEqual(content.upload_status, 'ready')
+        self.assertEqual(set(content.derivatives), {'thumb', 'medium', 'large'})
+        self.assertEqual(
+            (content.derivatives['medium']['width'], content.derivatives['medium']['height']),
+            (960, 640),
+        )
+        storage = get_content_storage('local')
+        for name, fmt in (('thumb', 'WEBP'), ('large', 'JPEG')):
+            key = content.derivatives[name][fmt.lower()].split(':', 1)[1]
+            with Image.open(storage.path(key)) as stored:
+                self.assertEqual(stored.format, fmt)
+                self.assertEqual(stored.width, content.derivatives[name]['width'])
+
+    def test_small_images_are_not_upscaled(self):
+        """Test that sizes above the original are skipped except the smallest"""
+        results = render_derivatives(
+            _image_file(size=(200, 100), mode='RGB').file, self.tmp,
+            {'thumb': 320, 'medium': 960},
+        )
+        self.assertEqual(list(results), ['thumb'])
+        self.assertEqual((results['thumb']['width'], results['thumb']['height']), (200, 100))
+
+    def test_unreadable_image_keeps_original(self):
+        """Test that a file Pillow cannot decode is still ready, without derivatives"""
+        content = self._add_image(
+            SimpleUploadedFile('photo.jpg', JPEG_HEAD + b'jpeg bytes', content_type='image/jpeg')
+        )
+        self.assertEqual(content.upload_status, 'ready')
+        self.assertEqual(content.derivatives, {})
+
+    def test_detail_page_uses_srcset(self):
+        """Test that images render as lazy <picture> elements with a srcset"""
+        self._add_image(_image_file())
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(
+            reverse('capsules:capsule_detail', kwargs={'pk': self.capsule.pk})
+        )
+        self.assertContains(response, '<source type="image/webp" srcset="')
+        self.assertContains(response, ' 320w, ')
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_srcset_orders_by_width(self):
+        """Test that srcset lists sizes from narrow to wide and skips unsigned refs"""
+        derivatives = {
+            'large': {'width': 1920, 'height': 1280, 'jpeg': 'local:l.jpeg'},
+            'thumb': {'width': 320, 'height': 213, 'jpeg': 'local:t.jpeg'},
+            'medium': {'width': 960, 'height': 640, 'jpeg': 'local:m.jpeg'},
+        }
+        urls = {'local:l.jpeg': '/l/', 'local:t.jpeg': '/t/'}
+        self.assertEqual(srcset(derivatives, 'jpeg', urls), '/t/ 320w, /l/ 1920w')
+
+
+class ContentDeduplicationTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = os.path.join(tmp.name, 'storage')
+        overrides = override_settings(
+            CAPSULES_DEFAULT_STORAGE='local',
+            CAPSULES_LOCAL_STORAGE_ROOT=self.root,
+            CAPSULES_SPOOL_DIR=os.path.join(tmp.name, 'spool'),
+            CAPSULES_UPLOAD_WORKERS=0,
+            CAPSULES_DERIVATIVE_WORKERS=0,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title='Dedup Capsule',
+            unlock_date=timezone.now() + timedelta(days=7),
+        )
+
+    def _add(self, data=PDF_HEAD + b'report', capsule=None):
+        content = CapsuleContent(
+            capsule=capsule or self.capsule, title='Report', content_type='document'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            save_pending(content, SimpleUploadedFile('report.pdf', data))
+        content.refresh_from_db()
+        return content
+
+    def _stored_files(self):
+        return sum(len(names) for _, _, names in os.walk(self.root))
+
+    def test_reupload_reuses_stored_file(self):
+        """Test that the same bytes are stored once and referenced twice"""
+        other = TimeCapsule.objects.create(
+            creator=self.user, title='Other', unlock_date=timezone.now() + timedelta(days=7)
+        )
+        first = self._add()
+        second = self._add(capsule=other)
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.storage_key, second.storage_key)
+        self.assertEqual(first.blob.ref_count, 2)
+        self.assertEqual(first.blob.digest, hashlib.sha256(PDF_HEAD + b'report').hexdigest())
+        self.assertEqual(self._stored_files(), 1)
+
+    def test_blob_is_freed_with_its_last_content(self):
+        """Test that deleting contents decrements and finally frees the blob"""
+        first = self._add()
+        second = self._add()
+        path = get_content_storage('local').path(first.storage_key)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(ContentBlob.objects.get().ref_count, 1)
+        self.assertTrue(os.path.exists(path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.capsule.delete()
+        self.assertFalse(ContentBlob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(second.blob_id, first.blob_id)
+
+    def test_replacing_the_file_releases_the_old_blob(self):
+        """Test that a new file for existing content drops the old reference"""
+        content = self._add()
+        old_blob = content.blob_id
+        with self.captureOnCommitCallbacks(execute=True):
+            save_pending(content, SimpleUploadedFile('report.pdf', PDF_HEAD + b'v2'))
+        content.refresh_from_db()
+        self.assertNotEqual(content.blob_id, old_blob)
+        self.assertFalse(ContentBlob.objects.filter(pk=old_blob).exists())
+        self.assertEqual(self._stored_files(), 1)
+
+    def test_saving_a_new_file_releases_the_only_reference(self):
+        """Test that replacing a content's only file through save() frees the old blob"""
+        content = self._add()
+        old_blob = content.blob_id
+        content.file = SimpleUploadedFile('report.pdf', PDF_HEAD + b'v2')
+        with self.captureOnCommitCallbacks(execute=True):
+            content.save()
+        content.refresh_from_db()
+        self.assertNotEqual(content.blob_id, old_blob)
+        self.assertEqual(content.blob.ref_count, 1)
+        self.assertFalse(ContentBlob.objects.filter(pk=old_blob).exists())
+        self.assertEqual(self._stored_files(), 1)
+
+    def test_upload_handler_hashes_while_receiving(self):
+        """Test that multipart uploads arrive with their digest"""
+        self.client.login(username='testuser', password='testpass123')
+        data = PDF_HEAD + b'x' * 4096
+        seen = []
+        original = file_digest
+
+        def spy(fileobj):
+            seen.append(getattr(fileobj, 'content_digest', None))
+            return original(fileobj)
+
+        with self.captureOnCommitCallbacks(execute=True), \
+                override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024), \
+                mock.patch('capsules.bulk.file_digest', spy):
+            self.client.post(
+                reverse('capsules:content_add_many', kwargs={'pk': self.capsule.pk}),
+                {'files': [SimpleUploadedFile('a.pdf', data), SimpleUploadedFile('b.pdf', PDF_HEAD)]},
+            )
+        self.assertEqual(
+            seen,
+            [hashlib.sha256(data).hexdigest(), hashlib.sha256(PDF_HEAD).hexdigest()],
+        )
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title='Cached Capsule',
+            unlock_date=timezone.now() + timedelta(days=7),
+        )
+        self.content = CapsuleContent.objects.create(
+            capsule=self.capsule,
+            title='First photo',
+            content_type='image',
+            storage_backend='cloudinary',
+            storage_key='image/upload/v1/capsule_contents/photo.jpg',
+        )
+        self.client.login(username='testuser', password='testpass123')
+        self.detail_url = reverse('capsules:capsule_detail', kwargs={'pk': self.capsule.pk})
+        self.list_url = reverse('capsules:capsule_list')
+
+    def test_repeat_views_reuse_cached_fragments(self):
+        """Test that a second visit renders no card or content block"""
+        for url, fragment in ((self.detail_url, 'capsules/_content_block.html'),
+                              (self.list_url, 'capsules/_capsule_card.html')):
+            response = self.client.get(url)
+            self.assertTemplateUsed(response, fragment)
+            response = self.client.get(url)
+            self.assertTemplateNotUsed(response, fragment)
+        self.assertContains(response, 'Cached Capsule')
+
+    def test_saves_and_deletes_invalidate(self):
+        """Test that changing the capsule or a content shows up right away"""
+        self.client.get(self.detail_url)
+        self.client.get(self.list_url)
+
+        self.content.title = 'Renamed photo'
+        self.content.save()
+        self.assertContains(self.client.get(self.detail_url), 'Renamed photo')
+
+        self.capsule.refresh_from_db()
+        self.capsule.title = 'Renamed capsule'
+        self.capsule.save(update_fields=['title'])
+        self.assertContains(self.client.get(self.list_url), 'Renamed capsule')
+
+        self.content.delete()
+        self.assertContains(self.client.get(self.list_url), '0 items')
+
+    def test_entries_switch_over_at_unlock_date(self):
+        """Test that locked entries are not served once the capsule is due"""
+        self.capsule.status = 'locked'
+        self.capsule.save()
+        self.assertContains(self.client.get(self.detail_url), 'Content locked until')
+        # Passing the unlock date changes no row, only the effective status
+        TimeCapsule.objects.filter(pk=self.capsule.pk).update(
+            unlock_date=timezone.now() - timedelta(minutes=1)
+        )
+        self.capsule.refresh_from_db()
+        response = self.client.get(self.detail_url)
+        self.assertNotContains(response, 'Content locked until')
+        self.assertContains(response, '/files/')
+
+    def test_timeouts_and_keys(self):
+        """Test that entries expire at the unlock date and are per user"""
+        self.capsule.unlock_date = timezone.now() + timedelta(seconds=60)
+        self.assertLessEqual(fragment_timeout(self.capsule), 60)
+        self.capsule.unlock_date = timezone.now() - timedelta(days=1)
+        self.assertEqual(fragment_timeout(self.capsule), 300)
+        with override_settings(CAPSULES_FRAGMENT_CACHE_TIMEOUT=0):
+            self.assertEqual(fragment_timeout(self.capsule), 0)
+
+        other = User.objects.create_user(username='other', password='testpass123')
+        self.assertNotEqual(
+            fragment_key('card', self.user, self.capsule.pk, self.capsule),
+            fragment_key('card', other, self.capsule.pk, self.capsule),
+        )
+
+    def test_capsule_delete_does_not_bump_per_content(self):
+        """Test that cascaded content deletes skip the version bump"""
+        CapsuleContent.objects.bulk_create([
+            CapsuleContent(capsule=self.capsule, title=f'Item {i}', content_type='document')
+            for i in range(5)
+        ])
+        with CaptureQueriesContext(connection) as ctx:
+            self.capsule.delete()
+        updates = [q for q in ctx.captured_queries
+                   if q['sql'].startswith('UPDATE "capsules_timecapsule"')]
+        self.assertEqual(updates, [])
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        overrides = override_settings(
+            CAPSULES_DEFAULT_STORAGE='local',
+            CAPSULES_LOCAL_STORAGE_ROOT=os.path.join(tmp.name, 'storage'),
+            CAPSULES_SPOOL_DIR=os.path.join(tmp.name, 'spool'),
+            CAPSULES_UPLOAD_WORKERS=0,
+            CAPSULES_DERIVATIVE_WORKERS=0,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title='My Capsule',
+            description='Mine',
+            unlock_date=timezone.now() + timedelta(days=7),
+        )
+        self.private = TimeCapsule.objects.create(
+            creator=self.other,
+            title='Private Capsule',
+            unlock_date=timezone.now() + timedelta(days=7),
+        )
+        self.public = TimeCapsule.objects.create(
+            creator=self.other,
+            title='Public Capsule',
+            unlock_date=timezone.now() - timedelta(days=1),
+            is_public=True,
+        )
+        self.content = CapsuleContent.objects.create(
+            capsule=self.public,
+            title='Public photo',
+            content_type='image',
+            storage_backend='cloudinary',
+            storage_key='image/upload/v1/capsule_contents/photo.jpg',
+        )
+        self.client.login(username='testuser', password='testpass123')
+
+    def _json(self, method, url, payload):
+        return getattr(self.client, method)(
+            url, data=json.dumps(payload), content_type='application/json'
+        )
+
+    def test_requires_login(self):
+        """Test that anonymous requests get a JSON 401 instead of a redirect"""
+        self.client.logout()
+        response = self.client.get(reverse('capsules:api_capsules'))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['error'], 'Authentication required.')
+
+    def test_batch_get_reports_invisible_as_missing(self):
+        """Test that a batch get returns visible capsules in order"""
+        ids = f'{self.public.pk},{self.private.pk},{self.capsule.pk},999999'
+        with query_budget(3):  # session, user, capsules
+            response = self.client.get(reverse('capsules:api_capsules'), {'ids': ids})
+        data = response.json()
+        self.assertEqual([c['id'] for c in data['results']], [self.public.pk, self.capsule.pk])
+        self.assertEqual(data['missing'], [self.private.pk, 999999])
+        self.assertEqual(data['results'][0]['status'], 'unlocked')
+        self.assertFalse(data['results'][0]['is_owner'])
+
+    def test_sparse_fields(self):
+        """Test that ?fields= limits the payload and rejects unknown fields"""
+        url = reverse('capsules:api_capsule', args=[self.capsule.pk])
+        response = self.client.get(url, {'fields': 'title,content_count'})
+        self.assertEqual(response.json(), {'title': 'My Capsule', 'content_count': 0})
+
+        response = self.client.get(url, {'fields': 'title,creator'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_pagination(self):
+        """Test that following next walks every own capsule once"""
+        for i in range(4):
+            TimeCapsule.objects.create(
+                creator=self.user, title=f'Capsule {i}',
+                unlock_date=timezone.now() + timedelta(days=7),
+            )
+        url = reverse('capsules:api_capsules') + '?limit=2&fields=id'
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            seen.extend(c['id'] for c in data['results'])
+            url = data['next']
+        expected = list(
+            TimeCapsule.objects.filter(creator=self.user)
+            .order_by('-created_at', '-pk').values_list('pk', flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+    def test_etag_and_not_modified(self):
+        """Test that a matching If-None-Match gets a 304 until the capsule changes"""
+        url = reverse('capsules:api_capsule', args=[self.capsule.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertTrue(etag.startswith('"'))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        self.capsule.title = 'Renamed'
+        self.capsule.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_capsule_write_operations(self):
+        """Test creating, editing, locking and deleting through the API"""
+        response = self._json('post', reverse('capsules:api_capsules'), {
+            'title': 'From the API',
+            'description': 'Created remotely',
+            'unlock_date': (timezone.now() + timedelta(days=30)).isoformat(),
+        })
+        self.assertEqual(response.status_code, 201)
+        capsule = TimeCapsule.objects.get(pk=response.json()['id'])
+        self.assertEqual(capsule.creator, self.user)
+        url = reverse('capsules:api_capsule', args=[capsule.pk])
+
+        response = self._json('patch', url, {'title': 'Edited'})
+        self.assertEqual(response.json()['title'], 'Edited')
+        self.assertEqual(self._json('patch', url, {'creator': self.other.pk}).status_code, 400)
+
+        response = self.client.post(reverse('capsules:api_capsule_lock', args=[capsule.pk]))
+        self.assertEqual(response.json()['status'], 'locked')
+        self.assertEqual(self._json('patch', url, {'title': 'Nope'}).status_code, 403)
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(TimeCapsule.objects.filter(pk=capsule.pk).exists())
+
+    def test_other_users_capsules_cannot_be_changed(self):
+        """Test that writes to a visible but foreign capsule answer 404"""
+        url = reverse('capsules:api_capsule', args=[self.public.pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self._json('patch', url, {'title': 'Mine now'}).status_code, 404)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+        content_url = reverse('capsules:api_content', args=[self.content.pk])
+        self.assertEqual(self.client.delete(content_url).status_code, 404)
+        self.assertEqual(
+            self.client.get(reverse('capsules:api_capsule', args=[self.private.pk])).status_code,
+            404,
+        )
+
+    def test_contents_and_file_urls(self):
+        """Test that file URLs are only handed out for unlocked capsules"""
+        locked = CapsuleContent.objects.create(
+            capsule=self.capsule,
+            title='Locked photo',
+            content_type='image',
+            storage_backend='cloudinary',
+            storage_key='image/upload/v1/capsule_contents/locked.jpg',
+        )
+        self.capsule.status = 'locked'
+        self.capsule.save()
+
+        response = self.client.get(
+            reverse('capsules:api_contents'), {'ids': f'{locked.pk},{self.content.pk}'}
+        )
+        results = response.json()['results']
+        self.assertIsNone(results[0]['file_url'])
+        self.assertIn('/files/', results[1]['file_url'])
+
+        response = self.client.get(reverse('capsules:api_capsule_contents', args=[self.private.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_add_content(self):
+        """Test that a file posted to a capsule is stored by the pipeline"""
+        upload = SimpleUploadedFile('notes.pdf', b'%PDF-1.4 notes', content_type='application/pdf')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('capsules:api_capsule_contents', args=[self.capsule.pk]),
+                {'title': 'Notes', 'description': 'Meeting notes', 'file': upload},
+            )
+        self.assertEqual(response.status_code, 202)
+        content = CapsuleContent.objects.get(pk=response.json()['id'])
+        self.assertEqual(content.content_type, 'document')
+        self.assertEqual(content.upload_status, 'ready')
+
+        response = self._json(
+            'patch', reverse('capsules:api_content', args=[content.pk]), {'title': 'Renamed'}
+        )
+        self.assertEqual(response.json()['title'], 'Renamed')
+
+
+class CapsuleEventTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title='Soon',
+            unlock_date=timezone.now() + timedelta(days=1),
+        )
+        TimeCapsule.objects.filter(pk=self.capsule.pk).update(status='locked')
+        self.private = TimeCapsule.objects.create(
+            creator=self.other,
+            title='Private',
+            unlock_date=timezone.now() + timedelta(days=1),
+        )
+        self.url = reverse('capsules:capsule_events') + f'?ids={self.capsule.pk},{self.private.pk}'
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+
+    async def _events(self, response, count):
+        events = []
+        async for chunk in response.streaming_content:
+            chunk = chunk.decode()
+            if chunk.startswith('event: status'):
+                events.append(json.loads(chunk.split('data: ', 1)[1]))
+                if len(events) == count:
+                    break
+        return events
+
+    def test_wsgi_sends_current_statuses_and_closes(self):
+        """Test that without ASGI the stream holds no worker"""
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.startswith('retry: 15000'))
+        self.assertIn(f'"id": {self.capsule.pk}, "status": "locked"', body)
+        # Capsules the user may not see are left out
+        self.assertNotIn(f'"id": {self.private.pk}', body)
+
+    def test_requires_login(self):
+        """Test that anonymous clients get a 401"""
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    @override_settings(CAPSULES_EVENTS_POLL_INTERVAL=60)
+    async def test_pushes_unlock_at_unlock_date(self):
+        """Test that an unlock is pushed at its unlock date without polling"""
+        await TimeCapsule.objects.filter(pk=self.capsule.pk).aupdate(
+            unlock_date=timezone.now() + timedelta(seconds=0.5)
+        )
+        response = await self.async_client.get(self.url)
+        started = time.monotonic()
+        events = await self._events(response, 2)
+        await response.streaming_content.aclose()
+        self.assertEqual([e['status'] for e in events], ['locked', 'unlocked'])
+        self.assertLess(time.monotonic() - started, 5)
+
+    @override_settings(CAPSULES_EVENTS_POLL_INTERVAL=0.1)
+    async def test_reports_deleted_capsules_as_gone(self):
+        """Test that a deleted capsule is reported once"""
+        response = await self.async_client.get(self.url)
+        events = await self._events(response, 1)
+        await TimeCapsule.objects.filter(pk=self.capsule.pk).adelete()
+        events += await self._events(response, 1)
+        await response.streaming_content.aclose()
+        self.assertEqual(events[-1], {'id': self.capsule.pk, 'status': 'gone'})
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title='Async Capsule',
+            description='Rendered twice',
+            unlock_date=timezone.now() - timedelta(days=1),
+        )
+        self.content = CapsuleContent.objects.create(
+            capsule=self.capsule,
+            title='Photo',
+            content_type='image',
+            storage_backend='cloudinary',
+            storage_key='image/upload/v1/capsule_contents/photo.jpg',
+        )
+
+    def _request(self, user, path='/'):
+        request = self.factory.get(path)
+        request.user = user
+        return request
+
+    def _html(self, response):
+        # CSRF tokens are masked differently on every render
+        return re.sub(r'value="[^"]+" name="csrfmiddlewaretoken"|name="csrfmiddlewaretoken" value="[^"]+"',
+                      '', response.content.decode())
+
+    def test_same_pages_as_sync_views(self):
+        """Test that the async list and detail views render what the sync ones do"""
+        # Sign identical delivery URLs in both renders
+        frozen = mock.patch('capsules.delivery.time.time', return_value=time.time())
+        frozen.start()
+        self.addCleanup(frozen.stop)
+        for name, args in (('capsule_list', ()), ('capsule_detail', (self.capsule.pk,))):
+            cache.clear()
+            sync = getattr(views, name)(self._request(self.user), *args)
+            cache.clear()
+            native = async_to_sync(getattr(async_views, name))(self._request(self.user), *args)
+            self.assertEqual(native.status_code, 200)
+            self.assertEqual(self._html(native), self._html(sync))
+
+    def test_permissions(self):
+        """Test that the async views apply the rules of the sync ones"""
+        request = self._request(self.other)
+        response = async_to_sync(async_views.capsule_detail)(request, self.capsule.pk)
+        self.assertEqual(response.status_code, 403)
+        with self.assertRaises(PermissionDenied):
+            async_to_sync(async_views.serve_protected_file)(request, self.content.pk)
+
+        response = async_to_sync(async_views.serve_protected_file)(
+            self._request(self.user), self.content.pk
+        )
+        self.assertEqual(response.url, delivery_url(self.content.storage_ref))
+
+        anonymous = self._request(mock.Mock(is_authenticated=False), '/capsules/')
+        response = async_to_sync(async_views.capsule_list)(anonymous)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('next=/capsules/', response.url)
+
+
+class BenchmarkServersTests(TestCase):
+    def test_percentiles(self):
+        """Test the nearest-rank percentiles of the report"""
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([], 0.99), 0)
+
+    def test_run_load(self):
+        """Test that the load generator counts successes and failures"""
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                status = 200 if self.headers['Cookie'] == 'sessionid=x' and self.path == '/ok' else 404
+                self.send_response(status)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        result = run_load(server.server_port, ['/ok', '/missing'], 'sessionid=x', 2, 0.3)
+        self.assertGreater(result['requests'], 0)
+        self.assertGreater(result['errors'], 0)
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+
+class BenchmarkUrlsTests(TestCase):
+    def test_seed_is_reused_and_mixed(self):
+        """Test that seeding tops up existing users and mixes statuses"""
+        users = seed(2, 12, 2, random.Random(0))
+        self.assertEqual(TimeCapsule.objects.filter(creator__in=users).count(), 24)
+        self.assertEqual(CapsuleContent.objects.filter(capsule__creator__in=users).count(), 48)
+        self.assertGreater(len(set(TimeCapsule.objects.values_list('status', flat=True))), 1)
+        seed(2, 12, 2, random.Random(0))
+        self.assertEqual(TimeCapsule.objects.count(), 24)
+
+    def test_every_route_is_reported_and_data_is_unchanged(self):
+        """Test that each capsules URL is measured without changing the data"""
+        from .urls import urlpatterns
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'results.json')
+        seed(1, 3, 2, random.Random(0))
+        before = list(TimeCapsule.objects.values_list('pk', 'status', 'version').order_by('pk'))
+        call_command(
+            'benchmark_urls', users=1, capsules=3, contents=2, requests=2, warmup=0,
+            json=path, stdout=StringIO(),
+        )
+        with open(path) as f:
+            results = json.load(f)
+        self.assertEqual(set(results['routes']), {p.name for p in urlpatterns})
+        for name, row in results['routes'].items():
+            self.assertEqual(row['requests'], 2, name)
+            self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+        self.assertEqual(results['routes']['capsule_list']['statuses'], {'200': 2})
+        self.assertGreater(results['routes']['capsule_list']['mean_bytes'], 0)
+        # capsule_lock and content_delete act on GET; their writes are rolled back
+        after = list(TimeCapsule.objects.values_list('pk', 'status', 'version').order_by('pk'))
+        self.assertEqual(before, after)
+        self.assertEqual(CapsuleContent.objects.count(), 6)
+
+        call_command('benchmark_urls', cleanup=True, stdout=StringIO())
+        self.assertFalse(TimeCapsule.objects.exists())
+
+
+class CapsuleExportTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        overrides = override_settings(
+            CAPSULES_DEFAULT_STORAGE='local',
+            CAPSULES_LOCAL_STORAGE_ROOT=tmp.name,
+            CAPSULES_EXPORT_CHUNK_SIZE=1024,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title='Summer Trip',
+            unlock_date=timezone.now() + timedelta(days=7),
+        )
+        self.files = {
+            'Beach.jpg': bytes(range(256)) * 40,
+            'Notes.txt': b'sand and sea\n' * 500,
+            'Notes (2).txt': b'more notes',
+        }
+        for name, data in self.files.items():
+            title, ext = os.path.splitext(name.replace(' (2)', ''))
+            CapsuleContent.objects.create(
+                capsule=self.capsule,
+                title=title,
+                content_type='image' if ext == '.jpg' else 'text',
+                file=SimpleUploadedFile(f'upload{ext}', data),
+            )
+        self.url = reverse('capsules:capsule_export', kwargs={'pk': self.capsule.pk})
+        self.client.login(username='testuser', password='testpass123')
+
+    def _archive(self, response):
+        self.assertEqual(response.status_code, 200)
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_archive_holds_every_file(self):
+        """Test that the export streams a ZIP of all files with unique names"""
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="summer-trip.zip"')
+        archive = self._archive(response)
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(sorted(archive.namelist()), sorted(self.files))
+        for name, data in self.files.items():
+            self.assertEqual(archive.read(name), data)
+        self.assertEqual(archive.getinfo('Beach.jpg').compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(archive.getinfo('Notes.txt').compress_type, zipfile.ZIP_DEFLATED)
+
+    def test_missing_file_is_listed(self):
+        """Test that a file missing from storage is reported inside the archive"""
+        content = self.capsule.contents.get(title='Beach')
+        os.remove(get_content_storage('local').path(content.storage_key))
+        with self.assertLogs('capsules.export', 'WARNING'):
+            archive = self._archive(self.client.get(self.url))
+        self.assertNotIn('Beach.jpg', archive.namelist())
+        self.assertEqual(archive.read('Notes.txt'), self.files['Notes.txt'])
+        self.assertIn('Beach.jpg', archive.read(ERRORS_NAME).decode())
+
+    def test_locked_capsule_is_refused(self):
+        """Test that the files of a locked capsule cannot be exported"""
+        TimeCapsule.objects.filter(pk=self.capsule.pk).update(status='locked')
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_other_users_private_capsule_is_refused(self):
+        """Test that only people allowed to see the files can export them"""
+        User.objects.create_user(username='otheruser', password='testpass123')
+        self.client.login(username='otheruser', password='testpass123')
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        TimeCapsule.objects.filter(pk=self.capsule.pk).update(is_public=True)
+        self.assertEqual(len(self._archive(self.client.get(self.url)).namelist()), 3)
+
+
+class CapsuleImportTests(TestCase):
+    FILES = {
+        'letters/1952.pdf': b'%PDF-1.4 first letter',
+        'letters/1953.pdf': b'%PDF-1.4 second letter',
+        'notes.txt': b'Remember the garden\n',
+        '.DS_Store': b'\x00\x00\x00\x01Bud1',
+    }
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        overrides = override_settings(
+            CAPSULES_DEFAULT_STORAGE='local',
+            CAPSULES_LOCAL_STORAGE_ROOT=os.path.join(tmp.name, 'storage'),
+            CAPSULES_IMPORT_DIR=os.path.join(tmp.name, 'imports'),
+            CAPSULES_IMPORT_WORKERS=0,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.unlock_date = (timezone.now() + timedelta(days=30)).isoformat()
+
+    def _directory(self, manifest=None):
+        root = os.path.join(self.tmp, 'source')
+        for name, data in self.FILES.items():
+            os.makedirs(os.path.dirname(os.path.join(root, name)), exist_ok=True)
+            with open(os.path.join(root, name), 'wb') as f:
+                f.write(data)
+        if manifest is not None:
+            with open(os.path.join(root, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f)
+        return root
+
+    def _titles(self, job):
+        return sorted(CapsuleContent.objects.filter(capsule=job.capsule).values_list('title', flat=True))
+
+    def test_directory_import_follows_manifest(self):
+        """Test that the manifest sets the capsule, the files and their titles"""
+        source = self._directory({
+            'title': 'Letters',
+            'unlock_date': self.unlock_date,
+            'files': [
+                'letters/1952.pdf',
+                {'path': 'notes.txt', 'title': 'Garden', 'description': 'From the shed'},
+                'missing.pdf',
+            ],
+        })
+        job = start_import(self.user, source)
+        reports = []
+        run_import(job, batch_size=2, report=reports.append)
+
+        self.assertEqual(job.capsule.title, 'Letters')
+        self.assertEqual(job.capsule.creator, self.user)
+        self.assertEqual(self._titles(job), ['1952', 'Garden'])
+        self.assertEqual(CapsuleContent.objects.get(title='Garden').description, 'From the shed')
+        self.assertEqual(len(reports), 2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.position, job.imported), ('done', 3, 2))
+        self.assertEqual(job.failures, [{'path': 'missing.pdf', 'error': 'Not found in the source.'}])
+        self.assertGreater(job.files_per_second, 0)
+
+    def test_interrupted_import_resumes_without_duplicates(self):
+        """Test that a rerun continues after the last committed batch"""
+        class Interrupted(Exception):
+            pass
+
+        def interrupt(job):
+            raise Interrupted()
+
+        job = start_import(self.user, self._directory(), unlock_date=self.unlock_date)
+        self.assertEqual(job.total, 3)
+        with self.assertRaises(Interrupted):
+            run_import(job, batch_size=2, report=interrupt)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.position), ('failed', 2))
+        self.assertEqual(len(self._titles(job)), 2)
+
+        job = run_import(ImportJob.objects.get(pk=job.pk), batch_size=2)
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(self._titles(job), ['1952', '1953', 'Notes'])
+        self.assertEqual(ImportJob.objects.get(pk=job.pk).imported, 3)
+
+    def test_unusable_source_is_refused(self):
+        """Test that invalid capsule fields and changed sources stop an import"""
+        source = self._directory()
+        with self.assertRaises(ImportSourceError):
+            start_import(self.user, source)
+        self.assertFalse(TimeCapsule.objects.exists())
+
+        job = start_import(self.user, source, unlock_date=self.unlock_date)
+        with open(os.path.join(source, 'extra.txt'), 'w') as f:
+            f.write('added later')
+        with self.assertRaises(ImportSourceError):
+            run_import(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('changed', job.error)
+
+    def test_uploaded_archive_is_imported(self):
+        """Test that the import view imports an uploaded ZIP file"""
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for name, data in self.FILES.items():
+                archive.writestr(name, data)
+            archive.writestr('manifest.json', json.dumps({'unlock_date': self.unlock_date}))
+        self.client.login(username='testuser', password='testpass123')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('capsules:capsule_import'),
+                {'archive': SimpleUploadedFile('family_letters.zip', buffer.getvalue())},
+                HTTP_ACCEPT='application/json',
+            )
+        self.assertEqual(response.status_code, 202)
+
+        state = self.client.get(response.json()['status_url']).json()
+        self.assertEqual((state['status'], state['imported']), ('done', 3))
+        self.assertEqual(TimeCapsule.objects.get().title, 'Family letters')
+        self.assertEqual(os.listdir(os.path.join(self.tmp, 'imports')), [])
+
+        response = self.client.post(
+            reverse('capsules:capsule_import'),
+            {'archive': SimpleUploadedFile('notes.txt', b'not an archive')},
+            HTTP_ACCEPT='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('archive', response.json()['errors'])
+
+    def test_command_reports_progress(self):
+        """Test that the command prints throughput and resumes by id"""
+        out = StringIO()
+        call_command(
+            'import_capsule', self._directory(), user='testuser',
+            unlock_date=self.unlock_date, batch_size=2, stdout=out,
+        )
+        self.assertIn('files/s', out.getvalue())
+        self.assertIn('Imported 3 of 3 files', out.getvalue())
+
+        job = ImportJob.objects.get()
+        out = StringIO()
+        call_command('import_capsule', resume=str(job.pk), stdout=out)
+        self.assertIn('at file 3 of 3', out.getvalue())
+        self.assertEqual(CapsuleContent.objects.count(), 3)
+
+
+@override_settings(CAPSULES_DEFAULT_STORAGE='local', CAPSULES_PURGE_WORKERS=0)
+class CapsuleDeletionTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        overrides = override_settings(CAPSULES_LOCAL_STORAGE_ROOT=tmp.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.storage = get_content_storage('local')
+
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.client.login(username='testuser', password='testpass123')
+        self.capsule = self._capsule('Doomed')
+        self.kept = self._capsule('Kept')
+        self.own = self._content(self.capsule, b'own')
+        self.shared = self._content(self.capsule, b'shared')
+        self.other = self._content(self.kept, b'shared')
+        # Stored before deduplication: the content owns its file
+        self.legacy = CapsuleContent.objects.create(
+            capsule=self.capsule,
+            title='Legacy',
+            content_type='document',
+            storage_backend='local',
+            storage_key=self.storage.save('old.pdf', io.BytesIO(PDF_HEAD + b'old')),
+        )
+
+    def _capsule(self, title):
+        return TimeCapsule.objects.create(
+            creator=self.user, title=title, unlock_date=timezone.now() + timedelta(days=7)
+        )
+
+    def _content(self, capsule, data):
+        return CapsuleContent.objects.create(
+            capsule=capsule,
+            title='Report',
+            content_type='document',
+            file=SimpleUploadedFile('report.pdf', PDF_HEAD + data),
+        )
+
+    def _stored(self, content):
+        return os.path.exists(self.storage.path(content.storage_key))
+
+    def test_delete_hides_capsule_at_once(self):
+        """Test that deleting hides the capsule in a few queries, keeping the rows"""
+        CapsuleContent.objects.bulk_create([
+            CapsuleContent(capsule=self.capsule, title=f'Item {i}', content_type='document')
+            for i in range(50)
+        ])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('capsules:capsule_delete', args=[self.capsule.pk]))
+        self.assertRedirects(response, reverse('capsules:capsule_list'), fetch_redirect_response=False)
+        self.assertLess(len(ctx.captured_queries), 10)
+
+        self.assertFalse(TimeCapsule.objects.filter(pk=self.capsule.pk).exists())
+        self.assertFalse(CapsuleContent.objects.live().filter(capsule_id=self.capsule.pk).exists())
+        self.assertEqual(self.kept.contents.count(), 1)
+        detail = reverse('capsules:capsule_detail', args=[self.capsule.pk])
+        self.assertEqual(self.client.get(detail).status_code, 404)
+        self.assertEqual(self.client.get(self.own.get_file_url()).status_code, 404)
+        edit = reverse('capsules:content_edit', args=[self.own.pk])
+        self.assertEqual(self.client.get(edit).status_code, 404)
+        self.assertEqual(CapsuleContent.objects.filter(capsule_id=self.capsule.pk).count(), 53)
+        self.assertTrue(self._stored(self.own))
+
+    def test_default_content_manager_needs_no_join(self):
+        """Test that only the user-facing content querysets join the capsule"""
+        self.assertNotIn('JOIN', str(CapsuleContent.objects.filter(pk=self.own.pk).query))
+        self.assertIn('JOIN', str(CapsuleContent.objects.live().filter(pk=self.own.pk).query))
+
+    def test_purge_removes_rows_then_files(self):
+        """Test that the purge frees unused files only, and can run again"""
+        self.client.post(reverse('capsules:capsule_delete', args=[self.capsule.pk]))
+        self.assertEqual(purge_deleted_capsules(batch_size=2), 1)
+        self.assertFalse(TimeCapsule.all_objects.filter(pk=self.capsule.pk).exists())
+        self.assertFalse(CapsuleContent.objects.filter(capsule_id=self.capsule.pk).exists())
+        self.assertEqual(ContentBlob.objects.get(pk=self.shared.blob_id).ref_count, 1)
+        self.assertFalse(ContentBlob.objects.filter(pk=self.own.blob_id).exists())
+        self.assertEqual(PendingStorageDeletion.objects.count(), 2)
+
+        self.assertEqual(delete_pending_files(), (2, 0))
+        self.assertFalse(self._stored(self.own))
+        self.assertFalse(self._stored(self.legacy))
+        self.assertTrue(self._stored(self.other))
+        self.assertEqual(purge_deleted_capsules(), 0)
+        self.assertEqual(delete_pending_files(), (0, 0))
+
+    @override_settings(CAPSULES_STORAGE_DELETE_RETRIES=2, CAPSULES_STORAGE_DELETE_RETRY_DELAY=60)
+    def test_failed_file_deletions_are_retried(self):
+        """Test that failed batch deletes back off and finally give up"""
+        PendingStorageDeletion.objects.enqueue([self.own.storage_ref, self.legacy.storage_ref])
+        now = timezone.now()
+        with mock.patch.object(LocalContentStorage, 'delete_many', side_effect=OSError('offline')):
+            self.assertEqual(delete_pending_files(now=now), (0, 2))
+            self.assertEqual(delete_pending_files(now=now), (0, 0))
+            self.assertEqual(delete_pending_files(now=now + timedelta(seconds=60)), (0, 2))
+        pending = PendingStorageDeletion.objects.first()
+        self.assertEqual((pending.attempts, pending.last_error), (2, 'offline'))
+        self.assertEqual(delete_pending_files(now=now + timedelta(days=1)), (0, 0))
+
+        PendingStorageDeletion.objects.update(attempts=1)
+        self.assertEqual(delete_pending_files(now=now + timedelta(days=1)), (2, 0))
+        self.assertFalse(self._stored(self.legacy))
+
+    def test_files_are_deleted_outside_the_claim(self):
+        """Test that storage calls run after the claim committed, with the batch leased"""
+        PendingStorageDeletion.objects.enqueue([self.own.storage_ref, self.legacy.storage_ref])
+        depth = len(connection.savepoint_ids)
+        seen = []
+
+        def delete_many(keys):
+            seen.append((
+                len(connection.savepoint_ids),
+                PendingStorageDeletion.objects.filter(next_attempt_at__lte=timezone.now()).count(),
+            ))
+
+        with mock.patch.object(LocalContentStorage, 'delete_many', side_effect=delete_many):
+            self.assertEqual(delete_pending_files(), (2, 0))
+        self.assertEqual(seen, [(depth, 0)])
+        self.assertFalse(PendingStorageDeletion.objects.exists())
+
+    def test_command_purges(self):
+        """Test that purge_deleted reports what it removed"""
+        self.client.delete(reverse('capsules:api_capsule', args=[self.capsule.pk]))
+        out = StringIO()
+        call_command('purge_deleted', stdout=out)
+        self.assertIn('Purged 1 capsules, deleted 2 stored files, 0 failed', out.getvalue())
+
+
+class PublicTimelineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.client.login(username='testuser', password='testpass123')
+
+    def _public_capsule(self, title, days_ago=1):
+        capsule = TimeCapsule.objects.create(
+            creator=self.user,
+            title=title,
+            unlock_date=timezone.now() + timedelta(days=7),
+            is_public=True,
+        )
+        TimeCapsule.objects.filter(pk=capsule.pk).update(
+            status='locked', unlock_date=timezone.now() - timedelta(days=days_ago)
+        )
+        return capsule
+
+    def _feed_ids(self, **kwargs):
+        return [entry['id'] for entry in feed_page(**kwargs)['entries']]
+
+    def test_sweep_appends_unlocked_public_capsules(self):
+        """Test that only public capsules unlocked by the sweeper join the feed"""
+        public = self._public_capsule('Public')
+        private = self._public_capsule('Private')
+        TimeCapsule.objects.filter(pk=private.pk).update(is_public=False)
+        self.assertEqual(self._feed_ids(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            sweep_due_capsules()
+        self.assertEqual(self._feed_ids(), [public.pk])
+
+    def test_private_and_deleted_capsules_leave_the_feed(self):
+        """Test that entries are removed when a capsule turns private or is deleted"""
+        first = self._public_capsule('First')
+        second = self._public_capsule('Second', days_ago=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            sweep_due_capsules()
+        self.assertEqual(self._feed_ids(), [first.pk, second.pk])
+
+        first.refresh_from_db()
+        first.is_public = False
+        with self.captureOnCommitCallbacks(execute=True):
+            first.save()
+        self.assertEqual(self._feed_ids(), [second.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(self._feed_ids(), [])
+        self.assertFalse(PublicTimelineEntry.objects.exists())
+
+    def test_saving_an_unlocked_public_capsule_adds_it(self):
+        """Test that a capsule made public after unlocking joins the feed"""
+        capsule = self._public_capsule('Later')
+        TimeCapsule.objects.filter(pk=capsule.pk).update(status='unlocked', is_public=False)
+        capsule.refresh_from_db()
+        capsule.is_public = True
+        with self.captureOnCommitCallbacks(execute=True):
+            capsule.save()
+        self.assertEqual(self._feed_ids(), [capsule.pk])
+
+    def test_feed_pages_are_served_from_cache(self):
+        """Test that repeat reads of the feed run no query"""
+        self._public_capsule('Cached')
+        with self.captureOnCommitCallbacks(execute=True):
+            sweep_due_capsules()
+        feed_page()
+        with self.assertNumQueries(0):
+            feed_page()
+
+    def test_feed_is_cursor_paginated(self):
+        """Test that following the cursors lists every entry once, newest first"""
+        capsules = [self._public_capsule(f'Capsule {n}', days_ago=n + 1) for n in range(5)]
+        with self.captureOnCommitCallbacks(execute=True):
+            sweep_due_capsules()
+
+        ids, cursor = [], None
+        while True:
+            page = feed_page(cursor=cursor, page_size=2)
+            ids += [entry['id'] for entry in page['entries']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(ids, [capsule.pk for capsule in capsules])
+
+    def test_public_feed_view(self):
+        """Test that the feed page lists public capsules and supports fragments"""
+        capsule = self._public_capsule('Shown')
+        with self.captureOnCommitCallbacks(execute=True):
+            sweep_due_capsules()
+        url = reverse('capsules:public_feed')
+        response = self.client.get(url)
+        self.assertTemplateUsed(response, 'capsules/public_feed.html')
+        self.assertContains(response, 'Shown')
+        self.assertContains(response, reverse('capsules:capsule_detail', args=[capsule.pk]))
+        response = self.client.get(url, {'fragment': 1})
+        self.assertTemplateNotUsed(response, 'capsules/public_feed.html')
+        self.assertContains(response, 'Shown')
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.other = User.objects.create_user(
+            username='otheruser',
+            email='other@example.com',
+            password='testpass123'
+        )
+        self.client.login(username='testuser', password='testpass123')
+
+    def _capsule(self, title, description='', creator=None, **kwargs):
+        return TimeCapsule.objects.create(
+            creator=creator or self.user,
+            title=title,
+            description=description,
+            unlock_date=timezone.now() + timedelta(days=7),
+            **kwargs
+        )
+
+    def _titles(self, query, user=None):
+        return [c.title for c in search_capsules(user or self.user, query)]
+
+    def test_results_are_ranked(self):
+        """Test that title matches rank above description matches"""
+        self._capsule('Notes', 'A summer holiday in Rome')
+        self._capsule('Summer holiday', 'Photos')
+        self.assertEqual(self._titles('summer holiday'), ['Summer holiday', 'Notes'])
+
+    def test_every_word_must_match_as_prefix(self):
+        """Test that queries match word prefixes and require all words"""
+        self._capsule('Graduation day', 'Speeches')
+        self.assertEqual(self._titles('gradu'), ['Graduation day'])
+        self.assertEqual(self._titles('graduation wedding'), [])
+        self.assertEqual(self._titles('  '), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        """Test that capsule and content changes update the index"""
+        capsule = self._capsule('Old title')
+        with self.captureOnCommitCallbacks(execute=True):
+            content = CapsuleContent.objects.create(
+                capsule=capsule, title='Birthday cake', content_type='image'
+            )
+        self.assertEqual(self._titles('cake'), ['Old title'])
+        self.assertEqual(
+            list(search(CapsuleContent.objects.all(), 'birthday')), [content]
+        )
+
+        capsule.title = 'New title'
+        capsule.save()
+        self.assertEqual(self._titles('old'), [])
+        self.assertEqual(self._titles('new'), ['New title'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            content.delete()
+        self.assertEqual(self._titles('cake'), [])
+        self.assertEqual(list(search(CapsuleContent.objects.all(), 'birthday')), [])
+
+        capsule.delete()
+        self.assertEqual(self._titles('new'), [])
+
+    def test_bulk_added_contents_are_indexed(self):
+        """Test that contents created by add_files can be found"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        capsule = self._capsule('Bulk')
+        with override_settings(CAPSULES_DEFAULT_STORAGE='local', CAPSULES_LOCAL_STORAGE_ROOT=tmp.name):
+            add_files(capsule, [SimpleUploadedFile('lighthouse.mp4', MP4_HEAD)])
+        self.assertEqual(self._titles('lighthouse'), ['Bulk'])
+
+    def test_capsule_is_reindexed_once_per_transaction(self):
+        """Test that content saves index their row and queue the capsule once"""
+        capsule = self._capsule('Album')
+        with mock.patch('capsules.search.index', wraps=search_module.index) as spy:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    for title in ('Beach', 'Harbour', 'Lantern'):
+                        CapsuleContent.objects.create(capsule=capsule, title=title, content_type='image')
+        kinds = [call.args[0] for call in spy.call_args_list]
+        self.assertEqual(kinds.count('content'), 3)
+        self.assertEqual(kinds.count('capsule'), 1)
+        self.assertEqual(self._titles('harbour lantern'), ['Album'])
+
+    def test_only_visible_capsules_match(self):
+        """Test that other users' private capsules are never returned"""
+        self._capsule('Shared secret', creator=self.other, is_public=True)
+        self._capsule('Private secret', creator=self.other)
+        self.assertEqual(self._titles('secret'), ['Shared secret'])
+
+    def test_locked_contents_are_not_searched(self):
+        """Test that contents of locked capsules do not match"""
+        capsule = self._capsule('Sealed', creator=self.other, is_public=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            CapsuleContent.objects.create(capsule=capsule, title='Hidden letter', content_type='document')
+        self.assertEqual(self._titles('letter'), ['Sealed'])
+        TimeCapsule.objects.filter(pk=capsule.pk).update(status='locked')
+        self.assertEqual(self._titles('letter'), [])
+        self.assertEqual(self._titles('sealed'), ['Sealed'])
+
+    @override_settings(CAPSULES_SEARCH_BACKEND='capsules.search.SearchBackend')
+    def test_fallback_backend(self):
+        """Test that the index-free backend applies the same matching rules"""
+        capsule = self._capsule('Fallback')
+        CapsuleContent.objects.create(capsule=capsule, title='Postcard', content_type='image')
+        self.assertEqual(self._titles('postcard fall'), ['Fallback'])
+        self.assertEqual(self._titles('postcard wedding'), [])
+
+    def test_search_view(self):
+        """Test that the search page lists the matches"""
+        capsule = self._capsule('Findable')
+        response = self.client.get(reverse('capsules:capsule_search'), {'q': 'findable'})
+        self.assertContains(response, reverse('capsules:capsule_detail', args=[capsule.pk]))
+        response = self.client.get(reverse('capsules:capsule_search'), {'q': 'nothing'})
+        self.assertContains(response, 'No capsules match')
+
+    def test_admin_search_uses_index(self):
+        """Test that the admin search box returns ranked index matches"""
+        User.objects.create_superuser(username='admin', email='admin@example.com', password='adminpass123')
+        self.client.login(username='admin', password='adminpass123')
+        self._capsule('Mentions', 'Some travel notes')
+        self._capsule('Travel', 'Elsewhere')
+        self._capsule('Unrelated')
+        response = self.client.get(reverse('admin:capsules_timecapsule_changelist'), {'q': 'travel'})
+        self.assertEqual(
+            [c.title for c in response.context['cl'].result_list],
+            ['Travel', 'Mentions'],
+        )
+        response = self.client.get(reverse('admin:capsules_capsulecontent_changelist'), {'q': 'travel'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_search_finds_related_rows(self):
+        """Test that the admin finds capsules by username and contents by capsule title"""
+        User.objects.create_superuser(username='admin', email='admin@example.com', password='adminpass123')
+        self.client.login(username='admin', password='adminpass123')
+        capsule = self._capsule('Harbour walk', creator=self.other)
+        self._capsule('Unrelated')
+        with self.captureOnCommitCallbacks(execute=True):
+            content = CapsuleContent.objects.create(capsule=capsule, title='Photo', content_type='image')
+        response = self.client.get(reverse('admin:capsules_timecapsule_changelist'), {'q': 'OtherUser'})
+        self.assertEqual(list(response.context['cl'].result_list), [capsule])
+        response = self.client.get(reverse('admin:capsules_capsulecontent_changelist'), {'q': 'harbour'})
+        self.assertEqual(list(response.context['cl'].result_list), [content])
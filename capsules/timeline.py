@@ -0,0 +1,143 @@
+"""Incrementally maintained feed of recently unlocked public capsules.
+
+Listing public capsules by unlock date straight from the capsules table
+scans and sorts every public capsule. Instead each public capsule gets a
+PublicTimelineEntry when it unlocks, and the feed is a keyset-paginated
+range scan over that table alone:
+
+- :func:`add_unlocked` is called by the unlock sweeper for the capsules it
+  unlocks (its queryset updates send no signals); the Procfile's ``clock``
+  process sweeps every minute, so the feed trails unlock dates by at most
+  that much
+- :func:`sync_timeline_entry` runs after every capsule save, adding the
+  entry of a capsule that is public and unlocked (created unlocked, made
+  public later, edited) and removing it otherwise (made private, locked
+  again)
+- Deleting a capsule deletes its entry through the cascade
+
+Rendered pages are cached under a feed version::
+
+    capsules:timeline:<version>:<page size>:<cursor>
+
+Every change to the timeline sets a new version once its transaction
+commits, so a read costs two cache lookups however many public capsules
+there are, and the database is only queried for the first read of a page
+after a change. Entries live for ``CAPSULES_TIMELINE_CACHE_TIMEOUT``
+seconds.
+"""
+
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import PublicTimelineEntry, TimeCapsule
+from .pagination import DEFAULT_PAGE_SIZE, paginate_keyset
+
+DEFAULT_TIMEOUT = 3600
+
+VERSION_KEY = 'capsules:timeline:version'
+
+
+def feed_version():
+    """The current version of the feed, created on first use."""
+    return cache.get_or_set(VERSION_KEY, lambda: uuid.uuid4().hex, timeout=None)
+
+
+def invalidate():
+    """Give the feed a new version once the current transaction commits."""
+    transaction.on_commit(lambda: cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=None))
+
+
+def _page_key(version, cursor, page_size):
+    digest = hashlib.sha256((cursor or '').encode()).hexdigest()[:32]
+    return f'capsules:timeline:{version}:{page_size}:{digest}'
+
+
+def _load_page(cursor, page_size):
+    page = paginate_keyset(
+        PublicTimelineEntry.objects.select_related('capsule__creator'),
+        cursor=cursor,
+        page_size=page_size,
+        field='unlocked_at',
+    )
+    return {
+        'entries': [
+            {
+                'id': entry.capsule_id,
+                'title': entry.capsule.title,
+                'description': entry.capsule.description,
+                'creator': entry.capsule.creator.username,
+                'unlocked_at': entry.unlocked_at,
+            }
+            for entry in page.items
+        ],
+        'next_cursor': page.next_cursor,
+    }
+
+
+def feed_page(cursor=None, page_size=None):
+    """
+    Return one page of the public feed, newest unlock first.
+
+    Args:
+        cursor: Cursor of the previous page, or None for the first page
+        page_size: Maximum number of entries, defaults to CAPSULES_PAGE_SIZE
+
+    Returns:
+        dict: ``entries`` (dicts with the capsule's ``id``, ``title``,
+        ``description``, ``creator`` and ``unlocked_at``) and
+        ``next_cursor`` (None on the last page)
+    """
+    page_size = page_size or getattr(settings, 'CAPSULES_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    # Read the version first: a page built from older rows is then stored
+    # under a version that is already being replaced
+    key = _page_key(feed_version(), cursor, page_size)
+    page = cache.get(key)
+    if page is None:
+        page = _load_page(cursor, page_size)
+        cache.set(key, page, getattr(settings, 'CAPSULES_TIMELINE_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    return page
+
+
+def add_unlocked(pks):
+    """
+    Append the public capsules among ``pks`` that are now unlocked.
+
+    Args:
+        pks: Primary keys of capsules that were just unlocked
+
+    Returns:
+        int: Number of capsules considered for the feed
+    """
+    rows = (
+        TimeCapsule.objects.filter(pk__in=pks, is_public=True, status='unlocked')
+        .values_list('pk', 'unlock_date')
+    )
+    entries = [PublicTimelineEntry(capsule_id=pk, unlocked_at=unlock_date) for pk, unlock_date in rows]
+    if entries:
+        PublicTimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+        invalidate()
+    return len(entries)
+
+
+def sync_timeline_entry(sender, instance, raw=False, **kwargs):
+    """post_save receiver adding or removing a saved capsule's entry."""
+    if raw:
+        return
+    if instance.is_public and instance.effective_status == 'unlocked':
+        PublicTimelineEntry.objects.update_or_create(
+            capsule_id=instance.pk, defaults={'unlocked_at': instance.unlock_date}
+        )
+        # Title or description may have changed as well
+        invalidate()
+    else:
+        # Removal invalidates through timeline_entry_deleted
+        PublicTimelineEntry.objects.filter(capsule_id=instance.pk).delete()
+
+
+def timeline_entry_deleted(sender, instance, **kwargs):
+    """post_delete receiver invalidating the feed, also for cascades."""
+    invalidate()
@@ -0,0 +1,286 @@
+"""Chunked, resumable uploads.
+
+Large files (videos from phones in particular) are uploaded as a sequence
+of fixed-size chunks instead of one multipart request:
+
+1. ``POST capsule/<pk>/uploads/`` opens an :class:`UploadSession` and
+   returns its id, URL and chunk size.
+2. ``PUT uploads/<id>/?offset=<n>`` sends the chunk starting at byte ``n``.
+   The chunk is streamed from the request into a temporary file and then
+   appended to the partial file, so neither the chunk nor the file is ever
+   held in memory.
+3. ``GET uploads/<id>/`` reports how many bytes were acknowledged; an
+   interrupted upload resumes from there.
+4. ``POST uploads/<id>/complete/`` validates the metadata with
+   CapsuleContentForm and creates the CapsuleContent from the temp file.
+
+Settings:
+
+- ``CAPSULES_UPLOAD_CHUNK_SIZE``: chunk size handed to clients
+- ``CAPSULES_MAX_UPLOAD_SIZE``: largest file accepted
+- ``CAPSULES_UPLOAD_TEMP_DIR``: where partial uploads are kept; a volume
+  shared by all web processes lets uploads survive restarts and spread
+  across them, otherwise a session whose file is gone restarts at 0
+- ``CAPSULES_UPLOAD_SESSION_TTL``: seconds of inactivity before a session
+  is purged by ``manage.py purge_uploads``
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+
+from .models import UploadSession
+from .sniffing import SNIFF_BYTES, sniff
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 5 * 1024 * 1024
+DEFAULT_MAX_UPLOAD_SIZE = 1024 * 1024 * 1024
+DEFAULT_SESSION_TTL = 24 * 60 * 60
+
+# Bytes copied from the request per read
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """
+    Raised when a chunk or upload cannot be accepted.
+
+    Attributes:
+        status: HTTP status the error should be reported with
+        offset: Bytes acknowledged so far, if known
+    """
+    status = 400
+
+    def __init__(self, message, offset=None):
+        super().__init__(message)
+        self.offset = offset
+
+
+class OffsetMismatch(UploadError):
+    """Raised when a chunk does not start where the previous one ended."""
+    status = 409
+
+
+def chunk_size():
+    """Chunk size handed to new upload sessions."""
+    return getattr(settings, 'CAPSULES_UPLOAD_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+def max_upload_size():
+    """Largest file, in bytes, that may be uploaded."""
+    return getattr(settings, 'CAPSULES_MAX_UPLOAD_SIZE', DEFAULT_MAX_UPLOAD_SIZE)
+
+
+def temp_dir():
+    """Directory holding the partial files of open sessions."""
+    return getattr(
+        settings,
+        'CAPSULES_UPLOAD_TEMP_DIR',
+        os.path.join(tempfile.gettempdir(), 'capsule_uploads'),
+    )
+
+
+def temp_path(session):
+    """Path of the partial file of ``session``."""
+    return os.path.join(temp_dir(), f'{session.pk}.part')
+
+
+def start_upload(user, capsule, filename, mime_type, size):
+    """
+    Open an upload session.
+
+    Args:
+        user: The uploading user
+        capsule: The capsule the file is for
+        filename: Original file name
+        mime_type: MIME type reported by the client
+        size: Total size of the file in bytes
+
+    Returns:
+        UploadSession: The new session
+
+    Raises:
+        UploadError: If the size is missing or over CAPSULES_MAX_UPLOAD_SIZE
+    """
+    if size <= 0:
+        raise UploadError("The file is empty.")
+    if size > max_upload_size():
+        raise UploadError(f"File size must be under {filesizeformat(max_upload_size())}.")
+    session = UploadSession.objects.create(
+        user=user,
+        capsule=capsule,
+        filename=os.path.basename(filename)[:255] or 'upload',
+        mime_type=mime_type[:100] or 'application/octet-stream',
+        size=size,
+        chunk_size=min(chunk_size(), size),
+    )
+    os.makedirs(temp_dir(), exist_ok=True)
+    # Create the file up front so chunk writes can always open it for update
+    open(temp_path(session), 'wb').close()
+    logger.info("Started upload %s of %s (%s bytes)", session.pk, session.filename, size)
+    return session
+
+
+def _receive(stream, chunk, length, sniff_head):
+    """Copy up to ``length`` bytes into ``chunk``; returns (head, missing)."""
+    remaining = length
+    head = b''
+    while remaining:
+        data = stream.read(min(COPY_BUFFER_SIZE, remaining))
+        if not data:
+            break
+        if sniff_head and len(head) < SNIFF_BYTES:
+            head += data[:SNIFF_BYTES - len(head)]
+        chunk.write(data)
+        remaining -= len(data)
+    return head, remaining
+
+
+def _check_chunk(session, offset, length):
+    if offset != session.received:
+        raise OffsetMismatch(
+            f"Expected a chunk at offset {session.received}.", offset=session.received
+        )
+    if length <= 0 or length > session.chunk_size or offset + length > session.size:
+        raise UploadError("Invalid chunk length.", offset=session.received)
+
+
+def _reset(session):
+    """Start a session over whose partial file is gone (restart, other dyno)."""
+    session.received = 0
+    session.save(update_fields=['received', 'updated_at'])
+    logger.warning("Partial file of upload %s is gone; restarting it", session.pk)
+    return OffsetMismatch(
+        "The partial upload was lost; send the file again from the start.", offset=0
+    )
+
+
+def write_chunk(session, offset, stream, length):
+    """
+    Append one chunk read from ``stream`` to the partial file.
+
+    The chunk is first received into a file of its own, without holding
+    any lock, however slowly the client sends it. The session row is then
+    locked only to check the offset again and append the chunk, so
+    concurrent retries of the same chunk cannot interleave. A chunk is
+    acknowledged only once all of its bytes are in the partial file.
+
+    The partial file lives on local disk, so it is gone after a restart or
+    when the chunk reaches another process; the session then starts over
+    at offset 0 and the client is told to resend from there.
+
+    The head of the first chunk is sniffed for the file's real type, so
+    unsupported files are refused before the rest is sent.
+
+    Args:
+        session: The upload session
+        offset: Byte offset the chunk starts at
+        stream: File-like object to read the chunk from (e.g. the request)
+        length: Number of bytes in the chunk
+
+    Returns:
+        int: Bytes acknowledged after this chunk
+
+    Raises:
+        OffsetMismatch: If ``offset`` is not the next expected byte, or
+            the partial file was lost (offset 0)
+        UploadError: If the chunk is too large, arrived incomplete, or
+            starts a file of an unsupported type
+    """
+    session = UploadSession.objects.get(pk=session.pk)
+    _check_chunk(session, offset, length)
+    os.makedirs(temp_dir(), exist_ok=True)
+    with tempfile.TemporaryFile(dir=temp_dir()) as chunk:
+        head, missing = _receive(stream, chunk, length, sniff_head=offset == 0)
+        if missing:
+            raise UploadError("The chunk arrived incomplete.", offset=session.received)
+        if offset == 0:
+            sniffed = sniff(head)
+            if not sniffed.is_supported:
+                raise UploadError(f"Unsupported file type ({sniffed.mime_type}).", offset=0)
+            session.mime_type = sniffed.mime_type
+
+        lost = None
+        with transaction.atomic():
+            locked = UploadSession.objects.select_for_update().get(pk=session.pk)
+            # A concurrent retry may have appended this chunk meanwhile
+            _check_chunk(locked, offset, length)
+            try:
+                # The first chunk (re)creates the file
+                with open(temp_path(session), 'wb' if offset == 0 else 'r+b') as partial:
+                    partial.seek(offset)
+                    chunk.seek(0)
+                    shutil.copyfileobj(chunk, partial, COPY_BUFFER_SIZE)
+                    # Drop any bytes left behind by an earlier, interrupted attempt
+                    partial.truncate()
+            except FileNotFoundError:
+                lost = _reset(locked)
+            else:
+                locked.received = offset + length
+                locked.mime_type = session.mime_type
+                locked.save(update_fields=['received', 'mime_type', 'updated_at'])
+        if lost:
+            raise lost
+    return locked.received
+
+
+def open_upload(session):
+    """
+    Open the received file of a complete session.
+
+    Returns:
+        UploadedFile: The file, usable wherever a form upload is expected
+
+    Raises:
+        UploadError: If bytes are still missing, or the partial file was
+            lost and the session restarted (offset 0)
+    """
+    if not session.is_complete:
+        raise UploadError("The upload is not complete.", offset=session.received)
+    try:
+        fileobj = open(temp_path(session), 'rb')
+    except FileNotFoundError:
+        raise _reset(session)
+    return UploadedFile(
+        file=fileobj,
+        name=session.filename,
+        content_type=session.mime_type,
+        size=session.size,
+    )
+
+
+def discard_upload(session):
+    """Delete a session together with its partial file."""
+    try:
+        os.remove(temp_path(session))
+    except FileNotFoundError:
+        pass
+    session.delete()
+
+
+def purge_stale_uploads(now=None):
+    """
+    Discard sessions without activity for CAPSULES_UPLOAD_SESSION_TTL seconds.
+
+    Args:
+        now: Reference time, defaults to the current time
+
+    Returns:
+        int: Number of sessions discarded
+    """
+    ttl = getattr(settings, 'CAPSULES_UPLOAD_SESSION_TTL', DEFAULT_SESSION_TTL)
+    cutoff = (now or timezone.now()) - timedelta(seconds=ttl)
+    count = 0
+    for session in UploadSession.objects.filter(updated_at__lt=cutoff).iterator():
+        discard_upload(session)
+        count += 1
+    return count
@@ -1,35 +1,66 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, async_views, events, views
 
 """
 URL configuration for the capsules app.
 
 This module defines all URL patterns for the time capsule functionality:
-- Home page
-- Capsule CRUD operations (Create, Read, Update, Delete)
-- Capsule content management
-- File serving with access control
+- Home page, the public capsule feed and search
+- Capsule CRUD operations (Create, Read, Update, Delete) and bulk imports
+- Capsule content management, including chunked uploads
+- File serving with access control and signed delivery URLs
+- ZIP export of a capsule's files
+- The JSON API (capsules.api)
+- Server-sent capsule status events (capsules.events)
 """
 
 app_name = 'capsules'
 
+# The busiest views have native async versions for the ASGI deployment
+fast_views = async_views if getattr(settings, 'CAPSULES_ASYNC_VIEWS', False) else views
+
 urlpatterns = [
     # Core pages
     path('', views.home, name='home'),
-    path('capsules/', views.capsule_list, name='capsule_list'),
+    path('capsules/', fast_views.capsule_list, name='capsule_list'),
+    path('public/', views.public_feed, name='public_feed'),
+    path('search/', views.capsule_search, name='capsule_search'),
     
     # Capsule management
     path('capsule/create/', views.capsule_create, name='capsule_create'),
-    path('capsule/<int:pk>/', views.capsule_detail, name='capsule_detail'),
+    path('capsule/import/', views.capsule_import, name='capsule_import'),
+    path('imports/<uuid:import_id>/', views.import_status, name='import_status'),
+    path('capsule/<int:pk>/', fast_views.capsule_detail, name='capsule_detail'),
     path('capsule/<int:pk>/edit/', views.capsule_edit, name='capsule_edit'),
     path('capsule/<int:pk>/delete/', views.capsule_delete, name='capsule_delete'),
     path('capsule/<int:pk>/lock/', views.capsule_lock, name='capsule_lock'),
+    path('capsule/<int:pk>/export/', views.capsule_export, name='capsule_export'),
     
     # Content management
     path('capsule/<int:pk>/add-content/', views.content_add, name='content_add'),
+    path('capsule/<int:pk>/add-files/', views.content_add_many, name='content_add_many'),
     path('content/<int:pk>/edit/', views.content_edit, name='content_edit'),
     path('content/<int:pk>/delete/', views.content_delete, name='content_delete'),
     
+    # Chunked, resumable uploads
+    path('capsule/<int:pk>/uploads/', views.upload_start, name='upload_start'),
+    path('uploads/<uuid:upload_id>/', views.upload_session, name='upload_session'),
+    path('uploads/<uuid:upload_id>/complete/', views.upload_complete, name='upload_complete'),
+    
     # File serving
-    path('content/<int:content_id>/file/', views.serve_protected_file, name='serve_protected_file'),
+    path('content/<int:content_id>/file/', fast_views.serve_protected_file, name='serve_protected_file'),
+    path('files/<str:token>/', views.deliver_file, name='deliver_file'),
+    
+    # Status events
+    path('events/', events.capsule_events, name='capsule_events'),
+    
+    # JSON API
+    path('api/capsules/', api.capsules, name='api_capsules'),
+    path('api/capsules/<int:pk>/', api.capsule, name='api_capsule'),
+    path('api/capsules/<int:pk>/lock/', api.capsule_lock, name='api_capsule_lock'),
+    path('api/capsules/<int:pk>/contents/', api.capsule_contents, name='api_capsule_contents'),
+    path('api/contents/', api.contents, name='api_contents'),
+    path('api/contents/<int:pk>/', api.content, name='api_content'),
+    path('api/contents/<int:pk>/file/', api.content_file, name='api_content_file'),
 ]
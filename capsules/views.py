@@ -1,14 +1,39 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone
-from django.http import HttpResponseForbidden, FileResponse
+from django.http import Http404, HttpResponse, HttpResponseForbidden, FileResponse, JsonResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
 from django.db.models import Q
 from django.core.exceptions import PermissionDenied
-from .models import TimeCapsule, CapsuleContent
-from .forms import TimeCapsuleForm, CapsuleContentForm
+from django.views.decorators.http import require_http_methods, require_POST
+from .derivatives import derivative_refs, fallback_url, srcset
+from .deletion import delete_capsule
+from .delivery import InvalidDeliveryToken, delivery_url, delivery_urls, read_token
+from .export import archive_name, export_entries, stream_zip
+from .fragments import cached_fragments
+from .instrumentation import track_storage
+from .models import TimeCapsule, CapsuleContent, ImportJob, UploadSession
+from .bulk import add_files
+from .forms import TimeCapsuleForm, CapsuleContentForm, CapsuleContentBulkForm, CapsuleImportForm
+from .imports import ImportSourceError, enqueue_import, start_import, store_archive
+from .pagination import DEFAULT_PAGE_SIZE, paginate_keyset
+from .storage import get_content_storage, guess_content_type, split_ref
+from .streaming import stream_file
+from .search import search_capsules
+from .timeline import feed_page
+from .pipeline import adopt_file, enqueue_upload, save_pending
+from .uploads import UploadError, discard_upload, open_upload, start_upload, temp_path, write_chunk
 import cloudinary
 from cloudinary.uploader import upload
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
 
 def home(request):
     """
@@ -25,40 +50,95 @@ def home(request):
 @login_required
 def capsule_list(request):
     """
-    Display a list of user's time capsules and handle automatic unlocking.
+    Display one page of the user's time capsules.
     
     This view:
-    1. Retrieves all capsules for the current user
-    2. Checks each capsule to see if it should be unlocked
-    3. Notifies the user if any capsules were unlocked
+    1. Retrieves a keyset-paginated page of the current user's capsules,
+       with their current status and version only
+    2. Reads the cached card of every capsule in one batch
+    3. Renders the missing cards from the capsules' content counts and
+       cover images, loaded in one query
+    4. Returns only the card markup for infinite-scroll requests
+    
+    Due capsules are shown as unlocked without writing to the database;
+    the unlock sweeper persists the transition separately.
     
     Args:
         request: The HTTP request
         
     Returns:
-        HttpResponse: Rendered template with list of capsules
+        HttpResponse: Rendered template with a page of capsules
+    """
+    now = timezone.now()
+    page = paginate_keyset(
+        _list_queryset(request.user, now),
+        cursor=request.GET.get('cursor'),
+        page_size=getattr(settings, 'CAPSULES_PAGE_SIZE', DEFAULT_PAGE_SIZE),
+    )
+
+    def render_cards(pks):
+        return {
+            capsule.pk: render_to_string('capsules/_capsule_card.html', {'capsule': capsule})
+            for capsule in _prepare_cards(pks, now)
+        }
+
+    cards = cached_fragments(
+        'card', request.user, [(c.pk, c) for c in page.items], render_cards, now
+    )
+    context = {'capsules': page.items, 'cards': cards, 'page': page}
+    
+    # Infinite scroll asks for the next batch of cards only
+    if request.GET.get('fragment'):
+        return render(request, 'capsules/_capsule_cards.html', context)
+    return render(request, 'capsules/capsule_list.html', context)
+
+@login_required
+def public_feed(request):
     """
-    print("\n=== Checking Capsules for Unlocking ===")
-    capsules = TimeCapsule.objects.filter(creator=request.user).order_by('-created_at')
-    print(f"Found {capsules.count()} capsules")
+    Display one page of the recently unlocked public capsules.
     
-    # Check each locked capsule if it should be unlocked
-    unlocked_any = False
-    for capsule in capsules:
-        print(f"\nProcessing capsule: {capsule.title}")
-        print(f"Current status: {capsule.status}")
-        if capsule.check_and_unlock():
-            print("Capsule was unlocked!")
-            unlocked_any = True
-        else:
-            print("Capsule remains in current status")
+    Pages come from the cached public timeline (see capsules.timeline),
+    so the feed costs no database query until it changes.
+    
+    Args:
+        request: The HTTP request
+        
+    Returns:
+        HttpResponse: Rendered template with a page of the feed
+    """
+    page = feed_page(cursor=request.GET.get('cursor'))
+    context = {'entries': page['entries'], 'next_cursor': page['next_cursor']}
+    
+    # Infinite scroll asks for the next batch of entries only
+    if request.GET.get('fragment'):
+        return render(request, 'capsules/_public_entries.html', context)
+    return render(request, 'capsules/public_feed.html', context)
+
+@login_required
+def capsule_search(request):
+    """
+    Search the capsules the user may view.
     
-    if unlocked_any:
-        messages.success(request, 'One or more of your time capsules have been unlocked!')
-        # Refresh the queryset to get updated status
-        capsules = TimeCapsule.objects.filter(creator=request.user).order_by('-created_at')
+    Matches titles and descriptions of capsules and of their contents
+    through the full-text index (see capsules.search), best match first;
+    the contents of locked capsules are not searched.
     
-    return render(request, 'capsules/capsule_list.html', {'capsules': capsules})
+    Args:
+        request: The HTTP request
+        
+    Returns:
+        HttpResponse: Rendered template with the best matches
+    """
+    query = request.GET.get('q', '').strip()
+    capsules = []
+    if query:
+        limit = getattr(settings, 'CAPSULES_SEARCH_MAX_RESULTS', 50)
+        capsules = list(
+            search_capsules(request.user, query)
+            .with_effective_status()
+            .select_related('creator')[:limit]
+        )
+    return render(request, 'capsules/capsule_search.html', {'query': query, 'capsules': capsules})
 
 @login_required
 def capsule_create(request):
@@ -94,6 +174,191 @@ def capsule_create(request):
         'title': 'Create time capsule'
     })
 
+@login_required
+def capsule_import(request):
+    """
+    Import an uploaded ZIP file of many files into a new time capsule.
+    
+    This view:
+    1. Validates the archive and the optional capsule fields
+    2. Creates the capsule from the form and the archive's manifest
+    3. Imports the files in the background (see capsules.imports)
+    
+    Args:
+        request: The HTTP request
+        
+    Returns:
+        HttpResponse: 202 with the import state as JSON when requested with
+        ``Accept: application/json``, otherwise a redirect to the new
+        capsule, or the form with errors
+    """
+    wants_json = 'application/json' in request.headers.get('Accept', '')
+    
+    if request.method == 'POST':
+        form = CapsuleImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            archive = form.cleaned_data['archive']
+            path = store_archive(archive)
+            try:
+                job = start_import(
+                    request.user,
+                    path,
+                    name=archive.name,
+                    uploaded=True,
+                    title=form.cleaned_data['title'],
+                    description=form.cleaned_data['description'],
+                    unlock_date=form.cleaned_data['unlock_date'],
+                    is_public=form.cleaned_data['is_public'] or None,
+                )
+            except ImportSourceError as e:
+                os.remove(path)
+                form.add_error(None, str(e))
+            else:
+                enqueue_import(job)
+                if wants_json:
+                    return JsonResponse(_import_state(job), status=202)
+                messages.success(request, f'Importing {job.total} files in the background.')
+                return redirect('capsules:capsule_detail', pk=job.capsule_id)
+        if wants_json:
+            return JsonResponse({'errors': form.errors}, status=400)
+    else:
+        form = CapsuleImportForm()
+    
+    return render(request, 'capsules/capsule_import_form.html', {
+        'form': form,
+        'title': 'Import capsule'
+    })
+
+def _import_state(job):
+    """JSON description of an import job for the client."""
+    return {
+        'import_id': str(job.pk),
+        'status_url': reverse('capsules:import_status', args=[job.pk]),
+        'capsule_url': reverse('capsules:capsule_detail', args=[job.capsule_id]),
+        'status': job.status,
+        'total': job.total,
+        'position': job.position,
+        'imported': job.imported,
+        'failures': job.failures,
+        'files_per_second': job.files_per_second,
+        'bytes_per_second': job.bytes_per_second,
+        'error': job.error,
+    }
+
+@login_required
+def import_status(request, import_id):
+    """
+    Report the progress of an import.
+    
+    Args:
+        request: The HTTP request
+        import_id: UUID of the import job
+        
+    Returns:
+        JsonResponse: The import state
+        
+    Raises:
+        Http404: If the job doesn't exist or belongs to another user
+    """
+    job = get_object_or_404(ImportJob, pk=import_id, user=request.user)
+    return JsonResponse(_import_state(job))
+
+def _list_queryset(user, now):
+    """The user's capsules, with only what the list needs before caching."""
+    return (
+        TimeCapsule.objects
+        .filter(creator=user)
+        .with_effective_status(now)
+        .only('created_at', 'unlock_date', 'status', 'version')
+    )
+
+def _card_queryset(pks, now):
+    """The capsules whose list cards must be rendered, with their card data."""
+    return TimeCapsule.objects.filter(pk__in=pks).with_effective_status(now).with_card_data()
+
+def _cover_refs(capsules):
+    """Storage references of the cover images that may be shown."""
+    visible = [capsule for capsule in capsules if not capsule.is_locked]
+    return (
+        [capsule.cover_file for capsule in visible]
+        + [ref for capsule in visible for ref in derivative_refs(capsule.cover_derivatives)]
+    )
+
+def _set_covers(capsules, covers):
+    """Set ``cover_url`` and ``cover_srcset`` from signed delivery URLs."""
+    for capsule in capsules:
+        capsule.cover_url = capsule.cover_srcset = None
+        if not capsule.is_locked:
+            capsule.cover_url = (fallback_url(capsule.cover_derivatives, covers)
+                                 or covers.get(capsule.cover_file))
+            capsule.cover_srcset = srcset(capsule.cover_derivatives, 'jpeg', covers)
+    return capsules
+
+def _prepare_cards(pks, now):
+    """
+    Load the capsules whose list cards must be rendered.
+    
+    Annotates them with their card data and signs the cover images of all
+    of them in one batch.
+    
+    Args:
+        pks: Primary keys of the capsules
+        now: Reference time for the effective status
+        
+    Returns:
+        list: TimeCapsule instances with ``cover_url`` and ``cover_srcset``
+    """
+    capsules = list(_card_queryset(pks, now))
+    return _set_covers(capsules, delivery_urls(_cover_refs(capsules)))
+
+def _content_refs(capsule, contents):
+    """Storage references of the files and derivatives of ``contents``."""
+    # Locked content is never rendered, so its URLs are not signed at all
+    if capsule.is_locked:
+        return []
+    return (
+        [c.storage_ref for c in contents]
+        + [ref for c in contents for ref in derivative_refs(c.derivatives)]
+    )
+
+def _set_content_urls(contents, urls):
+    """Set the URLs each content item renders from signed delivery URLs."""
+    for content in contents:
+        content.file_url = urls.get(content.storage_ref, '')
+        content.preview_url = fallback_url(content.derivatives, urls) or content.file_url
+        content.srcset_webp = srcset(content.derivatives, 'webp', urls)
+        content.srcset_jpeg = srcset(content.derivatives, 'jpeg', urls)
+    return contents
+
+def _prepare_contents(capsule, contents):
+    """
+    Precompute the values each content item needs to render.
+    
+    Signs the delivery URLs of all files and image derivatives in one
+    batch, so the template never builds a storage URL itself.
+    
+    Args:
+        capsule: The TimeCapsule the contents belong to
+        contents: List of CapsuleContent instances to render
+        
+    Returns:
+        list: CapsuleContent instances with ``file_url``, ``preview_url``,
+        ``srcset_webp`` and ``srcset_jpeg`` attributes
+    """
+    return _set_content_urls(contents, delivery_urls(_content_refs(capsule, contents)))
+
+def _detail_queryset(now):
+    """Capsules as the detail page needs them."""
+    return TimeCapsule.objects.with_effective_status(now).select_related('creator')
+
+def _can_view(user, capsule):
+    """The capsule_detail rule: owners see their capsules, everyone public ones."""
+    return capsule.creator_id == user.pk or capsule.is_public
+
+def _can_access_file(user, capsule):
+    """The serve_protected_file rule, the same as for viewing the capsule."""
+    return _can_view(user, capsule)
+
 @login_required
 def capsule_detail(request, pk):
     """
@@ -101,8 +366,9 @@ def capsule_detail(request, pk):
     
     This view:
     1. Retrieves the capsule and verifies user permission
-    2. Updates capsule status if unlock date has passed
-    3. Shows or hides content based on capsule status
+    2. Computes the capsule status at the current time without saving it
+    3. Shows or hides content based on capsule status, reading each
+       content block from the fragment cache and rendering only misses
     
     Args:
         request: The HTTP request
@@ -115,20 +381,34 @@ def capsule_detail(request, pk):
         Http404: If capsule doesn't exist
         PermissionDenied: If user doesn't have access
     """
-    capsule = get_object_or_404(TimeCapsule, pk=pk)
-    print(f"\n=== Viewing Capsule: {capsule.title} ===")
-    print(f"Current status: {capsule.status}")
-    print(f"Unlock date: {capsule.unlock_date}")
+    now = timezone.now()
+    capsule = get_object_or_404(_detail_queryset(now), pk=pk)
+    logger.debug(
+        "Viewing capsule %s (status=%s, unlock_date=%s)",
+        capsule.pk, capsule.effective_status, capsule.unlock_date
+    )
     
     # Check if user has permission to view this capsule
-    if capsule.creator != request.user and not capsule.is_public:
+    if not _can_view(request.user, capsule):
         return HttpResponseForbidden("You don't have permission to view this capsule.")
     
-    # Check if capsule should be unlocked
-    if capsule.check_and_unlock():
-        messages.success(request, 'Your time capsule has been unlocked!')
-    
-    return render(request, 'capsules/capsule_detail.html', {'capsule': capsule})
+    # The rows are one cheap query; signing and rendering is what the cache saves
+    contents = {content.pk: content for content in capsule.contents.all()}
+
+    def render_blocks(pks):
+        return {
+            content.pk: render_to_string(
+                'capsules/_content_block.html', {'capsule': capsule, 'content': content}
+            )
+            for content in _prepare_contents(capsule, [contents[pk] for pk in pks])
+        }
+
+    return render(request, 'capsules/capsule_detail.html', {
+        'capsule': capsule,
+        'content_blocks': cached_fragments(
+            'content', request.user, [(pk, capsule) for pk in contents], render_blocks, now
+        ),
+    })
 
 @login_required
 def capsule_edit(request, pk):
@@ -156,7 +436,7 @@ def capsule_edit(request, pk):
     if capsule.creator != request.user:
         return HttpResponseForbidden("You don't have permission to edit this capsule.")
     
-    if capsule.status == 'locked':
+    if capsule.is_locked:
         messages.error(request, "You can't edit a locked capsule.")
         return redirect('capsules:capsule_detail', pk=capsule.pk)
     
@@ -181,7 +461,8 @@ def capsule_delete(request, pk):
     
     This view:
     1. Verifies user permission
-    2. Deletes the capsule and all its contents
+    2. Deletes the capsule at once; its contents and files are purged in
+       the background (see capsules.deletion)
     3. Redirects to capsule list
     
     Args:
@@ -201,7 +482,7 @@ def capsule_delete(request, pk):
         return HttpResponseForbidden("You don't have permission to delete this capsule.")
     
     if request.method == 'POST':
-        capsule.delete()
+        delete_capsule(capsule)
         messages.success(request, 'Time capsule deleted successfully!')
         return redirect('capsules:capsule_list')
     
@@ -234,7 +515,7 @@ def capsule_lock(request, pk):
     if capsule.creator != request.user:
         return HttpResponseForbidden("You don't have permission to lock this capsule.")
     
-    if capsule.status == 'locked':
+    if capsule.is_locked:
         messages.error(request, "This capsule is already locked.")
         return redirect('capsules:capsule_detail', pk=capsule.pk)
     
@@ -252,6 +533,8 @@ def content_add(request, pk):
     1. Verifies user permission and capsule status
     2. Handles file upload and metadata
     3. Associates content with capsule
+    4. Leaves the storage upload to the background pipeline, so the
+       response does not wait for it
     
     Args:
         request: The HTTP request
@@ -269,7 +552,7 @@ def content_add(request, pk):
     if capsule.creator != request.user:
         return HttpResponseForbidden("You don't have permission to add content to this capsule.")
     
-    if capsule.status == 'locked':
+    if capsule.is_locked:
         messages.error(request, "You can't add content to a locked capsule.")
         return redirect('capsules:capsule_detail', pk=pk)
     
@@ -279,30 +562,17 @@ def content_add(request, pk):
             content = form.save(commit=False)
             content.capsule = capsule
             
-            # Automatically detect content type from file
+            # Content type detected from the file's magic bytes by the form
             if 'file' in request.FILES:
                 file = request.FILES['file']
-                
-                # Check file mime type
-                if file.content_type.startswith('image/'):
-                    content_type = 'image'
-                elif file.content_type.startswith('video/'):
-                    content_type = 'video'
-                elif file.content_type.startswith('application/') or file.content_type.startswith('text/'):
-                    content_type = 'document'
-                    # Set raw resource type for documents
-                    content.file.options = {
-                        'resource_type': 'raw'
-                    }
-                
-                content.content_type = content_type
-                content.save()
-                messages.success(request, 'Content added successfully!')
+                content.content_type = form.sniffed.content_type
+                save_pending(content, file)
+                messages.success(request, 'Content added! It will appear once the upload finishes.')
                 return redirect('capsules:capsule_detail', pk=pk)
             else:
                 messages.error(request, 'No file was uploaded.')
         else:
-            print("Form errors:", form.errors)
+            logger.info("Content form errors for capsule %s: %s", pk, form.errors.as_json())
             for field, errors in form.errors.items():
                 for error in errors:
                     messages.error(request, f'Error in {field}: {error}')
@@ -315,6 +585,68 @@ def content_add(request, pk):
         'title': 'Add Content'
     })
 
+@login_required
+def content_add_many(request, pk):
+    """
+    Add many files to a time capsule in one request.
+    
+    This view:
+    1. Verifies user permission and capsule status
+    2. Uploads the files to storage concurrently, inferring each title and
+       content type from the file
+    3. Creates all content rows at once and reports the result of every file
+    
+    Args:
+        request: The HTTP request
+        pk: Primary key of the capsule to add content to
+        
+    Returns:
+        HttpResponse: Per-file results as JSON when requested with
+        ``Accept: application/json``, otherwise a redirect to capsule detail
+        on success, or the form with errors
+        
+    Raises:
+        Http404: If capsule doesn't exist
+    """
+    capsule = get_object_or_404(TimeCapsule, pk=pk)
+    wants_json = 'application/json' in request.headers.get('Accept', '')
+    
+    if capsule.creator != request.user:
+        return HttpResponseForbidden("You don't have permission to add content to this capsule.")
+    
+    if capsule.is_locked:
+        if wants_json:
+            return JsonResponse({'error': "You can't add content to a locked capsule."}, status=403)
+        messages.error(request, "You can't add content to a locked capsule.")
+        return redirect('capsules:capsule_detail', pk=pk)
+    
+    if request.method == 'POST':
+        form = CapsuleContentBulkForm(request.POST, request.FILES)
+        if form.is_valid():
+            results = add_files(capsule, form.cleaned_data['files'])
+            added = sum(result.ok for result in results)
+            if wants_json:
+                return JsonResponse(
+                    {'added': added, 'results': [result.as_dict() for result in results]},
+                    status=201 if added else 400,
+                )
+            if added:
+                messages.success(request, f'Added {added} of {len(results)} files.')
+            for result in results:
+                if not result.ok:
+                    messages.error(request, f'{result.name}: {result.error}')
+            return redirect('capsules:capsule_detail', pk=pk)
+        if wants_json:
+            return JsonResponse({'errors': form.errors}, status=400)
+    else:
+        form = CapsuleContentBulkForm()
+    
+    return render(request, 'capsules/content_bulk_form.html', {
+        'form': form,
+        'capsule': capsule,
+        'title': 'Add files'
+    })
+
 @login_required
 def content_edit(request, pk):
     """
@@ -322,7 +654,8 @@ def content_edit(request, pk):
     
     This view:
     1. Verifies user permission and capsule status
-    2. Allows updating content metadata and file
+    2. Allows updating content metadata and file; a new file is uploaded
+       in the background
     3. Preserves existing file if no new file uploaded
     
     Args:
@@ -336,12 +669,12 @@ def content_edit(request, pk):
         Http404: If content doesn't exist
         PermissionDenied: If user doesn't have permission
     """
-    content = get_object_or_404(CapsuleContent, pk=pk)
+    content = get_object_or_404(CapsuleContent.objects.live(), pk=pk)
     
     if content.capsule.creator != request.user:
         return HttpResponseForbidden("You don't have permission to edit this content.")
     
-    if content.capsule.status == 'locked':
+    if content.capsule.is_locked:
         messages.error(request, "You can't edit content in a locked capsule.")
         return redirect('capsules:capsule_detail', pk=content.capsule.pk)
     
@@ -349,21 +682,12 @@ def content_edit(request, pk):
         form = CapsuleContentForm(request.POST, request.FILES, instance=content)
         if form.is_valid():
             try:
-                # Detect content type from file if a new file is uploaded
+                # Content type detected from the new file's magic bytes
                 if 'file' in request.FILES:
-                    file = request.FILES['file']
-                    if file.content_type.startswith('image/'):
-                        form.instance.content_type = 'image'
-                    elif file.content_type.startswith('video/'):
-                        form.instance.content_type = 'video'
-                    elif file.content_type.startswith('application/') or file.content_type.startswith('text/'):
-                        form.instance.content_type = 'document'
-                        # Set raw resource type for documents
-                        form.instance.file.options = {
-                            'resource_type': 'raw'
-                        }
-                
-                form.save()
+                    form.instance.content_type = form.sniffed.content_type
+                    save_pending(form.instance, request.FILES['file'])
+                else:
+                    form.save()
                 messages.success(request, 'Content updated successfully!')
                 return redirect('capsules:capsule_detail', pk=content.capsule.pk)
             except Exception as e:
@@ -399,12 +723,12 @@ def content_delete(request, pk):
         Http404: If content doesn't exist
         PermissionDenied: If user doesn't have permission
     """
-    content = get_object_or_404(CapsuleContent, pk=pk)
+    content = get_object_or_404(CapsuleContent.objects.live(), pk=pk)
     
     if content.capsule.creator != request.user:
         return HttpResponseForbidden("You don't have permission to delete this content.")
     
-    if content.capsule.status == 'locked':
+    if content.capsule.is_locked:
         messages.error(request, "You can't delete content from a locked capsule.")
         return redirect('capsules:capsule_detail', pk=content.capsule.pk)
     
@@ -420,33 +744,261 @@ def serve_protected_file(request, content_id):
     This view:
     1. Verifies user permission and capsule status
     2. Checks if content should be visible
-    3. Serves file securely
+    3. Redirects to a signed, expiring delivery URL for the file
     
     Args:
         request: The HTTP request
         content_id: ID of the content whose file should be served
         
     Returns:
-        FileResponse: The requested file
+        HttpResponseRedirect: Redirect to the file's delivery URL
         
     Raises:
         Http404: If content doesn't exist
         PermissionDenied: If user doesn't have permission
     """
-    content = get_object_or_404(CapsuleContent, pk=content_id)
+    content = get_object_or_404(CapsuleContent.objects.live().select_related('capsule'), pk=content_id)
     capsule = content.capsule
     
     # Check if user has permission to access this content
-    if capsule.creator != request.user and not capsule.is_public:
+    if not _can_access_file(request.user, capsule):
         raise PermissionDenied("You don't have permission to view this content.")
     
     # Check if capsule is locked
-    if capsule.status == 'locked' and not capsule.is_unlockable():
+    if capsule.is_locked:
+        raise PermissionDenied("This content is locked until the capsule's unlock date.")
+    
+    if not content.storage_key:
+        raise Http404("This content has no file.")
+    return redirect(delivery_url(content.storage_ref))
+
+@login_required
+def capsule_export(request, pk):
+    """
+    Download every file of a capsule as one ZIP archive.
+    
+    The archive is streamed while the files are fetched from storage (see
+    capsules.export), so it is never held in memory or on disk. The same
+    rules as for serve_protected_file apply.
+    
+    Args:
+        request: The HTTP request
+        pk: Primary key of the capsule to export
+        
+    Returns:
+        StreamingHttpResponse: The ZIP archive
+        
+    Raises:
+        Http404: If capsule doesn't exist
+        PermissionDenied: If user doesn't have permission or the capsule is locked
+    """
+    capsule = get_object_or_404(_detail_queryset(timezone.now()), pk=pk)
+    if not _can_access_file(request.user, capsule):
+        raise PermissionDenied("You don't have permission to view this content.")
+    if capsule.is_locked:
         raise PermissionDenied("This content is locked until the capsule's unlock date.")
     
+    contents = (
+        capsule.contents.exclude(storage_key='')
+        .filter(upload_status='ready')
+        .select_related('blob')
+    )
+    logger.info("Exporting capsule %s for user %s", capsule.pk, request.user.pk)
+    response = StreamingHttpResponse(
+        stream_zip(export_entries(contents)), content_type='application/zip'
+    )
+    response['Content-Disposition'] = content_disposition_header(True, archive_name(capsule))
+    return response
+
+def deliver_file(request, token):
+    """
+    Deliver a file addressed by a signed delivery token.
+    
+    The token carries the storage reference and its expiry and is verified
+    with an HMAC, so this view needs neither a session nor any database
+    query. Permission checks happen when the token is issued.
+    
+    Files in backends that support streaming (the local filesystem) are
+    streamed with Range and conditional GET support; files in other
+    backends are served by redirecting to the backend's URL.
+    
+    Args:
+        request: The HTTP request
+        token: Signed token produced by capsules.delivery
+        
+    Returns:
+        HttpResponse: The file, or a redirect to the file in storage
+        
+    Raises:
+        Http404: If the token is invalid or expired, or the file is missing
+    """
+    try:
+        ref, expires = read_token(token)
+        backend, key = split_ref(ref)
+        storage = get_content_storage(backend)
+    except (InvalidDeliveryToken, KeyError):
+        raise Http404("This link is invalid or has expired.")
+    
+    cache_control = f'private, max-age={max(int(expires - time.time()), 0)}'
+    if storage.supports_streaming:
+        info = storage.info(key)
+        if info is None:
+            raise Http404("This file no longer exists.")
+        return stream_file(
+            request, storage.path(key), info, guess_content_type(key),
+            cache_control=cache_control,
+        )
+    
+    with track_storage():
+        url = storage.url(key)
+    response = redirect(url)
+    response['Cache-Control'] = cache_control
+    return response
+
+@login_required
+@require_POST
+def upload_start(request, pk):
+    """
+    Open a chunked, resumable upload to a capsule.
+    
+    Expects the form fields ``filename``, ``size`` and ``mime_type``.
+    See capsules.uploads for the protocol.
+    
+    Args:
+        request: The HTTP request
+        pk: Primary key of the capsule the file is for
+        
+    Returns:
+        JsonResponse: 201 with ``upload_id``, ``upload_url``, ``chunk_size``
+        and ``offset``, or 400/403 with an ``error``
+        
+    Raises:
+        Http404: If capsule doesn't exist
+    """
+    capsule = get_object_or_404(TimeCapsule, pk=pk)
+    if capsule.creator_id != request.user.pk:
+        return JsonResponse({'error': "You don't have permission to add content to this capsule."}, status=403)
+    if capsule.is_locked:
+        return JsonResponse({'error': "You can't add content to a locked capsule."}, status=403)
+    
     try:
-        # For Cloudinary files, redirect to the URL
-        return redirect(content.file.url)
-    except Exception as e:
-        messages.error(request, f"Error serving file: {str(e)}")
-        return redirect('capsules:capsule_detail', pk=capsule.pk)
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'error': 'A file size is required.'}, status=400)
+    try:
+        session = start_upload(
+            request.user,
+            capsule,
+            request.POST.get('filename', ''),
+            request.POST.get('mime_type', ''),
+            size,
+        )
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    return JsonResponse(_upload_state(session), status=201)
+
+def _upload_state(session):
+    """JSON description of an upload session for the client."""
+    return {
+        'upload_id': str(session.pk),
+        'upload_url': reverse('capsules:upload_session', args=[session.pk]),
+        'complete_url': reverse('capsules:upload_complete', args=[session.pk]),
+        'chunk_size': session.chunk_size,
+        'size': session.size,
+        'offset': session.received,
+    }
+
+@login_required
+@require_http_methods(['GET', 'PUT', 'DELETE'])
+def upload_session(request, upload_id):
+    """
+    Report, extend or cancel a chunked upload.
+    
+    - GET returns the upload state, including the acknowledged ``offset``
+      to resume from.
+    - PUT with ``?offset=<n>`` writes the request body as the chunk that
+      starts at byte ``n``. The body is streamed to disk, never read into
+      memory as a whole.
+    - DELETE cancels the upload.
+    
+    Args:
+        request: The HTTP request
+        upload_id: UUID of the upload session
+        
+    Returns:
+        JsonResponse: The upload state, or an ``error`` with the offset to
+        resume from (409 when a chunk was sent for the wrong offset)
+        
+    Raises:
+        Http404: If the session doesn't exist or belongs to another user
+    """
+    session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+    
+    if request.method == 'DELETE':
+        discard_upload(session)
+        return HttpResponse(status=204)
+    
+    if request.method == 'PUT':
+        try:
+            offset = int(request.GET.get('offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return JsonResponse({'error': 'A chunk offset is required.', 'offset': session.received}, status=400)
+        try:
+            session.received = write_chunk(session, offset, request, length)
+        except UploadError as e:
+            return JsonResponse({'error': str(e), 'offset': e.offset}, status=e.status)
+    
+    return JsonResponse(_upload_state(session))
+
+@login_required
+@require_POST
+def upload_complete(request, upload_id):
+    """
+    Turn a fully received upload into capsule content.
+    
+    The metadata (``title``, ``description``, ``content_type``) is
+    validated with CapsuleContentForm exactly as for a regular upload,
+    with the received file in place of the multipart one. The file is then
+    moved to the upload pipeline, like a regular upload.
+    
+    Args:
+        request: The HTTP request
+        upload_id: UUID of the upload session
+        
+    Returns:
+        JsonResponse: 201 with ``content_id`` and ``redirect_url``, or an
+        ``error``/``errors`` response
+        
+    Raises:
+        Http404: If the session doesn't exist or belongs to another user
+    """
+    session = get_object_or_404(
+        UploadSession.objects.select_related('capsule'), pk=upload_id, user=request.user
+    )
+    capsule = session.capsule
+    if capsule.is_locked:
+        return JsonResponse({'error': "You can't add content to a locked capsule."}, status=403)
+    
+    try:
+        uploaded_file = open_upload(session)
+    except UploadError as e:
+        return JsonResponse({'error': str(e), 'offset': e.offset}, status=e.status)
+    
+    with uploaded_file:
+        form = CapsuleContentForm(request.POST, {'file': uploaded_file})
+        valid = form.is_valid()
+    if not valid:
+        return JsonResponse({'errors': form.errors}, status=400)
+    content = form.save(commit=False)
+    content.capsule = capsule
+    # The received file is already on disk; hand it to the pipeline as is
+    enqueue_upload(content, adopt_file(temp_path(session)), session.filename)
+    discard_upload(session)
+    
+    logger.info("Completed upload %s as content %s", upload_id, content.pk)
+    messages.success(request, 'Content added successfully!')
+    return JsonResponse({
+        'content_id': content.pk,
+        'redirect_url': reverse('capsules:capsule_detail', args=[capsule.pk]),
+    }, status=201)
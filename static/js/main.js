@@ -2,50 +2,122 @@
  * main.js - Core JavaScript functionality for the Everpast Time Capsule application
  * 
  * This file contains all client-side functionality including:
- * - Countdown timers for time capsules
+ * - Countdown timers and live status updates for time capsules
  * - File upload preview functionality
  * - Form validation
  * - UI enhancements and animations
  */
 
 /**
- * Updates a countdown timer element with time remaining until unlock
- * @param {HTMLElement} element - The DOM element to update
- * @param {string} unlockDate - ISO date string of when the capsule unlocks
+ * Formats the time left until an unlock date
+ * @param {number} timeLeft - Milliseconds until the unlock
+ * @returns {string} e.g. "2d 3h 4m 5s"
  */
-function updateCountdown(element, unlockDate) {
-    const now = new Date().getTime();
-    const unlockTime = new Date(unlockDate).getTime();
-    const timeLeft = unlockTime - now;
-
-    if (timeLeft <= 0) {
-        element.innerHTML = "Unlocked!";
-        element.classList.add("unlocked-animation");
-        return;
-    }
-
+function formatTimeLeft(timeLeft) {
     const days = Math.floor(timeLeft / (1000 * 60 * 60 * 24));
     const hours = Math.floor((timeLeft % (1000 * 60 * 60 * 24)) / (1000 * 60 * 60));
     const minutes = Math.floor((timeLeft % (1000 * 60 * 60)) / (1000 * 60));
     const seconds = Math.floor((timeLeft % (1000 * 60)) / 1000);
-
-    element.innerHTML = `${days}d ${hours}h ${minutes}m ${seconds}s`;
+    return `${days}d ${hours}h ${minutes}m ${seconds}s`;
 }
 
+const STATUS_BADGES = {
+    active: '<span class="badge bg-primary">Active</span>',
+    locked: '<span class="badge bg-danger">Locked</span>',
+    unlocked: '<span class="badge bg-success">Unlocked</span>',
+};
+
 /**
- * Initializes countdown timers for all elements with 'countdown' class
- * Runs when the DOM is fully loaded
+ * Updates every countdown timer on the page
+ * Countdowns that ran out wait for the server to confirm the unlock
+ * instead of guessing it from the client's clock
  */
-document.addEventListener('DOMContentLoaded', function() {
-    const countdownElements = document.querySelectorAll('.countdown');
-    countdownElements.forEach(element => {
-        const unlockDate = element.dataset.unlockDate;
-        if (unlockDate) {
-            updateCountdown(element, unlockDate);
-            setInterval(() => updateCountdown(element, unlockDate), 1000);
+function tickCountdowns() {
+    const now = Date.now();
+    document.querySelectorAll('.countdown[data-unlock-date]').forEach(element => {
+        const status = element.dataset.status;
+        if (status === 'unlocked') {
+            element.textContent = 'Unlocked!';
+            element.classList.add('unlocked-animation');
+            return;
+        }
+        if (status === 'gone') {
+            element.textContent = '';
+            return;
         }
+        const timeLeft = new Date(element.dataset.unlockDate).getTime() - now;
+        element.textContent = timeLeft > 0 ? formatTimeLeft(timeLeft) : 'Unlocking...';
     });
-});
+}
+
+/**
+ * Reloads one section of the current page in place
+ * @param {HTMLElement} section - Element with an id that the page renders again
+ */
+function refreshSection(section) {
+    fetch(window.location.href, { credentials: 'same-origin' })
+        .then(response => response.ok ? response.text() : Promise.reject(response))
+        .then(html => {
+            const fresh = new DOMParser().parseFromString(html, 'text/html').getElementById(section.id);
+            if (fresh) section.replaceWith(fresh);
+        })
+        // The section keeps its old state; the next visit shows the new one
+        .catch(() => {});
+}
+
+/**
+ * Applies a status event pushed by the server to the page
+ * Updates badges and countdowns of the capsule, and reloads sections that
+ * depend on its status (e.g. the contents of the detail page). Those are
+ * spread over a few seconds so that clients watching a popular capsule do
+ * not all hit the server at its unlock time.
+ * @param {Object} event - {id, status, unlock_date}
+ */
+function applyCapsuleStatus(event) {
+    const badge = STATUS_BADGES[event.status];
+    document.querySelectorAll(`[data-capsule-status="${event.id}"]`).forEach(element => {
+        if (badge) element.innerHTML = badge;
+    });
+    document.querySelectorAll(`.countdown[data-capsule-id="${event.id}"]`).forEach(element => {
+        element.dataset.status = event.status;
+        if (event.unlock_date) element.dataset.unlockDate = event.unlock_date;
+    });
+    document.querySelectorAll(`[data-refresh-on-status="${event.id}"]`).forEach(section => {
+        if (!badge || section.dataset.status === event.status) return;
+        section.dataset.status = event.status;
+        setTimeout(() => refreshSection(section), Math.random() * 5000);
+    });
+}
+
+let capsuleEvents = null;
+let countdownTicker = null;
+
+/**
+ * Drives all countdown timers from one shared ticker and keeps capsule
+ * statuses current with server-sent events
+ * Countdowns are elements with the 'countdown' class and data-capsule-id,
+ * data-unlock-date and data-status attributes. One EventSource on the URL
+ * in the body's data-capsule-events-url watches all of their capsules;
+ * call this again after adding countdowns to the page.
+ */
+function watchCapsules() {
+    const countdowns = document.querySelectorAll('.countdown[data-unlock-date]');
+    if (!countdowns.length) return;
+    tickCountdowns();
+    if (!countdownTicker) countdownTicker = setInterval(tickCountdowns, 1000);
+
+    const eventsUrl = document.body.dataset.capsuleEventsUrl;
+    if (!eventsUrl || !window.EventSource) return;
+    const ids = [...new Set(Array.from(countdowns, element => element.dataset.capsuleId))];
+    const url = `${eventsUrl}?ids=${ids.join(',')}`;
+    if (capsuleEvents && capsuleEvents.url.endsWith(url)) return;
+    if (capsuleEvents) capsuleEvents.close();
+    // The browser reconnects on its own whenever the stream ends
+    capsuleEvents = new EventSource(url);
+    capsuleEvents.addEventListener('status', message => applyCapsuleStatus(JSON.parse(message.data)));
+}
+
+document.addEventListener('DOMContentLoaded', watchCapsules);
 
 /**
  * Handles file selection and generates preview for images
@@ -142,3 +214,125 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 });
+
+/**
+ * Loads further pages of capsule cards as the user scrolls.
+ * Each page ends with a sentinel element carrying the URL of the next
+ * fragment; when it scrolls into view it is replaced by that fragment.
+ * @param {HTMLElement} container - The element holding the cards
+ */
+function initInfiniteScroll(container) {
+    if (!container || !('IntersectionObserver' in window)) return;
+
+    const observer = new IntersectionObserver(entries => {
+        entries.forEach(entry => {
+            if (!entry.isIntersecting) return;
+            const sentinel = entry.target;
+            observer.unobserve(sentinel);
+            fetch(sentinel.dataset.nextUrl, { credentials: 'same-origin' })
+                .then(response => response.ok ? response.text() : Promise.reject(response))
+                .then(html => {
+                    sentinel.insertAdjacentHTML('beforebegin', html);
+                    sentinel.remove();
+                    container.querySelectorAll('.capsule-list-sentinel').forEach(el => observer.observe(el));
+                    watchCapsules();
+                })
+                // On failure the sentinel keeps its plain "Load more" link
+                .catch(() => {});
+        });
+    }, { rootMargin: '400px' });
+
+    container.querySelectorAll('.capsule-list-sentinel').forEach(el => observer.observe(el));
+}
+
+/**
+ * Uploads the file of a content form in resumable chunks.
+ * The form needs a data-upload-url attribute pointing at the capsule's
+ * upload endpoint. Each chunk is acknowledged by the server; if the
+ * connection drops, submitting again resumes from the last acknowledged
+ * chunk instead of starting over.
+ * @param {HTMLFormElement} form - The content form
+ */
+function initChunkedUpload(form) {
+    if (!form || !form.dataset.uploadUrl || !window.fetch || !window.localStorage) return;
+
+    const fileInput = form.querySelector('input[type="file"]');
+    const submitBtn = form.querySelector('button[type="submit"]');
+    const csrfToken = form.querySelector('[name="csrfmiddlewaretoken"]').value;
+    const maxRetries = 5;
+
+    const request = (url, options = {}) => fetch(url, {
+        credentials: 'same-origin',
+        ...options,
+        headers: { 'X-CSRFToken': csrfToken, ...(options.headers || {}) },
+    });
+    const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+    const resumeKey = file => `upload:${form.dataset.uploadUrl}:${file.name}:${file.size}:${file.lastModified}`;
+
+    async function openSession(file) {
+        const saved = localStorage.getItem(resumeKey(file));
+        if (saved) {
+            const response = await request(saved);
+            if (response.ok) return response.json();
+            localStorage.removeItem(resumeKey(file));
+        }
+        const body = new FormData();
+        body.append('filename', file.name);
+        body.append('size', file.size);
+        body.append('mime_type', file.type);
+        const response = await request(form.dataset.uploadUrl, { method: 'POST', body });
+        const session = await response.json();
+        if (!response.ok) throw new Error(session.error);
+        localStorage.setItem(resumeKey(file), session.upload_url);
+        return session;
+    }
+
+    async function sendChunks(file, session) {
+        let offset = session.offset;
+        let retries = 0;
+        while (offset < file.size) {
+            submitBtn.textContent = `Uploading... ${Math.floor(offset * 100 / file.size)}%`;
+            try {
+                const chunk = file.slice(offset, offset + session.chunk_size);
+                const response = await request(`${session.upload_url}?offset=${offset}`, {
+                    method: 'PUT',
+                    body: chunk,
+                });
+                const state = await response.json();
+                if (!response.ok && response.status !== 409) throw new Error(state.error);
+                // On 409 the server tells us where to continue from
+                offset = state.offset;
+                retries = 0;
+            } catch (error) {
+                if (++retries > maxRetries) throw error;
+                await sleep(1000 * 2 ** retries);
+            }
+        }
+    }
+
+    form.addEventListener('submit', async function(event) {
+        const file = fileInput && fileInput.files[0];
+        if (!file) return;
+        event.preventDefault();
+
+        try {
+            const session = await openSession(file);
+            await sendChunks(file, session);
+
+            const body = new FormData(form);
+            body.delete(fileInput.name);
+            const response = await request(session.complete_url, { method: 'POST', body });
+            const result = await response.json();
+            if (!response.ok) {
+                const errors = result.errors ? Object.values(result.errors).flat() : [result.error];
+                throw new Error(errors.join(' '));
+            }
+            localStorage.removeItem(resumeKey(file));
+            window.location = result.redirect_url;
+        } catch (error) {
+            alert(`Upload interrupted: ${error.message}. Submit again to resume.`);
+            submitBtn.disabled = false;
+            submitBtn.textContent = 'Add content';
+        }
+    });
+}
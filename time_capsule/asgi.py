@@ -2,6 +2,8 @@
 ASGI config for time_capsule project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+This is how the app is deployed (see Procfile), so that the long-lived
+capsule status streams (capsules.events) do not each hold a worker.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
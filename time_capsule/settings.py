@@ -89,6 +89,14 @@ LOGGING = {
             'handlers': ['console'],
             'level': 'DEBUG',
         },
+        # Application logs, including one line per request from
+        # RequestMetricsMiddleware; set CAPSULES_LOG_LEVEL=WARNING to switch
+        # them (and the request instrumentation) off
+        'capsules': {
+            'handlers': ['console'],
+            'level': os.getenv('CAPSULES_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
     },
 }
 
@@ -118,6 +126,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'capsules.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -274,6 +283,113 @@ LOGOUT_REDIRECT_URL = '/'
 LOGIN_REDIRECT_URL = '/'
 LOGIN_URL = 'account_login'
 
+# Capsule unlock sweeper
+# Run the in-process sweep loop in this process. Set it only on the command
+# line of the web or worker process that should sweep, so manage.py
+# commands, migrations and tests never start the loop.
+CAPSULES_RUN_SWEEPER = os.getenv('CAPSULES_RUN_SWEEPER', 'False') == 'True'
+# Seconds between in-process sweeps; 0 disables the loop and leaves unlocking
+# to the `unlock_capsules` management command (the Procfile's clock process).
+CAPSULES_UNLOCK_SWEEP_INTERVAL = int(os.getenv('CAPSULES_UNLOCK_SWEEP_INTERVAL', '60'))
+
+# Number of capsules per page of the capsule list
+CAPSULES_PAGE_SIZE = 24
+
+# Signed file delivery URLs: lifetime in seconds, and how long before expiry
+# a cached URL stops being handed out
+CAPSULES_DELIVERY_URL_TTL = 3600
+CAPSULES_DELIVERY_URL_MARGIN = 300
+
+# Cached capsule cards and content blocks: seconds an entry may live (capped
+# by the delivery URL margin and the capsule's unlock date), 0 to disable
+CAPSULES_FRAGMENT_CACHE_TIMEOUT = 300
+
+# Cached pages of the public capsule feed: seconds a page may live; pages are
+# replaced as soon as the feed changes anyway
+CAPSULES_TIMELINE_CACHE_TIMEOUT = 3600
+
+# Full-text search: backend (None picks the one for the database vendor, see
+# capsules.search), PostgreSQL text search configuration, and most results
+# listed per query
+CAPSULES_SEARCH_BACKEND = None
+CAPSULES_SEARCH_CONFIG = 'english'
+CAPSULES_SEARCH_MAX_RESULTS = 50
+
+# JSON API: largest page a client may request with ?limit=, and most ids
+# per batch get
+CAPSULES_API_MAX_PAGE_SIZE = 100
+CAPSULES_API_MAX_BATCH = 100
+
+# Serve the capsule list, detail and file views natively async. Off by
+# default, since under wsgi.py every async view needs an event loop of its
+# own; the ASGI deployment turns it on (Procfile).
+CAPSULES_ASYNC_VIEWS = os.getenv('CAPSULES_ASYNC_VIEWS', 'False') == 'True'
+
+# Capsule status events (served through time_capsule.asgi): seconds between
+# status checks of the watched capsules (unlocks are pushed when they happen
+# regardless), lifetime of a stream before the browser reconnects, and most
+# capsules per stream
+CAPSULES_EVENTS_POLL_INTERVAL = 15
+CAPSULES_EVENTS_MAX_AGE = 300
+CAPSULES_EVENTS_MAX_CAPSULES = 100
+
+# Content storage: backend used for new uploads ('cloudinary' or 'local'),
+# and where the local backend keeps its files
+CAPSULES_STORAGE_BACKENDS = {
+    'cloudinary': 'capsules.storage.CloudinaryContentStorage',
+    'local': 'capsules.storage.LocalContentStorage',
+}
+CAPSULES_DEFAULT_STORAGE = os.getenv('CAPSULES_STORAGE', 'cloudinary')
+CAPSULES_LOCAL_STORAGE_ROOT = os.getenv(
+    'CAPSULES_LOCAL_STORAGE_ROOT', os.path.join(MEDIA_ROOT, 'capsule_contents')
+)
+
+# Uploads: largest accepted file, chunk size of resumable uploads, and how
+# long an idle upload session is kept before `purge_uploads` discards it
+CAPSULES_MAX_UPLOAD_SIZE = int(os.getenv('CAPSULES_MAX_UPLOAD_SIZE', str(1024 * 1024 * 1024)))
+CAPSULES_UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+CAPSULES_UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+# Background upload pipeline: storage upload threads per process, attempts
+# per file, the delay before the first retry (doubled on every retry), and
+# seconds after which a still pending upload is taken as lost to a restart
+CAPSULES_UPLOAD_WORKERS = int(os.getenv('CAPSULES_UPLOAD_WORKERS', '4'))
+CAPSULES_UPLOAD_RETRIES = 3
+CAPSULES_UPLOAD_RETRY_DELAY = 2.0
+CAPSULES_UPLOAD_STALE_AFTER = 60 * 60
+
+# Simultaneous storage uploads when many files are added at once
+CAPSULES_BULK_UPLOAD_CONCURRENCY = 4
+
+# Bulk imports: files added per batch, and background imports of uploaded
+# archives per process (0 imports when the upload's transaction commits)
+CAPSULES_IMPORT_BATCH_SIZE = 50
+CAPSULES_IMPORT_WORKERS = int(os.getenv('CAPSULES_IMPORT_WORKERS', '1'))
+
+# Deleted capsules: contents or files handled per purge transaction, purge
+# threads per process (0 leaves it to `purge_deleted`), and attempts and
+# first retry delay (doubled on every retry) for deleting stored files
+CAPSULES_PURGE_BATCH_SIZE = 500
+CAPSULES_PURGE_WORKERS = int(os.getenv('CAPSULES_PURGE_WORKERS', '1'))
+CAPSULES_STORAGE_DELETE_RETRIES = 5
+CAPSULES_STORAGE_DELETE_RETRY_DELAY = 60.0
+
+# ZIP export: files fetched from storage at the same time per download, and
+# size of the chunks read from storage and sent to the client
+CAPSULES_EXPORT_CONCURRENCY = 4
+CAPSULES_EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Hash uploads as they are received, for content-addressed deduplication
+FILE_UPLOAD_HANDLERS = [
+    'capsules.hashing.HashingMemoryFileUploadHandler',
+    'capsules.hashing.HashingTemporaryFileUploadHandler',
+]
+
+# Responsive image derivatives: size name -> longest side in pixels, and
+# processes resizing them (0 resizes in the upload worker thread)
+CAPSULES_IMAGE_SIZES = {'thumb': 320, 'medium': 960, 'large': 1920}
+CAPSULES_DERIVATIVE_WORKERS = int(os.getenv('CAPSULES_DERIVATIVE_WORKERS', '2'))
+
 # Admin configuration
 ADMIN_URL = 'admin/'
 ADMIN_LOGIN_URL = None